@@ -0,0 +1,192 @@
+import os
+import time
+import asyncio
+import contextlib
+from urllib.parse import urlparse
+
+MB = 1024 * 1024
+
+
+def _parse_host_values(text, cast):
+    """Разбирает строку вида "huggingface.co=20,cdn.example.com=5" в словарь"""
+    values = {}
+    for item in (text or "").split(","):
+        host, sep, value = item.partition("=")
+        if sep and host.strip() and value.strip():
+            values[host.strip().lower()] = cast(value.strip())
+    return values
+
+
+class TokenBucket:
+    """
+    Ограничитель скорости (token bucket): rate байт в секунду, запас не больше burst байт.
+
+    Токены могут уходить в минус: прочитанный чанк списывается сразу, а вызывающий ждёт,
+    пока долг не погасится. Поэтому большие чанки не блокируют очередь, а скорость
+    всех потоков вместе не превышает rate.
+    """
+
+    def __init__(self, rate=0):
+        self.rate = 0
+        self.burst = 0
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        self._refill()
+        self.rate = max(0.0, float(rate or 0))
+        # Запас — одна секунда трафика, но не меньше 64 КБ
+        self.burst = max(self.rate, 64 * 1024)
+        self._tokens = min(self._tokens, self.burst) if self.rate else self.burst
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount):
+        """Списывает amount байт и возвращает, сколько секунд нужно подождать"""
+        if not self.rate:
+            return 0.0
+        self._refill()
+        self._tokens -= amount
+        return max(0.0, -self._tokens / self.rate)
+
+
+class BandwidthLimiter:
+    """
+    Общее для всех загрузок ограничение скорости (глобальное и по хостам) и количества
+    одновременных соединений с одним хостом. Лимиты можно менять во время работы.
+
+    Лимит хоста действует и на его поддомены: "huggingface.co" ограничивает и "cdn-lfs.huggingface.co".
+    """
+
+    def __init__(self, rate=0, host_rates=None, max_connections=0, host_connections=None):
+        self._global = TokenBucket(rate)
+        self._host_buckets = {}
+        self.host_rates = {}
+        self.max_connections = 0
+        self.host_connections = {}
+        self._active = {}
+        self._condition = None
+        self.set_limits(rate, host_rates, max_connections, host_connections)
+
+    def _match(self, values, host):
+        """Значение для хоста (или его родительского домена) из словаря лимитов"""
+        # Хост может прийти с портом ("host:8080") — лимиты задаются по имени
+        host = (urlparse(f"//{host}").hostname or "") if host else ""
+        while host:
+            if host in values:
+                return host, values[host]
+            _sub, _dot, host = host.partition(".")
+        return None, None
+
+    def set_limits(self, rate=None, host_rates=None, max_connections=None, host_connections=None):
+        """
+        Меняет лимиты. rate — байт/с для всех загрузок вместе, host_rates — {хост: байт/с},
+        max_connections — соединений на хост, host_connections — {хост: соединений}.
+        Значения хостов добавляются к текущим; 0 или None снимает лимит хоста.
+        """
+        if rate is not None:
+            self._global.set_rate(rate)
+        for host, value in (host_rates or {}).items():
+            host = host.lower()
+            if value:
+                self.host_rates[host] = float(value)
+                self._host_buckets.setdefault(host, TokenBucket()).set_rate(value)
+            else:
+                self.host_rates.pop(host, None)
+                self._host_buckets.pop(host, None)
+        if max_connections is not None:
+            self.max_connections = max(0, int(max_connections))
+        for host, value in (host_connections or {}).items():
+            if value:
+                self.host_connections[host.lower()] = max(1, int(value))
+            else:
+                self.host_connections.pop(host.lower(), None)
+        self._wake()
+
+    def is_limited(self, host):
+        """Ограничена ли скорость загрузки с хоста (глобально или для него)"""
+        return bool(self._global.rate) or self._match(self.host_rates, host)[0] is not None
+
+    async def throttle(self, host, amount):
+        """Учитывает amount полученных байт и при превышении лимита приостанавливает загрузку"""
+        delay = self._global.reserve(amount)
+        matched, _rate = self._match(self.host_rates, host)
+        if matched is not None:
+            delay = max(delay, self._host_buckets[matched].reserve(amount))
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _connection_limit(self, host):
+        matched, limit = self._match(self.host_connections, host)
+        return (matched, limit) if matched is not None else ((host or "").lower(), self.max_connections)
+
+    def _wake(self):
+        """Будит ожидающих соединения после изменения лимитов"""
+        if self._condition is None:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        asyncio.ensure_future(self._notify())
+
+    async def _notify(self):
+        async with self._condition:
+            self._condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def connection(self, host):
+        """Занимает слот соединения с хостом (ждёт, если достигнут лимит)"""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            while True:
+                key, limit = self._connection_limit(host)
+                if not limit or self._active.get(key, 0) < limit:
+                    break
+                await self._condition.wait()
+            self._active[key] = self._active.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._active[key] -= 1
+                if not self._active[key]:
+                    del self._active[key]
+                self._condition.notify_all()
+
+    def to_dict(self):
+        return {
+            "limit_mb": self._global.rate / MB if self._global.rate else 0,
+            "host_limits_mb": {host: rate / MB for host, rate in self.host_rates.items()},
+            "max_connections_per_host": self.max_connections,
+            "host_max_connections": dict(self.host_connections),
+            "active_connections": dict(self._active),
+        }
+
+
+_bandwidth_limiter = None
+
+
+def get_bandwidth_limiter():
+    """
+    Общий ограничитель скорости: PDM_BANDWIDTH_LIMIT_MB (МБ/с на все загрузки),
+    PDM_HOST_BANDWIDTH_LIMITS_MB ("хост=МБ/с,..."), PDM_MAX_CONNECTIONS_PER_HOST и PDM_HOST_MAX_CONNECTIONS ("хост=N,...")
+    """
+    global _bandwidth_limiter
+    if _bandwidth_limiter is None:
+        _bandwidth_limiter = BandwidthLimiter(
+            rate=float(os.environ.get("PDM_BANDWIDTH_LIMIT_MB", "0")) * MB,
+            host_rates={
+                host: value * MB
+                for host, value in _parse_host_values(os.environ.get("PDM_HOST_BANDWIDTH_LIMITS_MB"), float).items()
+            },
+            max_connections=int(os.environ.get("PDM_MAX_CONNECTIONS_PER_HOST", "0")),
+            host_connections=_parse_host_values(os.environ.get("PDM_HOST_MAX_CONNECTIONS"), int),
+        )
+    return _bandwidth_limiter
@@ -0,0 +1,366 @@
+"""
+Локальный сервер, имитирующий HuggingFace Hub и CDN, для бенчмарков и ручной проверки без сети.
+
+Что умеет:
+  GET  /api/models                              поиск (search, limit)
+  GET  /api/models/{repo}[/revision/{rev}]      метаданные репозитория (siblings с размерами и LFS SHA-256)
+  HEAD/GET /{repo}/resolve/{rev}/{path}         302 на /cdn/{sha256} с заголовками X-Repo-Commit/X-Linked-*
+  HEAD/GET /cdn/{sha256}                        содержимое файла (Range, If-Range, ETag)
+  HEAD/GET /files/{name}                        прямые ссылки (как у CivitAI и других сайтов)
+  HEAD/GET /redirect/{name}                     302 на /files/{name}
+
+Содержимое файлов генерируется на лету из одного блока псевдослучайных байт, поэтому файлы
+в несколько гигабайт не занимают память. Скорость каждого соединения можно ограничить (rate_mb),
+а ответы с ошибками (429, 503, 524) и обрывы посреди передачи — подмешать через inject().
+
+Запуск отдельно: python benchmarks/mock_hf_server.py --port 8900 --repo org/model=model.safetensors:256
+и HF_ENDPOINT=http://127.0.0.1:8900 для ComfyUI.
+"""
+import re
+import sys
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import threading
+
+from aiohttp import web
+
+MB = 1024 * 1024
+BLOCK_SIZE = MB
+CHUNK_SIZE = 256 * 1024
+
+
+class MockFile:
+    """Файл заданного размера: повторяющийся блок псевдослучайных байт (свой для каждого seed)"""
+
+    def __init__(self, size, seed=0):
+        self.size = int(size)
+        self.seed = seed
+        self._block = random.Random(seed).randbytes(BLOCK_SIZE)
+        self._sha256 = None
+
+    def read(self, start, end):
+        """Байты [start, end)"""
+        parts = []
+        while start < end:
+            offset = start % BLOCK_SIZE
+            length = min(BLOCK_SIZE - offset, end - start)
+            parts.append(self._block[offset:offset + length])
+            start += length
+        return b"".join(parts)
+
+    @property
+    def sha256(self):
+        if self._sha256 is None:
+            hasher = hashlib.sha256()
+            for start in range(0, self.size, BLOCK_SIZE):
+                hasher.update(self.read(start, min(start + BLOCK_SIZE, self.size)))
+            self._sha256 = hasher.hexdigest()
+        return self._sha256
+
+
+class MockHub:
+    """
+    Состояние сервера: репозитории, прямые ссылки, ограничение скорости и очередь ошибок.
+    Сервер работает в отдельном потоке со своим event loop (start/stop), чтобы его работа
+    не попадала в замеры задержек event loop клиента.
+    """
+
+    KINDS = ("search", "api", "resolve", "cdn", "files")
+
+    def __init__(self, rate_mb=0, chunk_size=CHUNK_SIZE):
+        self.rate_mb = rate_mb
+        self.chunk_size = chunk_size
+        self.repos = {}
+        self.files = {}
+        self._blobs = {}
+        self._faults = {kind: [] for kind in self.KINDS}
+        self._lock = threading.Lock()
+        self.stats = {}
+        self.reset_stats()
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self.base_url = None
+
+    # --- данные ---
+
+    def add_repo(self, repo_id, files, downloads=0, seed=None):
+        """files: {путь в репозитории: размер в байтах}"""
+        seed = seed if seed is not None else len(self._blobs) + 1
+        siblings = {}
+        for index, (path, size) in enumerate(sorted(files.items())):
+            blob = MockFile(size, seed * 1000 + index)
+            siblings[path] = blob
+            self._blobs[blob.sha256] = blob
+        commit = hashlib.sha1(repo_id.encode("utf-8")).hexdigest()
+        self.repos[repo_id] = {"sha": commit, "files": siblings, "downloads": downloads}
+        return self.repos[repo_id]
+
+    def add_file(self, name, size, seed=None):
+        """Файл для прямой ссылки /files/{name}"""
+        blob = MockFile(size, seed if seed is not None else 999000 + len(self.files))
+        self.files[name] = blob
+        return blob
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    # --- ошибки ---
+
+    def inject(self, kind, status=None, count=1, retry_after=None, drop_after=None):
+        """
+        Следующие count запросов вида kind (search, api, resolve, cdn, files) завершатся ошибкой:
+        ответом status (с Retry-After, если задан) или обрывом соединения после drop_after байт тела.
+        """
+        if kind not in self._faults:
+            raise ValueError(f"Unknown request kind: {kind}")
+        with self._lock:
+            self._faults[kind].extend(
+                [{"status": status, "retry_after": retry_after, "drop_after": drop_after}] * count
+            )
+
+    def clear_faults(self):
+        with self._lock:
+            for faults in self._faults.values():
+                faults.clear()
+
+    def _take_fault(self, kind):
+        with self._lock:
+            self.stats["requests"][kind] = self.stats["requests"].get(kind, 0) + 1
+            if self._faults[kind]:
+                self.stats["faults"] += 1
+                return self._faults[kind].pop(0)
+        return None
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {"requests": {}, "faults": 0, "bytes_served": 0}
+
+    # --- обработчики ---
+
+    def _fault_response(self, fault):
+        headers = {}
+        if fault["retry_after"] is not None:
+            headers["Retry-After"] = str(fault["retry_after"])
+        text = "error code: 524" if fault["status"] == 524 else f"mock error {fault['status']}"
+        return web.Response(status=fault["status"], text=text, headers=headers)
+
+    async def _search(self, request):
+        fault = self._take_fault("search")
+        if fault and fault["status"]:
+            return self._fault_response(fault)
+        query = request.query.get("search", "").lower()
+        limit = int(request.query.get("limit", 10))
+        found = [
+            {"id": repo_id, "modelId": repo_id, "downloads": repo["downloads"], "likes": 0, "tags": []}
+            for repo_id, repo in self.repos.items()
+            if query in repo_id.lower()
+        ]
+        found.sort(key=lambda item: -item["downloads"])
+        return web.json_response(found[:limit])
+
+    async def _model_info(self, request):
+        fault = self._take_fault("api")
+        if fault and fault["status"]:
+            return self._fault_response(fault)
+        repo_id = f"{request.match_info['namespace']}/{request.match_info['name']}"
+        repo = self.repos.get(repo_id)
+        if repo is None:
+            return web.json_response({"error": "Repository not found"}, status=404)
+        return web.json_response({
+            "id": repo_id,
+            "modelId": repo_id,
+            "sha": repo["sha"],
+            "downloads": repo["downloads"],
+            "tags": [],
+            "siblings": [
+                {
+                    "rfilename": path,
+                    "size": blob.size,
+                    "blobId": blob.sha256[:40],
+                    "lfs": {"sha256": blob.sha256, "size": blob.size, "pointerSize": 134},
+                }
+                for path, blob in repo["files"].items()
+            ],
+        })
+
+    async def _resolve(self, request):
+        fault = self._take_fault("resolve")
+        if fault and fault["status"]:
+            return self._fault_response(fault)
+        repo_id = f"{request.match_info['namespace']}/{request.match_info['name']}"
+        repo = self.repos.get(repo_id)
+        blob = repo["files"].get(request.match_info["path"]) if repo else None
+        if blob is None:
+            return web.json_response({"error": "Entry not found"}, status=404,
+                                     headers={"X-Error-Code": "EntryNotFound"})
+        # Как у HF: файлы LFS отдаются редиректом на CDN, метаданные — в заголовках редиректа
+        raise web.HTTPFound(f"{request.url.origin()}/cdn/{blob.sha256}", headers={
+            "X-Repo-Commit": repo["sha"],
+            "X-Linked-Etag": f'"{blob.sha256}"',
+            "X-Linked-Size": str(blob.size),
+            "ETag": f'"{blob.sha256}"',
+        })
+
+    async def _cdn(self, request):
+        blob = self._blobs.get(request.match_info["sha256"])
+        if blob is None:
+            return web.Response(status=404, text="Not found")
+        return await self._serve(request, blob, self._take_fault("cdn"))
+
+    async def _direct(self, request):
+        blob = self.files.get(request.match_info["name"])
+        if blob is None:
+            return web.Response(status=404, text="Not found")
+        return await self._serve(request, blob, self._take_fault("files"))
+
+    async def _redirect(self, request):
+        raise web.HTTPFound(f"/files/{request.match_info['name']}")
+
+    async def _serve(self, request, blob, fault):
+        """Отдаёт файл с поддержкой Range/If-Range и ограничением скорости соединения"""
+        if fault and fault["status"]:
+            return self._fault_response(fault)
+        etag = f'"{blob.sha256}"'
+        start, end = 0, blob.size
+        status = 200
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", request.headers.get("Range", "").strip())
+        if_range = request.headers.get("If-Range")
+        if match and (if_range is None or if_range == etag):
+            first, last = match.groups()
+            if first:
+                start = int(first)
+                end = min(int(last) + 1, blob.size) if last else blob.size
+            elif last:
+                start = max(0, blob.size - int(last))
+            if start >= blob.size:
+                return web.Response(status=416, headers={"Content-Range": f"bytes */{blob.size}"})
+            status = 206
+
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "Content-Length": str(end - start),
+            "Accept-Ranges": "bytes",
+            "ETag": etag,
+        }
+        if status == 206:
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{blob.size}"
+        if request.method == "HEAD":
+            return web.Response(status=status, headers=headers)
+
+        response = web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+        drop_after = fault["drop_after"] if fault else None
+        rate = self.rate_mb * MB
+        started = time.monotonic()
+        sent = 0
+        position = start
+        while position < end:
+            if drop_after is not None and sent >= drop_after:
+                # Обрыв соединения посреди передачи
+                request.transport.close()
+                return response
+            chunk = blob.read(position, min(position + self.chunk_size, end))
+            try:
+                await response.write(chunk)
+            except ConnectionError:
+                # Клиент закрыл соединение (отмена, лишний сегмент) — это не ошибка сервера
+                return response
+            position += len(chunk)
+            sent += len(chunk)
+            with self._lock:
+                self.stats["bytes_served"] += len(chunk)
+            if rate:
+                delay = started + sent / rate - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        await response.write_eof()
+        return response
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/api/models", self._search)
+        app.router.add_get("/api/models/{namespace}/{name}", self._model_info)
+        app.router.add_get("/api/models/{namespace}/{name}/revision/{revision}", self._model_info)
+        for method in ("HEAD", "GET"):
+            app.router.add_route(method, "/{namespace}/{name}/resolve/{revision}/{path:.+}", self._resolve)
+            app.router.add_route(method, "/cdn/{sha256}", self._cdn)
+            app.router.add_route(method, "/files/{name}", self._direct)
+            app.router.add_route(method, "/redirect/{name}", self._redirect)
+        return app
+
+    # --- запуск ---
+
+    def start(self, host="127.0.0.1", port=0):
+        """Запускает сервер в фоновом потоке и возвращает его адрес"""
+        ready = threading.Event()
+        errors = []
+
+        def _run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._runner = web.AppRunner(self.app(), access_log=None)
+                self._loop.run_until_complete(self._runner.setup())
+                site = web.TCPSite(self._runner, host, port)
+                self._loop.run_until_complete(site.start())
+                bound_host, bound_port = self._runner.addresses[0][:2]
+                self.base_url = f"http://{bound_host}:{bound_port}"
+            except Exception as e:
+                errors.append(e)
+                ready.set()
+                return
+            ready.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self._runner.cleanup())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=_run, name="mock-hf-server", daemon=True)
+        self._thread.start()
+        ready.wait()
+        if errors:
+            raise errors[0]
+        return self.base_url
+
+    def stop(self):
+        if self._loop is not None and self._thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=10)
+            self._thread = None
+
+
+def _parse_repo(value):
+    """org/model=file.safetensors:256,config.json:0.01 -> (repo_id, {путь: байт})"""
+    repo_id, _sep, files = value.partition("=")
+    sizes = {}
+    for item in files.split(","):
+        path, _sep, size_mb = item.rpartition(":")
+        sizes[path] = int(float(size_mb) * MB)
+    return repo_id, sizes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mock HuggingFace Hub / CDN server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--rate-mb", type=float, default=0, help="per-connection speed limit, MB/s")
+    parser.add_argument("--repo", action="append", default=[], help="org/model=path:size_mb[,path:size_mb]")
+    parser.add_argument("--file", action="append", default=[], help="name:size_mb for /files/{name}")
+    args = parser.parse_args(argv)
+
+    hub = MockHub(rate_mb=args.rate_mb)
+    for value in args.repo or ["mock/model=model.safetensors:64,config.json:0.01"]:
+        hub.add_repo(*_parse_repo(value))
+    for value in args.file:
+        name, _sep, size_mb = value.rpartition(":")
+        hub.add_file(name, int(float(size_mb) * MB))
+    hub.base_url = f"http://{args.host}:{args.port}"
+    web.run_app(hub.app(), host=args.host, port=args.port, access_log=None,
+                print=lambda *_args: print(f"Mock HF server: {hub.base_url}", file=sys.stderr))
+
+
+if __name__ == "__main__":
+    main()
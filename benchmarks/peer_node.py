@@ -0,0 +1,60 @@
+"""
+Узел для бенчмарков режима узлов: HTTP API пакета (все routes из nodes.py) без ComfyUI.
+
+PromptServer подменяется минимальным aiohttp приложением, folder_paths — папкой моделей узла.
+Настройки (HF_ENDPOINT, PDM_PEERS, PDM_PEER_TOKEN, PDM_PEER_ID, ...) берутся из окружения:
+
+    python benchmarks/peer_node.py --port 8921 --models-dir /tmp/node-a
+"""
+import os
+import sys
+import types
+import argparse
+import importlib
+
+from aiohttp import web
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from run import PACKAGE, REPO_ROOT, install_folder_paths  # noqa: E402
+
+
+class PromptServer:
+    """То немногое от PromptServer ComfyUI, что нужно setup_routes()"""
+
+    instance = None
+
+    def __init__(self):
+        self.app = web.Application()
+        self.routes = web.RouteTableDef()
+
+    def send_sync(self, event, payload):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Package HTTP API without ComfyUI, for peer benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--models-dir", required=True)
+    args = parser.parse_args(argv)
+
+    os.makedirs(os.path.join(args.models_dir, "checkpoints"), exist_ok=True)
+    install_folder_paths(args.models_dir)
+    PromptServer.instance = PromptServer()
+    server = types.ModuleType("server")
+    server.PromptServer = PromptServer
+    sys.modules["server"] = server
+
+    package = types.ModuleType(PACKAGE)
+    package.__path__ = [REPO_ROOT]
+    sys.modules[PACKAGE] = package
+    # Импорт nodes регистрирует routes в PromptServer.instance.routes
+    importlib.import_module(f"{PACKAGE}.nodes")
+    PromptServer.instance.app.add_routes(PromptServer.instance.routes)
+    web.run_app(PromptServer.instance.app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
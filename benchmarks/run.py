@@ -0,0 +1,648 @@
+"""
+Бенчмарки загрузчика на локальном сервере, имитирующем HuggingFace и CDN (mock_hf_server.py).
+
+Работает без сети и без ComfyUI: пакет загружается из папки репозитория, вместо folder_paths
+подставляется временная папка моделей, HF_ENDPOINT указывает на локальный сервер.
+Для каждого сценария измеряются время и скорость, задержки event loop во время загрузки,
+пик RSS процесса (и, с --tracemalloc, пик памяти Python), количество повторов и время
+восстановления после ошибок. Результаты — JSON (stdout или --output), чтобы сравнивать версии:
+
+    python benchmarks/run.py --output before.json
+    python benchmarks/run.py --output after.json --compare before.json
+"""
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import socket
+import asyncio
+import argparse
+import platform
+import resource
+import importlib
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from mock_hf_server import MB, MockHub  # noqa: E402
+
+PACKAGE = "preset_download_manager"
+SCHEMA_VERSION = 1
+
+
+# --- окружение ---
+
+def prepare_environment(work_dir, endpoint):
+    """Настройки, при которых пакет не трогает сеть, папки ComfyUI и файлы рядом с собой"""
+    no_proxy = [value for value in os.environ.get("NO_PROXY", "").split(",") if value]
+    os.environ.update({
+        "HF_ENDPOINT": endpoint,
+        "HF_HOME": os.path.join(work_dir, "hf_home"),
+        "HF_HUB_DISABLE_TELEMETRY": "1",
+        "HF_HUB_DISABLE_PROGRESS_BARS": "1",
+        "NO_PROXY": ",".join(no_proxy + ["127.0.0.1", "localhost"]),
+        "PDM_METADATA_CACHE_PERSIST": "0",
+        "PDM_VERIFY_DB": os.path.join(work_dir, "verified.json"),
+        "PDM_BLOB_STORE": "0",
+        "PDM_JSON_LOG": "0",
+    })
+    os.environ.pop("PDM_PROXY", None)
+
+
+def install_folder_paths(models_dir):
+    """Подменяет folder_paths ComfyUI временной папкой моделей (даже если ComfyUI доступен)"""
+    module = types.ModuleType("folder_paths")
+    module.models_dir = models_dir
+    module.folder_names_and_paths = {}
+    module.get_folder_paths = lambda folder_name: [os.path.join(models_dir, folder_name)]
+    sys.modules["folder_paths"] = module
+
+
+def load_package():
+    """Загружает модули пакета из папки репозитория (без __init__.py, который регистрирует routes)"""
+    package = types.ModuleType(PACKAGE)
+    package.__path__ = [REPO_ROOT]
+    sys.modules[PACKAGE] = package
+    return types.SimpleNamespace(
+        downloader=importlib.import_module(f"{PACKAGE}.downloader"),
+        metadata_cache=importlib.import_module(f"{PACKAGE}.metadata_cache"),
+        metrics=importlib.import_module(f"{PACKAGE}.metrics"),
+        http_client=importlib.import_module(f"{PACKAGE}.http_client"),
+        retry=importlib.import_module(f"{PACKAGE}.retry"),
+    )
+
+
+def _package_version():
+    try:
+        with open(os.path.join(REPO_ROOT, "pyproject.toml"), encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("version"):
+                    return line.split("=", 1)[1].strip().strip('"')
+    except OSError:
+        pass
+    return None
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+# --- измерения ---
+
+def _rss_bytes():
+    """Текущий RSS процесса (Linux), иначе пик из getrusage"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class LoopMonitor:
+    """
+    Фоновая задача, которая каждые interval секунд засыпает и замеряет, насколько позже
+    положенного она проснулась (задержка event loop), а заодно — пик RSS процесса.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.lags = []
+        self.peak_rss = 0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - started - self.interval))
+            self.peak_rss = max(self.peak_rss, _rss_bytes())
+
+    async def __aenter__(self):
+        self.peak_rss = _rss_bytes()
+        self._task = asyncio.ensure_future(self._run())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def summary(self):
+        return {
+            "loop_lag_ms": {
+                "p50": round(_percentile(self.lags, 0.5) * 1000, 3) if self.lags else None,
+                "p99": round(_percentile(self.lags, 0.99) * 1000, 3) if self.lags else None,
+                "max": round(max(self.lags) * 1000, 3) if self.lags else None,
+                "samples": len(self.lags),
+            },
+            "rss_peak_mb": round(self.peak_rss / MB, 1),
+        }
+
+
+class Bench:
+    """Сервер, модули пакета и параметры запуска, общие для всех сценариев"""
+
+    def __init__(self, hub, modules, models_dir, args):
+        self.hub = hub
+        self.modules = modules
+        self.models_dir = models_dir
+        self.args = args
+        self.size = int(args.size_mb * MB)
+        self.results = {}
+
+    def clean(self):
+        """Удаляет скачанные файлы и кэш метаданных, чтобы каждый прогон был холодным"""
+        for name in os.listdir(self.models_dir):
+            shutil.rmtree(os.path.join(self.models_dir, name), ignore_errors=True)
+        # Папки моделей в ComfyUI существуют заранее
+        os.makedirs(os.path.join(self.models_dir, "checkpoints"))
+        self.modules.metadata_cache.get_metadata_cache().clear()
+        self.modules.retry.get_circuit_breakers().reset()
+
+    def retries(self):
+        return sum(value for _name, _labels, value in self.modules.metrics.RETRIES.samples())
+
+    async def download(self, data):
+        """Скачивает модель и проверяет, что на диске файл (или папка) нужного размера"""
+        result = await self.modules.downloader.download_model(dict(data, save_path="checkpoints"))
+        path = result["path"]
+        if os.path.isdir(path):
+            size = sum(
+                os.path.getsize(os.path.join(root, name))
+                for root, _dirs, files in os.walk(path) for name in files
+                if ".cache" not in root
+            )
+        else:
+            size = os.path.getsize(path)
+        return {"bytes": size, "sha256": result.get("sha256")}
+
+
+# --- сценарии ---
+
+async def direct(bench):
+    blob = bench.hub.files["direct.bin"]
+    return await bench.download({"direct_url": bench.hub.url("/files/direct.bin"), "sha256": blob.sha256})
+
+
+async def direct_unverified(bench):
+    """Прямая загрузка без ожидаемого SHA-256 в пресете (для сравнения способов записи)"""
+    return await bench.download({"direct_url": bench.hub.url("/files/direct.bin")})
+
+
+async def hf_file(bench):
+    return await bench.download({"model_id": "bench/single", "model_path": "model.safetensors"})
+
+
+async def hf_repo(bench):
+    return await bench.download({"model_id": "bench/sharded", "workers": bench.args.segments})
+
+
+async def retry_524_direct(bench):
+    bench.hub.inject("files", status=524)
+    return await direct(bench)
+
+
+async def retry_429_hf(bench):
+    bench.hub.inject("cdn", status=429, retry_after=1)
+    return await hf_file(bench)
+
+
+async def retry_503_direct(bench):
+    bench.hub.inject("files", status=503, retry_after=1)
+    return await direct(bench)
+
+
+async def retry_429_direct(bench):
+    bench.hub.inject("files", status=429, retry_after=1)
+    return await direct(bench)
+
+
+async def _expect_failure(bench, data):
+    """Загрузка, которая должна завершиться ошибкой; возвращает, сколько запросов и времени на это ушло"""
+    started = time.perf_counter()
+    try:
+        await bench.download(data)
+    except Exception as e:
+        return {
+            "failed_after_seconds": round(time.perf_counter() - started, 4),
+            "error_kind": bench.modules.retry.classify(e).kind,
+            "requests": sum(bench.hub.stats["requests"].values()),
+        }
+    raise RuntimeError("Download succeeded but was expected to fail")
+
+
+async def fail_fast_404_direct(bench):
+    bench.hub.inject("files", status=404, count=100)
+    return await _expect_failure(bench, {"direct_url": bench.hub.url("/files/direct.bin")})
+
+
+async def fail_fast_401_hf(bench):
+    bench.hub.inject("resolve", status=401, count=100)
+    return await _expect_failure(bench, {"model_id": "bench/single", "model_path": "model.safetensors"})
+
+
+async def circuit_breaker_direct(bench):
+    """Хост отвечает 524 на всё: первая задача исчерпывает повторы, остальные завершаются сразу"""
+    bench.hub.inject("files", status=524, count=1000)
+    data = {"direct_url": bench.hub.url("/files/direct.bin")}
+    first = await _expect_failure(bench, data)
+    later = [await _expect_failure(bench, data) for _index in range(5)]
+    return {
+        "first_failure_seconds": first["failed_after_seconds"],
+        "later_failures_max_seconds": max(run["failed_after_seconds"] for run in later),
+        "later_error_kind": later[-1]["error_kind"],
+        "requests": sum(bench.hub.stats["requests"].values()),
+    }
+
+
+async def resume_after_drop(bench):
+    bench.hub.inject("files", drop_after=bench.size // 2)
+    result = await direct(bench)
+    result["wasted_bytes"] = max(0, bench.hub.stats["bytes_served"] - bench.size)
+    return result
+
+
+async def _search_latencies(bench, queries, cold):
+    search_models = bench.modules.downloader.search_models
+    cache = bench.modules.metadata_cache.get_metadata_cache()
+    latencies = []
+    for query in queries:
+        if cold:
+            cache.clear()
+        started = time.perf_counter()
+        found = await search_models(query, 10)
+        latencies.append(time.perf_counter() - started)
+        if not isinstance(found, list):
+            raise RuntimeError(f"Unexpected search response: {found!r}")
+    return {
+        "requests": len(latencies),
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 0.5) * 1000, 3),
+            "p95": round(_percentile(latencies, 0.95) * 1000, 3),
+            "max": round(max(latencies) * 1000, 3),
+        },
+    }
+
+
+async def search_cold(bench):
+    return await _search_latencies(bench, [f"model-{index}" for index in range(bench.args.searches)], cold=True)
+
+
+async def search_cached(bench):
+    return await _search_latencies(bench, ["model"] * bench.args.searches, cold=False)
+
+
+async def search_429(bench):
+    bench.hub.inject("search", status=429, retry_after=1)
+    return await _search_latencies(bench, ["model"], cold=True)
+
+
+
+class PeerNodes:
+    """
+    Узлы в отдельных процессах (peer_node.py) с общим PDM_PEER_TOKEN и списком PDM_PEERS.
+    У каждого узла своя папка моделей, кэш HuggingFace и база проверенных файлов.
+    """
+
+    TOKEN = "bench-peer-token"
+
+    def __init__(self, bench, count=2):
+        self.bench = bench
+        self.work_dir = tempfile.mkdtemp(prefix="peers-", dir=os.path.dirname(bench.models_dir))
+        self.ports = [_free_port() for _index in range(count)]
+        self.urls = [f"http://127.0.0.1:{port}" for port in self.ports]
+        self.processes = []
+        self.session = None
+
+    async def __aenter__(self):
+        import aiohttp
+
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=600))
+        try:
+            for index, port in enumerate(self.ports):
+                node_dir = os.path.join(self.work_dir, f"node-{index}")
+                env = dict(
+                    os.environ,
+                    PDM_PEERS=",".join(self.urls),
+                    PDM_PEER_TOKEN=self.TOKEN,
+                    PDM_PEER_ID=f"node-{index}",
+                    HF_HOME=os.path.join(node_dir, "hf_home"),
+                    PDM_VERIFY_DB=os.path.join(node_dir, "verified.json"),
+                )
+                self.processes.append(subprocess.Popen(
+                    [sys.executable, os.path.join(BENCH_DIR, "peer_node.py"),
+                     "--port", str(port), "--models-dir", os.path.join(node_dir, "models")],
+                    env=env, stdout=subprocess.DEVNULL,
+                ))
+            for url in self.urls:
+                await self._wait_ready(url)
+        except BaseException:
+            await self.__aexit__(None, None, None)
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self.session is not None:
+            await self.session.close()
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    async def _wait_ready(self, url, timeout=60):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                async with self.session.get(f"{url}/preset_download_manager/metrics") as response:
+                    if response.status == 200:
+                        return
+            except OSError:
+                pass
+            if time.monotonic() > deadline or any(process.poll() is not None for process in self.processes):
+                raise RuntimeError(f"Peer node {url} did not start")
+            await asyncio.sleep(0.2)
+
+    async def download(self, index, data):
+        """Скачивает модель на узле index через POST /preset_download_manager/download"""
+        started = time.perf_counter()
+        async with self.session.post(
+            f"{self.urls[index]}/preset_download_manager/download", json=dict(data, save_path="checkpoints")
+        ) as response:
+            result = await response.json()
+        if response.status != 200:
+            raise RuntimeError(f"Download on node-{index} failed: {result.get('message')}")
+        return round(time.perf_counter() - started, 4)
+
+    async def peer_downloads(self, index):
+        """Значения pdm_peer_downloads_total узла index по результату (hit, miss, fallback)"""
+        async with self.session.get(f"{self.urls[index]}/preset_download_manager/metrics") as response:
+            text = await response.text()
+        counts = {}
+        for line in text.splitlines():
+            if line.startswith("pdm_peer_downloads_total{"):
+                labels, value = line.rsplit(" ", 1)
+                counts[labels.split('result="', 1)[1].split('"', 1)[0]] = int(float(value))
+        return counts
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _peer_download(bench, delay):
+    """
+    Один файл HuggingFace на двух узлах: второй узел начинает через delay секунд после первого
+    (None — после того, как первый закончил). Второй узел должен взять файл у первого, а хаб — отдать файл один раз.
+    """
+    data = {"model_id": "bench/single", "model_path": "model.safetensors"}
+    async with PeerNodes(bench, 2) as nodes:
+        first = asyncio.ensure_future(nodes.download(0, data))
+        if delay is None:
+            await asyncio.wait([first])
+        else:
+            await asyncio.sleep(delay)
+        second_seconds = await nodes.download(1, data)
+        first_seconds = await first
+        peer_downloads = await nodes.peer_downloads(1)
+    hub_bytes = bench.hub.stats["bytes_served"]
+    if not peer_downloads.get("hit"):
+        raise RuntimeError(f"Second node did not download from the first one: {peer_downloads}")
+    if hub_bytes != bench.size:
+        raise RuntimeError(f"Hub served {hub_bytes} bytes for a {bench.size}-byte file")
+    return {
+        "bytes": bench.size,
+        "first_node_seconds": first_seconds,
+        "second_node_seconds": second_seconds,
+        "peer_downloads": peer_downloads,
+        "hub_bytes_served": hub_bytes,
+    }
+
+
+async def peer_second_node(bench):
+    """Второй узел качает файл, который первый уже скачал"""
+    return await _peer_download(bench, delay=None)
+
+
+async def peer_concurrent(bench):
+    """Второй узел начинает, пока первый ещё качает, и дожидается его загрузки"""
+    return await _peer_download(bench, delay=1)
+
+# Имя -> (функция, переменные окружения, ограничение скорости соединения, с каким сценарием сравнивать восстановление)
+SCENARIOS = {
+    "direct_single": (direct, {"PDM_SEGMENTS": "1"}, False, None),
+    "direct_segmented": (direct, {"PDM_SEGMENTS": "{segments}"}, False, None),
+    "throttled_single": (direct, {"PDM_SEGMENTS": "1"}, True, None),
+    "throttled_segmented": (direct, {"PDM_SEGMENTS": "{segments}"}, True, None),
+    # Запись: прежний цикл (блоки по 8 КБ прямо в event loop) против фонового потока с разными буферами
+    "write_inline_8k": (direct_unverified, {"PDM_SEGMENTS": "1", "PDM_WRITE_BUFFER_MB": "0"}, False, None),
+    "write_buffered_1mb": (direct_unverified, {"PDM_SEGMENTS": "1", "PDM_WRITE_BUFFER_MB": "1"}, False, None),
+    "write_buffered": (direct_unverified, {"PDM_SEGMENTS": "1"}, False, None),
+    "write_buffered_16mb": (direct_unverified, {"PDM_SEGMENTS": "1", "PDM_WRITE_BUFFER_MB": "16"}, False, None),
+    "hf_file_hub": (hf_file, {"PDM_SEGMENTS": "1"}, False, None),
+    "hf_file_native": (hf_file, {"PDM_SEGMENTS": "{segments}"}, False, None),
+    "hf_repo_snapshot": (hf_repo, {"PDM_SEGMENTS": "1"}, False, None),
+    "hf_repo_native": (hf_repo, {"PDM_SEGMENTS": "{segments}"}, False, None),
+    "retry_524_direct": (retry_524_direct, {"PDM_SEGMENTS": "1"}, False, "direct_single"),
+    "retry_429_hf": (retry_429_hf, {"PDM_SEGMENTS": "1"}, False, "hf_file_hub"),
+    "retry_503_direct": (retry_503_direct, {"PDM_SEGMENTS": "1"}, False, "direct_single"),
+    "retry_429_direct": (retry_429_direct, {"PDM_SEGMENTS": "1"}, False, "direct_single"),
+    "fail_fast_404_direct": (fail_fast_404_direct, {"PDM_SEGMENTS": "1"}, False, None),
+    "fail_fast_401_hf": (fail_fast_401_hf, {"PDM_SEGMENTS": "1"}, False, None),
+    "circuit_breaker_direct": (
+        circuit_breaker_direct, {"PDM_SEGMENTS": "1", "PDM_RETRY_DELAY": "0.2", "PDM_MAX_RETRY_DELAY": "1"}, False, None
+    ),
+    "resume_after_drop": (resume_after_drop, {"PDM_SEGMENTS": "1"}, False, "direct_single"),
+    "search_cold": (search_cold, {}, False, None),
+    "search_cached": (search_cached, {}, False, None),
+    "search_429": (search_429, {}, False, None),
+    # Режим узлов: хаб и два узла в отдельных процессах
+    "peer_second_node": (peer_second_node, {"PDM_SEGMENTS": "1"}, False, None),
+    "peer_concurrent": (peer_concurrent, {"PDM_SEGMENTS": "1", "PDM_PEER_POLL_INTERVAL": "0.5"}, True, None),
+}
+
+
+async def run_scenario(bench, name):
+    func, env, throttled, baseline = SCENARIOS[name]
+    args = bench.args
+    env = {key: value.format(segments=args.segments) for key, value in env.items()}
+    env.setdefault("PDM_MIN_SEGMENT_SIZE_MB", str(max(1, int(args.size_mb // (args.segments * 2)) or 1)))
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+
+    runs = []
+    try:
+        for _repeat in range(args.repeat):
+            bench.clean()
+            bench.hub.clear_faults()
+            bench.hub.reset_stats()
+            bench.hub.rate_mb = args.throttle_mb if throttled else 0
+            retries_before = bench.retries()
+            if args.tracemalloc:
+                tracemalloc.start()
+            started = time.perf_counter()
+            async with LoopMonitor() as monitor:
+                try:
+                    run = await func(bench)
+                    run["ok"] = True
+                except Exception as e:
+                    run = {"ok": False, "error": f"{type(e).__name__}: {e}"[:500]}
+            run["seconds"] = round(time.perf_counter() - started, 4)
+            if args.tracemalloc:
+                run["python_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / MB, 1)
+                tracemalloc.stop()
+            run.update(monitor.summary())
+            run["retries"] = bench.retries() - retries_before
+            run["server"] = {
+                "requests": dict(bench.hub.stats["requests"]),
+                "faults": bench.hub.stats["faults"],
+                "bytes_served": bench.hub.stats["bytes_served"],
+            }
+            if run["ok"] and run.get("bytes"):
+                run["throughput_mb_s"] = round(run["bytes"] / MB / run["seconds"], 2)
+            runs.append(run)
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        bench.hub.rate_mb = 0
+
+    # Итог сценария — прогон с медианным временем, остальные прогоны — только время
+    ordered = sorted(runs, key=lambda run: run["seconds"])
+    result = dict(ordered[len(ordered) // 2])
+    result.update({"scenario": name, "env": env, "runs_seconds": [run["seconds"] for run in runs]})
+    if args.repeat > 1:
+        result["seconds_stdev"] = round(statistics.stdev(result["runs_seconds"]), 4)
+    if throttled:
+        result["connection_limit_mb_s"] = args.throttle_mb
+    base = bench.results.get(baseline)
+    if base and base.get("ok") and result.get("ok"):
+        # Сколько времени ушло на ошибку и восстановление по сравнению с загрузкой без ошибок
+        result["recovery_seconds"] = round(result["seconds"] - base["seconds"], 4)
+    bench.results[name] = result
+    return result
+
+
+def compare(results, previous):
+    """Таблица изменений относительно прошлого запуска (в stderr)"""
+    before = {result["scenario"]: result for result in previous.get("results", [])}
+    lines = [f"{'scenario':<22}{'before, s':>12}{'after, s':>12}{'change':>10}"]
+    for result in results:
+        old = before.get(result["scenario"])
+        if not old or not old.get("ok") or not result.get("ok"):
+            lines.append(f"{result['scenario']:<22}{'-':>12}{result['seconds']:>12.3f}{'':>10}")
+            continue
+        change = (result["seconds"] - old["seconds"]) / old["seconds"] * 100 if old["seconds"] else 0.0
+        lines.append(f"{result['scenario']:<22}{old['seconds']:>12.3f}{result['seconds']:>12.3f}{change:>+9.1f}%")
+    print("\n".join(lines), file=sys.stderr)
+
+
+async def run(args, hub, modules, models_dir):
+    bench = Bench(hub, modules, models_dir, args)
+    results = []
+    try:
+        for name in args.scenario or list(SCENARIOS):
+            print(f"[benchmark] {name}...", file=sys.stderr)
+            results.append(await run_scenario(bench, name))
+    finally:
+        await modules.http_client.close_sessions()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline download benchmarks against a mock HuggingFace server")
+    parser.add_argument("--size-mb", type=float, default=128, help="size of the downloaded file")
+    parser.add_argument("--segments", type=int, default=4, help="connections for segmented scenarios")
+    parser.add_argument("--throttle-mb", type=float, default=32, help="per-connection limit for throttled scenarios")
+    parser.add_argument("--searches", type=int, default=50, help="requests per search scenario")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="run only these scenarios")
+    parser.add_argument("--tracemalloc", action="store_true", help="also record peak Python allocations (slower)")
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="pdm-bench-")
+    models_dir = os.path.join(work_dir, "models")
+    os.makedirs(models_dir)
+
+    hub = MockHub()
+    size = int(args.size_mb * MB)
+    hub.add_file("direct.bin", size)
+    hub.add_repo("bench/single", {"model.safetensors": size, "config.json": 1024})
+    shard = max(1, size // 8)
+    hub.add_repo("bench/sharded", {f"model-{index:05d}-of-00008.safetensors": shard for index in range(8)})
+    for index in range(200):
+        hub.add_repo(f"bench/model-{index}", {"config.json": 64}, downloads=index)
+
+    try:
+        endpoint = hub.start()
+        prepare_environment(work_dir, endpoint)
+        install_folder_paths(models_dir)
+        modules = load_package()
+        results = asyncio.run(run(args, hub, modules, models_dir))
+    finally:
+        hub.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "schema": SCHEMA_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "package_version": _package_version(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "size_mb": args.size_mb,
+            "segments": args.segments,
+            "throttle_mb": args.throttle_mb,
+            "searches": args.searches,
+            "repeat": args.repeat,
+        },
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(results, json.load(f))
+    return 0 if all(result.get("ok") for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
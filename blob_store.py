@@ -0,0 +1,357 @@
+import os
+import json
+import time
+import errno
+import shutil
+import threading
+
+import folder_paths
+
+from .integrity import sha256_file
+
+# ioctl FICLONE (Linux): копия файла с общими блоками на Btrfs/XFS/bcachefs
+FICLONE = 0x40049409
+
+
+def _reflink(src, dst):
+    """Создаёт reflink-копию файла; выбрасывает OSError, если файловая система не поддерживает клонирование"""
+    import fcntl
+
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+
+
+def place_file(src, dst, allow_copy=True):
+    """
+    Размещает копию src по пути dst: жёсткая ссылка, reflink или (если allow_copy) обычное копирование.
+    dst заменяется атомарно. Возвращает использованный способ ("hardlink", "reflink", "copy")
+    или None, если без копирования разместить файл нельзя.
+    """
+    tmp_path = f"{dst}.{os.getpid()}.link"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    method = None
+    try:
+        os.link(src, tmp_path)
+        method = "hardlink"
+    except OSError:
+        try:
+            _reflink(src, tmp_path)
+            method = "reflink"
+        except (OSError, ImportError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if not allow_copy:
+                return None
+            shutil.copyfile(src, tmp_path)
+            method = "copy"
+    try:
+        os.replace(tmp_path, dst)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return method
+
+
+class BlobStore:
+    """
+    Локальное хранилище файлов моделей по SHA-256 (content-addressed).
+
+    Файлы лежат в <root>/blobs/<sha256>, индекс (<root>/index.json) хранит размер, время последнего
+    использования и ссылки (пути в папках моделей, куда файл размещён) каждого файла, а также связь
+    "источник -> SHA-256" (repo/revision/path или URL).
+    В папки моделей файлы попадают жёсткими ссылками (или reflink/копией), поэтому один и тот же
+    файл в нескольких папках занимает место на диске один раз, а повторная установка — это создание ссылки.
+
+    Файл хранилища используется, пока жив хотя бы один путь из его ссылок (для жёсткой ссылки — тот же inode,
+    для reflink и копии — файл того же размера). Число жёстких ссылок (st_nlink) для этого не годится:
+    у reflink-копии свой inode. Неиспользуемые файлы удаляются при сборке мусора (после добавления и при
+    запуске): без ограничения размера (max_bytes) — все, с ограничением — давно не использованные, пока
+    объём больше max_bytes. Пока файл используется, удаление модели из одной папки не освобождает место.
+
+    Перед размещением размер и mtime файла сверяются с записанными при добавлении: файл модели,
+    изменённый на месте через жёсткую ссылку, не попадёт в другие папки (с verify — сверяется и SHA-256).
+    """
+
+    def __init__(self, root, max_bytes=0):
+        self.root = root
+        self.blobs_dir = os.path.join(root, "blobs")
+        self.index_path = os.path.join(root, "index.json")
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = None
+
+    def _load(self):
+        if self._index is None:
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+            self._index.setdefault("blobs", {})
+            self._index.setdefault("sources", {})
+        return self._index
+
+    def _save(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def blob_path(self, sha256):
+        return os.path.join(self.blobs_dir, sha256)
+
+    def resolve(self, sha256=None, source=None, verify=False):
+        """
+        Возвращает SHA-256 файла, который есть в хранилище (по хешу или по источнику), или None.
+        Файл, который удалили или изменили после добавления, из хранилища убирается (verify — сверить и SHA-256).
+        """
+        with self._lock:
+            index = self._load()
+            if not sha256 and source:
+                sha256 = index["sources"].get(source)
+            if not sha256 or sha256 not in index["blobs"]:
+                return None
+            record = dict(index["blobs"][sha256])
+        if not self._is_intact(sha256, record, verify):
+            self.remove(sha256)
+            return None
+        return sha256
+
+    def _is_intact(self, sha256, record, verify=False):
+        try:
+            stat = os.stat(self.blob_path(sha256))
+        except OSError:
+            # Файл удалили вручную — забываем о нём
+            return False
+        changed = record.get("size") is not None and record["size"] != stat.st_size
+        if not changed and record.get("mtime_ns") is not None and record["mtime_ns"] != stat.st_mtime_ns:
+            changed = True
+        if not changed and (verify or record.get("mtime_ns") is None):
+            # Записи без mtime (из прошлых версий) проверяем по содержимому один раз
+            changed = sha256_file(self.blob_path(sha256)) != sha256
+            if not changed:
+                self._touch(sha256, size=stat.st_size, mtime_ns=stat.st_mtime_ns, used=False)
+        if changed:
+            print(f"[PresetDownloadManager] ⚠️ Файл {sha256[:12]}… в хранилище изменён после добавления — "
+                  f"убираем его из хранилища, модель будет скачана заново")
+        return not changed
+
+    def materialize(self, sha256, target_path, source=None):
+        """Размещает файл из хранилища по пути target_path (после resolve). Возвращает способ размещения."""
+        os.makedirs(os.path.dirname(target_path) or ".", exist_ok=True)
+        method = place_file(self.blob_path(sha256), target_path)
+        self._touch(sha256, source, ref=(target_path, method))
+        return method
+
+    def add(self, path, sha256, source=None):
+        """
+        Добавляет скачанный файл в хранилище. Копирование не используется: если жёсткую ссылку
+        или reflink создать нельзя (другая файловая система), файл не кэшируется.
+        """
+        blob_path = self.blob_path(sha256)
+        method = None
+        if os.path.isfile(blob_path):
+            with self._lock:
+                record = dict(self._load()["blobs"].get(sha256) or {})
+            if record and self._is_intact(sha256, record):
+                # Такой файл уже есть — скачанная копия заменяется ссылкой на него
+                try:
+                    method = place_file(blob_path, path, allow_copy=False)
+                except OSError as e:
+                    print(f"[PresetDownloadManager] ⚠️ Не удалось заменить файл ссылкой на хранилище: {e}")
+                if method is None:
+                    # Скачанный файл остаётся отдельной копией и хранилище не использует
+                    self._touch(sha256, source)
+                    return True
+            else:
+                self.remove(sha256)
+        if method is None:
+            os.makedirs(self.blobs_dir, exist_ok=True)
+            try:
+                method = place_file(path, blob_path, allow_copy=False)
+            except OSError as e:
+                print(f"[PresetDownloadManager] ⚠️ Не удалось добавить файл в хранилище: {e}")
+                return False
+            if method is None:
+                return False
+        stat = os.stat(blob_path)
+        self._touch(sha256, source, stat.st_size, stat.st_mtime_ns, ref=(path, method))
+        # Без ограничения размера удаляются файлы, которые больше не использует ни одна папка моделей;
+        # только что добавленный файл не трогаем
+        self.gc(keep=(sha256,))
+        return True
+
+    def _touch(self, sha256, source=None, size=None, mtime_ns=None, used=True, ref=None):
+        with self._lock:
+            index = self._load()
+            record = index["blobs"].setdefault(sha256, {})
+            if size is not None:
+                record["size"] = size
+            if mtime_ns is not None:
+                record["mtime_ns"] = mtime_ns
+            if used:
+                record["last_used"] = time.time()
+            if ref is not None:
+                path, method = ref
+                record.setdefault("refs", {})[os.path.abspath(path)] = method
+            if source:
+                index["sources"][source] = sha256
+            try:
+                self._save()
+            except OSError as e:
+                print(f"[PresetDownloadManager] ⚠️ Не удалось сохранить индекс хранилища: {e}")
+
+    def _live_refs(self, sha256, record, blob_stat):
+        """
+        Пути из ссылок файла, которые всё ещё его используют. Для записей без ссылок (из прошлых версий,
+        где были только жёсткие ссылки) возвращает None — тогда использование видно по st_nlink.
+        """
+        refs = record.get("refs")
+        if refs is None:
+            return None
+        live = {}
+        for path, method in refs.items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if method == "hardlink":
+                alive = (stat.st_dev, stat.st_ino) == (blob_stat.st_dev, blob_stat.st_ino)
+            else:
+                alive = stat.st_size == blob_stat.st_size
+            if alive:
+                live[path] = method
+        return live
+
+    def _references(self, sha256, record, blob_stat):
+        """Сколько папок моделей используют файл; мёртвые ссылки убираются из индекса"""
+        live = self._live_refs(sha256, record, blob_stat)
+        if live is None:
+            return blob_stat.st_nlink - 1
+        if len(live) != len(record["refs"]):
+            with self._lock:
+                current = self._load()["blobs"].get(sha256)
+                if current is not None:
+                    current["refs"] = {
+                        path: method for path, method in current.get("refs", {}).items()
+                        if path in live or path not in record["refs"]
+                    }
+                    try:
+                        self._save()
+                    except OSError as e:
+                        print(f"[PresetDownloadManager] ⚠️ Не удалось сохранить индекс хранилища: {e}")
+        return len(live)
+
+    def remove(self, sha256):
+        with self._lock:
+            index = self._load()
+            index["blobs"].pop(sha256, None)
+            for source in [source for source, value in index["sources"].items() if value == sha256]:
+                del index["sources"][source]
+            try:
+                os.remove(self.blob_path(sha256))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            self._save()
+
+    def usage(self):
+        """
+        Отчёт об использовании диска: общий объём хранилища, сколько места сэкономлено ссылками
+        в папках моделей и сколько освободит удаление файлов, которые не использует ни одна папка.
+        """
+        with self._lock:
+            blobs = dict(self._load()["blobs"])
+        total = linked = unreferenced = 0
+        files = []
+        for sha256, record in blobs.items():
+            try:
+                stat = os.stat(self.blob_path(sha256))
+            except OSError:
+                continue
+            refs = self._references(sha256, record, stat)
+            total += stat.st_size
+            if refs:
+                # Место, которое заняли бы отдельные копии в папках моделей
+                linked += stat.st_size * refs
+            else:
+                unreferenced += stat.st_size
+            files.append({
+                "sha256": sha256,
+                "size": stat.st_size,
+                "links": refs,
+                "last_used": record.get("last_used"),
+            })
+        files.sort(key=lambda item: item["last_used"] or 0, reverse=True)
+        return {
+            "root": self.root,
+            "blobs": len(files),
+            "bytes": total,
+            "max_bytes": self.max_bytes or None,
+            "linked_bytes": linked,
+            "unreferenced_bytes": unreferenced,
+            "files": files,
+        }
+
+    def gc(self, max_bytes=None, keep=()):
+        """
+        Удаляет файлы, которые не использует ни одна папка моделей: без ограничения размера — все,
+        с ограничением — давно не использованные (LRU), пока объём хранилища больше max_bytes.
+        Если объём всё ещё больше, из хранилища убираются и используемые файлы (LRU): они остаются
+        на диске в папках моделей, удаляется только запись в хранилище. Файлы из keep не удаляются.
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        with self._lock:
+            blobs = sorted(self._load()["blobs"].items(), key=lambda item: item[1].get("last_used") or 0)
+        total = sum(record.get("size") or 0 for _sha256, record in blobs)
+        unused = []
+        used = []
+        removed = []
+        freed = 0
+        for sha256, record in blobs:
+            if sha256 in keep:
+                continue
+            try:
+                stat = os.stat(self.blob_path(sha256))
+            except OSError:
+                # Файл удалили вручную — забываем о нём
+                self.remove(sha256)
+                total -= record.get("size") or 0
+                removed.append(sha256)
+                continue
+            (used if self._references(sha256, record, stat) else unused).append((sha256, record))
+
+        for sha256, record in unused:
+            if max_bytes and total <= max_bytes:
+                break
+            self.remove(sha256)
+            total -= record.get("size") or 0
+            freed += record.get("size") or 0
+            removed.append(sha256)
+        if max_bytes:
+            for sha256, record in used:
+                if total <= max_bytes:
+                    break
+                self.remove(sha256)
+                total -= record.get("size") or 0
+                removed.append(sha256)
+        return {"removed": removed, "freed_bytes": freed, "bytes": total}
+
+
+_blob_store = None
+
+
+def get_blob_store():
+    """Хранилище по SHA-256 (PDM_BLOB_DIR, по умолчанию <models_dir>/.pdm_blobs), если включено PDM_BLOB_STORE=1, иначе None"""
+    global _blob_store
+    if os.environ.get("PDM_BLOB_STORE", "0") != "1":
+        return None
+    if _blob_store is None:
+        root = os.environ.get("PDM_BLOB_DIR") or os.path.join(folder_paths.models_dir, ".pdm_blobs")
+        max_bytes = int(float(os.environ.get("PDM_BLOB_MAX_GB", "0")) * 1024 ** 3)
+        _blob_store = BlobStore(root, max_bytes)
+    return _blob_store
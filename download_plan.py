@@ -0,0 +1,208 @@
+import os
+import shutil
+import asyncio
+
+from .downloader import filter_repo_files, get_repo_info, repo_file_patterns, resolve_target
+from .http_client import get_proxy, get_session
+from .integrity import normalize_sha256
+from .local_index import get_local_index
+from .metadata_cache import get_metadata_cache
+
+# Порядок загрузки в плане: сначала большие файлы, сначала маленькие или как в пресетах
+PLAN_ORDERS = ("largest", "smallest", "preset")
+
+# Запас свободного места, как при проверке перед загрузкой одного файла
+DISK_SPACE_BUFFER = 1.1
+
+
+def preset_models(preset):
+    """Модели пресета (у старых пресетов модель описана полями самого пресета)"""
+    if preset.get("models") is not None:
+        return [model for model in preset["models"] if isinstance(model, dict)]
+    if preset.get("model_id"):
+        return [{
+            "model_id": preset["model_id"],
+            "model_path": preset.get("model_path") or "",
+            "save_path": preset.get("save_path") or "checkpoints",
+            "hf_token": preset.get("hf_token") or "",
+        }]
+    return []
+
+
+async def _remote_size(url, hf_token=""):
+    """
+    Размер файла по прямой ссылке (HEAD, Content-Length); кэшируется вместе с метаданными HF,
+    но только в памяти: ссылка в ключе может быть подписанной (с токеном в query), на диск она не пишется.
+    """
+    async def _fetch():
+        headers = {"Accept-Encoding": "identity"}
+        if hf_token:
+            headers["Authorization"] = f"Bearer {hf_token}"
+        session = await get_session()
+        async with session.head(url, headers=headers, allow_redirects=True, proxy=get_proxy()) as response:
+            response.raise_for_status()
+            length = response.headers.get("Content-Length")
+            return int(length) if length and length.isdigit() else None
+
+    return await get_metadata_cache().get_or_fetch(f"head:{url}", _fetch, persist=False)
+
+
+async def _model_size(model, hf_token=""):
+    """(размер загрузки в байтах или None, SHA-256 из метаданных HF или None)"""
+    if model.get("size"):
+        return int(model["size"]), None
+    try:
+        if model.get("direct_url"):
+            return await _remote_size(model["direct_url"], hf_token), None
+        info = await get_repo_info(model["model_id"], hf_token, model.get("revision") or None)
+    except Exception as e:
+        print(f"[PresetDownloadManager] ⚠️ Не удалось узнать размер {model.get('direct_url') or model.get('model_id')}: {e}")
+        return None, None
+    siblings = info.get("siblings") or []
+    if model.get("model_path"):
+        for sibling in siblings:
+            if sibling["rfilename"] == model["model_path"]:
+                return sibling["size"], sibling["sha256"]
+        return None, None
+    # Для всего репозитория — только файлы, которые пройдут фильтр шаблонов
+    return sum(sibling["size"] or 0 for sibling in filter_repo_files(siblings, *repo_file_patterns(model))), None
+
+
+def _model_source(model):
+    """Что именно скачивается: ссылка или репозиторий, файл, ревизия и шаблоны файлов"""
+    if model.get("direct_url"):
+        return model["direct_url"]
+    return (model.get("model_id"), model.get("model_path"), model.get("revision")) + repo_file_patterns(model)
+
+
+def _filesystem(path):
+    """(устройство, существующая папка) для пути, который может ещё не существовать"""
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev, path
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                raise
+            path = parent
+
+
+def _sort_items(items, order):
+    if order == "largest":
+        # Файлы неизвестного размера — в конце
+        items.sort(key=lambda item: (item["size"] is None, -(item["size"] or 0)))
+    elif order == "smallest":
+        items.sort(key=lambda item: (item["size"] is None, item["size"] or 0))
+
+
+async def build_plan(presets, order="largest", hf_token=""):
+    """
+    План загрузки набора пресетов.
+
+    Каждая модель сопоставляется с итоговым путём (как в download_model); модели, общие для нескольких
+    пресетов, скачиваются один раз, уже скачанные (по индексу локальных файлов) пропускаются.
+    Размеры оставшихся загрузок суммируются по файловым системам и сравниваются со свободным местом,
+    поэтому нехватка места обнаруживается до начала загрузок, а не на середине набора.
+    """
+    if order not in PLAN_ORDERS:
+        raise ValueError(f"Unknown order: {order} (expected one of {', '.join(PLAN_ORDERS)})")
+
+    entries = {}
+    for preset in presets:
+        preset_id = preset.get("id") or preset.get("name")
+        for model in preset_models(preset):
+            if not model.get("direct_url") and not model.get("model_id"):
+                continue
+            params = dict(model)
+            params.setdefault("save_path", "checkpoints")
+            if hf_token and not params.get("hf_token"):
+                params["hf_token"] = hf_token
+            kind, target = resolve_target(params, create=False)
+            key = os.path.normcase(os.path.normpath(target))
+            entry = entries.get(key)
+            if entry is None:
+                entries[key] = {"model": params, "kind": kind, "target": target, "presets": [preset_id]}
+            else:
+                entry["presets"].append(preset_id)
+                source = _model_source(params)
+                existing = _model_source(entry["model"])
+                if source != existing:
+                    # Разные источники пишут в один файл — скачается первый, остальные показываем как конфликт
+                    entry.setdefault("conflicts", []).append({"preset": preset_id, "model": params})
+
+    loop = asyncio.get_running_loop()
+    local_index = get_local_index()
+    statuses = await loop.run_in_executor(
+        None, lambda: [local_index.model_status(entry["model"]) for entry in entries.values()]
+    )
+
+    items = []
+    present = []
+    for entry, status in zip(entries.values(), statuses):
+        if status["installed"]:
+            present.append({"target": entry["target"], "presets": entry["presets"]})
+        else:
+            items.append(entry)
+
+    sizes = await asyncio.gather(*[
+        _model_size(item["model"], item["model"].get("hf_token", "")) for item in items
+    ])
+    for item, (size, sha256) in zip(items, sizes):
+        item["size"] = size
+        if sha256 and not normalize_sha256(item["model"].get("sha256")):
+            item["model"]["sha256"] = sha256
+
+    filesystems = {}
+    for item in items:
+        device, existing_dir = await loop.run_in_executor(None, _filesystem, item["target"])
+        filesystem = filesystems.get(device)
+        if filesystem is None:
+            usage = await loop.run_in_executor(None, shutil.disk_usage, existing_dir)
+            filesystem = filesystems[device] = {
+                "path": existing_dir,
+                "free_bytes": usage.free,
+                "required_bytes": 0,
+                "unknown_size": 0,
+                "downloads": 0,
+            }
+        filesystem["downloads"] += 1
+        if item["size"] is None:
+            filesystem["unknown_size"] += 1
+        else:
+            filesystem["required_bytes"] += item["size"]
+    for filesystem in filesystems.values():
+        required_with_buffer = int(filesystem["required_bytes"] * DISK_SPACE_BUFFER)
+        filesystem["required_with_buffer"] = required_with_buffer
+        filesystem["ok"] = filesystem["free_bytes"] >= required_with_buffer
+
+    _sort_items(items, order)
+    return {
+        "order": order,
+        "downloads": items,
+        "present": present,
+        "duplicates": sum(len(item["presets"]) - 1 for item in items) + sum(len(item["presets"]) - 1 for item in present),
+        "total_bytes": sum(item["size"] or 0 for item in items),
+        "unknown_size": sum(1 for item in items if item["size"] is None),
+        "filesystems": list(filesystems.values()),
+        "ok": all(filesystem["ok"] for filesystem in filesystems.values()),
+    }
+
+
+def plan_response(plan):
+    """План для API: без токенов доступа в параметрах моделей"""
+    def _public(model):
+        return {key: value for key, value in model.items() if key != "hf_token"}
+
+    downloads = []
+    for item in plan["downloads"]:
+        item = dict(item, model=_public(item["model"]))
+        if item.get("conflicts"):
+            item["conflicts"] = [dict(conflict, model=_public(conflict["model"])) for conflict in item["conflicts"]]
+        downloads.append(item)
+    return dict(plan, downloads=downloads)
+
+
+def execute_plan(plan, job_manager, priority=0):
+    """Ставит загрузки плана в очередь в порядке плана (очередь сохраняет порядок при равном приоритете)"""
+    return [job_manager.submit(item["model"], priority) for item in plan["downloads"]]
@@ -0,0 +1,1480 @@
+import os
+import json
+import hashlib
+import time
+import errno
+import shutil
+import asyncio
+import functools
+import threading
+import contextlib
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import folder_paths
+import aiohttp
+
+from .bandwidth import get_bandwidth_limiter
+from .blob_store import get_blob_store
+from .file_writer import BufferedFileWriter, allocate_file
+from .http_client import get_proxy, get_session
+from .integrity import (IntegrityError, SequentialHasher, get_verification_store, normalize_sha256, sha256_file,
+                        verify_download, verify_file)
+from .metadata_cache import get_metadata_cache
+from .metrics import BLOB_STORE_HITS, BYTES_DOWNLOADED, PEER_DOWNLOADS, TIME_TO_FIRST_BYTE, log_event
+from .mirrors import (get_source_scoreboard, has_mirrors, mirror_token_hosts, mirror_urls, source_speed_floor,
+                      source_token)
+from .peers import claim_download, find_peer_sources, peer_token, peers_enabled
+from .progress import TransferProgress
+from .retry import (HTTPStatusError, RetryPolicy, SlowSourceError, classify, get_circuit_breakers, host_key,
+                    parse_retry_after, record_retry, retry_async)
+
+# Блокирующие вызовы huggingface_hub (hf_hub_download, snapshot_download, model_info)
+# выполняются в отдельном ограниченном пуле потоков, чтобы не замораживать event loop PromptServer
+_hf_executor = None
+
+
+def _get_hf_executor():
+    """Возвращает (лениво создавая) пул потоков для загрузок через huggingface_hub"""
+    global _hf_executor
+    if _hf_executor is None:
+        max_workers = max(1, int(os.environ.get("PDM_HF_WORKERS", "4")))
+        _hf_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pdm-hf")
+    return _hf_executor
+
+
+async def _run_blocking(func, *args, **kwargs):
+    """Выполняет блокирующую функцию в пуле потоков huggingface_hub и ожидает результат"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_hf_executor(), functools.partial(func, *args, **kwargs))
+
+
+# Типы папок, которые поддерживаются через folder_paths.get_folder_paths()
+# Для остальных стандартных папок (например, diffusion_models) используем models_dir
+SUPPORTED_FOLDER_TYPES = {
+    "checkpoints": "checkpoints",
+    "loras": "loras",
+    "vae": "vae",
+    "clip": "clip",
+    "controlnet": "controlnet",
+    "upscale_models": "upscale_models",
+    "embeddings": "embeddings",
+    "hypernetworks": "hypernetworks",
+    "diffusers": "diffusers",
+    "onnx": "onnx",
+    "unet": "unet",
+    "clip_vision": "clip_vision",
+    "style_models": "style_models",
+    "vae_approx": "vae_approx",
+    "ipadapter": "ipadapter",
+    "gligen": "gligen",
+    "text_encoders": "text_encoders",
+    "audio_encoders": "audio_encoders",
+    "configs": "configs",
+    "model_patches": "model_patches",
+    "photomaker": "photomaker",
+    "sams": "sams",
+    "vibevoice": "vibevoice"
+}
+
+# Типы папок, для которых get_folder_paths возвращает неправильный путь
+# Всегда используем models_dir для этих типов
+FORCE_MODELS_DIR_TYPES = {"diffusion_models"}
+
+
+def resolve_base_path(save_path, create=True):
+    """Определяет папку сохранения по типу (save_path), создавая её при необходимости (если create)"""
+    # Определяем путь сохранения
+    save_path_lower = save_path.lower().strip()
+    base_path = None
+
+    # Для проблемных типов сразу используем models_dir
+    if save_path_lower in FORCE_MODELS_DIR_TYPES:
+        pass  # base_path останется None, будет использован fallback
+    # Пробуем получить путь через folder_paths только для поддерживаемых типов
+    elif save_path_lower in SUPPORTED_FOLDER_TYPES:
+        folder_type = SUPPORTED_FOLDER_TYPES[save_path_lower]
+        try:
+            paths = folder_paths.get_folder_paths(folder_type)
+            if paths and len(paths) > 0 and paths[0] and paths[0].strip():
+                # Проверяем, что путь действительно содержит название нужной папки
+                # Это защита от случаев, когда get_folder_paths возвращает неправильный путь
+                returned_path = paths[0].strip()
+                if save_path_lower in returned_path.lower():
+                    base_path = returned_path
+                    # Папка из folder_paths может ещё не существовать (новый контейнер, extra_model_paths)
+                    if create:
+                        os.makedirs(base_path, exist_ok=True)
+        except Exception:
+            pass
+
+    # Fallback: используем models_dir с подпапкой
+    # Это работает для всех типов: стандартных, которые не поддерживаются get_folder_paths
+    # (например, diffusion_models), и нестандартных (кастомные папки)
+    if not base_path or not base_path.strip():
+        models_dir = folder_paths.models_dir
+        # Создаём подпапку с именем типа, если её нет
+        target_dir = os.path.join(models_dir, save_path)
+        if create:
+            os.makedirs(target_dir, exist_ok=True)
+        base_path = target_dir
+
+    return base_path
+
+
+def resolve_target(data, create=True):
+    """
+    Куда будет скачана модель: ("file", путь к файлу) для прямой ссылки и файла репозитория
+    или ("dir", папка модели) для всего репозитория.
+    """
+    direct_url = data.get("direct_url")
+    model_id = data.get("model_id") or ""
+    model_path = data.get("model_path", "")
+    base_path = resolve_base_path(data.get("save_path", "checkpoints"), create)
+
+    if direct_url:
+        # Определяем имя файла из URL
+        filename = os.path.basename(urlparse(direct_url).path)
+        if not filename or filename == "/":
+            filename = "downloaded_file"
+        return "file", os.path.join(base_path, filename)
+    if model_path:
+        # Определяем имя файла из model_path
+        filename = os.path.basename(model_path)
+        if not filename:
+            # Если не удалось определить имя из пути, используем имя репозитория
+            filename = model_id.split("/")[-1] + ".safetensors"
+        return "file", os.path.join(base_path, filename)
+    # Вся модель сохраняется в подпапку с именем модели
+    return "dir", os.path.join(base_path, model_id.split("/")[-1])
+
+
+# Скрытая папка внутри папки моделей для промежуточных файлов huggingface_hub:
+# она на той же файловой системе, что и итоговый файл, поэтому перенос — это os.replace без копирования
+STAGING_DIR_NAME = ".pdm_staging"
+
+# Время запуска: папки staging старше него остались от прерванных загрузок прошлых запусков
+_started_at = time.time()
+
+
+def _staging_root(base_path):
+    return os.path.join(base_path, STAGING_DIR_NAME)
+
+
+def _staging_dir(base_path, model_id, revision, model_path):
+    """
+    Папка staging файла репозитория. Она одна и та же для (репозиторий, ревизия, файл), поэтому повторная
+    попытка продолжает недокачанный файл huggingface_hub; удаляется после успешной загрузки
+    или cleanup_staging_dirs.
+    """
+    key = hashlib.sha256(f"{model_id}@{revision or ''}:{model_path}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(_staging_root(base_path), key)
+
+
+def cleanup_staging_dirs():
+    """Удаляет папки staging, оставшиеся от прерванных загрузок (вызывается при запуске сервера)"""
+    roots = set()
+    for folder_type in SUPPORTED_FOLDER_TYPES.values():
+        try:
+            roots.update(folder_paths.get_folder_paths(folder_type))
+        except Exception:
+            pass
+    models_dir = folder_paths.models_dir
+    try:
+        roots.update(os.path.join(models_dir, name) for name in os.listdir(models_dir))
+    except OSError:
+        pass
+
+    removed = 0
+    for root in roots:
+        staging_root = _staging_root(root)
+        try:
+            entries = os.listdir(staging_root)
+        except OSError:
+            continue
+        for name in entries:
+            path = os.path.join(staging_root, name)
+            try:
+                if os.path.getmtime(path) >= _started_at:
+                    continue  # Папка загрузки, начатой уже в этом запуске
+            except OSError:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+        try:
+            os.rmdir(staging_root)
+        except OSError:
+            pass
+    if removed:
+        print(f"[PresetDownloadManager] Удалено незавершённых временных папок загрузки: {removed}")
+    return removed
+
+
+# Список файлов полностью скачанного репозитория: по нему проверяется, что модель уже скачана, когда
+# HuggingFace недоступен
+REPO_MARKER_NAME = ".pdm_complete.json"
+
+
+def _repo_files_present(target_dir, files):
+    """Все ли файлы репозитория (записи siblings) есть в target_dir; размер сверяется, если известен"""
+    for sibling in files:
+        try:
+            size = os.path.getsize(os.path.join(target_dir, *sibling["rfilename"].split("/")))
+        except OSError:
+            return False
+        if sibling.get("size") is not None and size != sibling["size"]:
+            return False
+    return True
+
+
+def _read_repo_marker(target_dir, marker):
+    """Файлы из списка прошлой загрузки, если она была для того же репозитория, ревизии и шаблонов"""
+    try:
+        with open(os.path.join(target_dir, REPO_MARKER_NAME), 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(saved, dict) or any(saved.get(key) != value for key, value in marker.items()):
+        return None
+    return saved.get("files") or None
+
+
+def _write_repo_marker(target_dir, marker, files):
+    """Записывает список файлов скачанного репозитория (без списка с HuggingFace — файлы из папки)"""
+    if files is None:
+        files = []
+        for root, dirs, names in os.walk(target_dir):
+            dirs[:] = [name for name in dirs if not name.startswith(".")]
+            for name in names:
+                if name.startswith(".") or is_partial_file(name):
+                    continue
+                path = os.path.join(root, name)
+                files.append({
+                    "rfilename": os.path.relpath(path, target_dir).replace(os.sep, "/"),
+                    "size": os.path.getsize(path),
+                })
+    try:
+        with open(os.path.join(target_dir, REPO_MARKER_NAME), 'w', encoding='utf-8') as f:
+            json.dump(dict(marker, files=[{"rfilename": item["rfilename"], "size": item.get("size")} for item in files]), f)
+    except OSError as e:
+        print(f"[PresetDownloadManager] ⚠️ Не удалось записать список файлов модели: {e}")
+
+
+HTML_RESPONSE_ERROR = (
+    "Server returned HTML page instead of file. This usually means:\n"
+    "1. The URL requires authentication (check if you need HuggingFace API Token)\n"
+    "2. The file doesn't exist or was moved\n"
+    "3. The URL is incorrect\n\n"
+    "Response preview: {preview}"
+)
+
+
+class _RangeNotSupported(Exception):
+    """Сервер не поддерживает (или перестал поддерживать) загрузку по диапазонам"""
+
+
+def is_partial_file(name):
+    """Недокачанный файл (.part) или его состояние (.part.json)"""
+    return name.endswith(".part") or name.endswith(".part.json")
+
+
+def _remove_quietly(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _load_part_state(state_path, url):
+    """Читает валидаторы (ETag/Last-Modified, размер) недокачанного файла, если они относятся к этому URL"""
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(state, dict) or state.get("url") != url:
+        return {}
+    return state
+
+
+def _save_part_state(state_path, state):
+    with open(state_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+
+
+def _part_state_url(state_path):
+    """С какого источника качался недокачанный файл (None, если загрузки не было)"""
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state.get("url") if isinstance(state, dict) else None
+
+
+def _switch_part_source(part_path, state_path, url, keep):
+    """
+    Переносит недокачанный файл на другой источник. Если keep, скачанные части сохраняются
+    (валидаторы старого источника сбрасываются — целостность проверит SHA-256), иначе загрузка начнётся заново.
+    """
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = None
+    if not keep or not isinstance(state, dict):
+        _remove_quietly(part_path, state_path)
+        return
+    state.update(url=url, etag=None, last_modified=None)
+    _save_part_state(state_path, state)
+
+
+def _parse_content_range(value):
+    """Разбирает заголовок Content-Range вида 'bytes 100-199/1000' в (start, end, total)"""
+    try:
+        unit, _, spec = (value or "").partition(" ")
+        byte_range, _, total = spec.partition("/")
+        start, _, end = byte_range.partition("-")
+        if unit.strip().lower() != "bytes":
+            return None
+        return int(start), int(end), (int(total) if total and total != "*" else None)
+    except ValueError:
+        return None
+
+
+async def _read_error_response(response):
+    """Формирует сообщение об ошибке из ответа сервера с кодом, отличным от 200/206"""
+    # Проверяем Content-Type перед чтением ответа
+    content_type = response.headers.get('Content-Type', '').lower()
+    if 'application/json' in content_type:
+        try:
+            error_data = await response.json()
+            return error_data.get('error', error_data.get('message', str(error_data)))
+        except Exception:
+            pass
+    # Если это HTML или другой тип, читаем только первые 500 символов
+    error_text = await response.text()
+    if len(error_text) > 500:
+        error_text = error_text[:500] + "..."
+    return f"HTTP {response.status}: {error_text}"
+
+
+async def _http_error(response):
+    """Исключение для ответа с кодом ошибки (с кодом и Retry-After для политики повторов)"""
+    return HTTPStatusError(
+        await _read_error_response(response), response.status, parse_retry_after(response.headers.get('Retry-After'))
+    )
+
+
+async def _fetch_to_part(url, part_path, state_path, hf_token, progress):
+    """
+    Одна попытка загрузки в .part файл.
+    Если .part уже есть и известны его валидаторы, докачивает оставшуюся часть через Range/If-Range.
+    Возвращает SHA-256 файла, посчитанный во время загрузки (None, если файл уже был докачан).
+    """
+    state = _load_part_state(state_path, url)
+    if state.get("segments"):
+        # Файл сегментной загрузки выделен на полный размер — продолжить его одним потоком нельзя
+        _remove_quietly(part_path, state_path)
+        state = {}
+    offset = os.path.getsize(part_path) if state and os.path.exists(part_path) else 0
+
+    # SHA-256 считается на лету; при докачке сначала хешируем уже скачанную часть
+    hasher = hashlib.sha256()
+    if offset:
+        await asyncio.get_running_loop().run_in_executor(None, sha256_file, part_path, hasher, offset)
+
+    headers = {"Accept-Encoding": "identity"}
+    if hf_token:
+        headers["Authorization"] = f"Bearer {hf_token}"
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        # If-Range: если файл на сервере изменился, сервер вернёт его целиком (200) вместо части
+        etag = state.get("etag")
+        validator = etag if etag and not etag.startswith("W/") else state.get("last_modified")
+        if validator:
+            headers["If-Range"] = validator
+
+    host = urlparse(url).hostname
+    session = await get_session()
+    request_started = time.monotonic()
+    async with session.get(url, headers=headers, allow_redirects=True, proxy=get_proxy()) as response:
+        TIME_TO_FIRST_BYTE.observe(time.monotonic() - request_started, host=host)
+        if offset and response.status == 416:
+            # Запрошенный диапазон за пределами файла: либо файл уже докачан, либо он изменился
+            if state.get("total") == offset:
+                progress.set_total(offset)
+                progress.set_bytes(offset)
+                return None
+            _remove_quietly(part_path, state_path)
+            return await _fetch_to_part(url, part_path, state_path, hf_token, progress)
+
+        if response.status not in (200, 206):
+            raise await _http_error(response)
+        get_circuit_breakers().record_success(url)
+
+        if response.status == 206:
+            content_range = _parse_content_range(response.headers.get('Content-Range'))
+            if not offset or content_range is None or content_range[0] != offset:
+                # Сервер вернул не тот диапазон — докачка невозможна, начинаем с нуля
+                _remove_quietly(part_path, state_path)
+                return await _fetch_to_part(url, part_path, state_path, hf_token, progress)
+            total_size = content_range[2]
+        else:
+            # Сервер отдал файл целиком (Range не поддерживается или файл изменился)
+            offset = 0
+            hasher = hashlib.sha256()
+            total_size = int(response.headers.get('Content-Length', 0)) or None
+
+        # Проверяем, что это действительно файл, а не HTML страница
+        content_type = response.headers.get('Content-Type', '').lower()
+
+        # Если Content-Type указывает на HTML, это ошибка
+        if 'text/html' in content_type:
+            error_text = await response.text()
+            raise Exception(HTML_RESPONSE_ERROR.format(preview=error_text[:300]))
+
+        # Читаем первые байты для проверки (независимо от Content-Type)
+        # Это нужно, так как некоторые серверы могут не указывать правильный Content-Type
+        first_bytes = await response.content.read(1024)
+
+        # Проверяем, не является ли ответ HTML страницей (только для начала файла)
+        head = first_bytes.lstrip()[:9].lower()
+        if not offset and (head.startswith(b'<!doctype') or head.startswith(b'<html')):
+            error_text = first_bytes.decode('utf-8', errors='ignore')
+            raise Exception(HTML_RESPONSE_ERROR.format(preview=error_text[:300]))
+
+        # Запоминаем валидаторы, чтобы при обрыве можно было безопасно докачать файл
+        _save_part_state(state_path, {
+            "url": url,
+            "etag": response.headers.get('ETag') or state.get("etag"),
+            "last_modified": response.headers.get('Last-Modified') or state.get("last_modified"),
+            "total": total_size,
+        })
+
+        downloaded = offset + len(first_bytes)
+        progress.set_total(total_size)
+        progress.set_bytes(downloaded)
+
+        limiter = get_bandwidth_limiter()
+        BYTES_DOWNLOADED.inc(len(first_bytes), host=host)
+        await limiter.throttle(host, len(first_bytes))
+
+        # Запись идёт в отдельном потоке крупными блоками, чтобы не блокировать event loop
+        async with BufferedFileWriter(part_path, 'ab' if offset else 'wb', on_write=hasher.update) as writer:
+            # Записываем первые байты, которые мы уже прочитали
+            await writer.write(first_bytes)
+
+            # Продолжаем скачивание остальной части файла
+            async for chunk in response.content.iter_chunked(writer.buffer_size):
+                await writer.write(chunk)
+                downloaded += len(chunk)
+                progress.advance(len(chunk))
+                BYTES_DOWNLOADED.inc(len(chunk), host=host)
+                await limiter.throttle(host, len(chunk))
+
+        if total_size and downloaded != total_size:
+            raise aiohttp.ClientPayloadError(
+                f"Connection closed before download completed ({downloaded} of {total_size} bytes)"
+            )
+
+    return hasher.hexdigest()
+
+
+def _segment_settings():
+    """Количество соединений и размер сегмента (одного Range-запроса) для многопоточной загрузки одного файла"""
+    connections = max(1, int(os.environ.get("PDM_SEGMENTS", "1")))
+    min_segment_size = max(1, int(os.environ.get("PDM_MIN_SEGMENT_SIZE_MB", "32"))) * 1024 * 1024
+    return connections, min_segment_size
+
+
+def _range_headers(hf_token, start, end, state):
+    headers = {"Accept-Encoding": "identity", "Range": f"bytes={start}-{end}"}
+    if hf_token:
+        headers["Authorization"] = f"Bearer {hf_token}"
+    etag = state.get("etag")
+    validator = etag if etag and not etag.startswith("W/") else state.get("last_modified")
+    if validator:
+        headers["If-Range"] = validator
+    return headers
+
+
+async def _fetch_segment(session, url, part_path, state, segment, hf_token, progress, hasher):
+    """
+    Докачивает один сегмент [start, end] в заранее выделенный .part файл с собственными повторами.
+    segment — список [start, end, done], done обновляется по мере записи; записанные блоки передаются hasher.
+    """
+    policy = RetryPolicy()
+    retry_delay = policy.base_delay
+    limiter = get_bandwidth_limiter()
+    host = urlparse(url).hostname
+
+    for attempt in range(policy.max_attempts):
+        start, end, done = segment
+        if start + done > end:
+            return
+        try:
+            headers = _range_headers(hf_token, start + done, end, state)
+            # Сегментов может быть больше, чем разрешено соединений с хостом — лишние ждут своей очереди
+            async with limiter.connection(host):
+                request_started = time.monotonic()
+                async with session.get(url, headers=headers, allow_redirects=True, proxy=get_proxy()) as response:
+                    TIME_TO_FIRST_BYTE.observe(time.monotonic() - request_started, host=host)
+                    if response.status != 206:
+                        if response.status == 200:
+                            # Файл на сервере изменился (If-Range не совпал) — сегменты больше не согласованы
+                            raise _RangeNotSupported("File changed on server during segmented download")
+                        raise await _http_error(response)
+                    content_range = _parse_content_range(response.headers.get('Content-Range'))
+                    if content_range is None or content_range[0] != start + done:
+                        raise _RangeNotSupported("Server returned an unexpected Content-Range")
+                    get_circuit_breakers().record_success(url)
+
+                    async with BufferedFileWriter(part_path, 'r+b', offset=start + done,
+                                                  on_write=hasher.writer(start + done)) as writer:
+                        async for chunk in response.content.iter_chunked(writer.buffer_size):
+                            chunk = chunk[:end + 1 - (start + segment[2])]
+                            await writer.write(chunk)
+                            segment[2] += len(chunk)
+                            progress.advance(len(chunk))
+                            BYTES_DOWNLOADED.inc(len(chunk), host=host)
+                            await limiter.throttle(host, len(chunk))
+                            if start + segment[2] > end:
+                                break
+
+            if start + segment[2] <= end:
+                raise aiohttp.ClientPayloadError(f"Connection closed before segment {start}-{end} completed")
+            return
+
+        except _RangeNotSupported:
+            raise
+        except Exception as e:
+            failure = classify(e)
+            if policy.should_retry(failure, attempt):
+                retry_delay = policy.next_delay(retry_delay, failure)
+                record_retry("segment", e, attempt, url, retry_delay)
+                await asyncio.sleep(retry_delay)
+                continue
+            raise
+
+
+async def _fetch_segmented(url, part_path, state_path, hf_token, progress):
+    """
+    Загружает файл параллельно несколькими Range-запросами в заранее выделенный (разреженный) .part файл.
+    Файл делится на сегменты по PDM_MIN_SEGMENT_SIZE_MB, соединения берут их по порядку, поэтому
+    SHA-256 считается во время загрузки: сегменты впереди границы хеша ждут её в памяти (SequentialHasher).
+    Возвращает SHA-256 файла или None, если сервер не поддерживает Range или файл слишком мал —
+    тогда используется один поток.
+    """
+    connections, segment_size = _segment_settings()
+    state = _load_part_state(state_path, url)
+    if os.path.exists(part_path) and not state.get("segments"):
+        # Есть недокачанный файл обычной загрузки — продолжаем его в один поток
+        return None
+
+    session = await get_session()
+    if not state.get("segments") or not os.path.exists(part_path):
+        # Проверяем поддержку Range и узнаём размер запросом первого байта
+        async with get_bandwidth_limiter().connection(urlparse(url).hostname), \
+                session.get(url, headers=_range_headers(hf_token, 0, 0, {}), allow_redirects=True, proxy=get_proxy()) as response:
+            content_range = _parse_content_range(response.headers.get('Content-Range'))
+            content_type = response.headers.get('Content-Type', '').lower()
+            if response.status != 206 or content_range is None or not content_range[2] or 'text/html' in content_type:
+                return None
+            total_size = content_range[2]
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+
+        if total_size < 2 * segment_size:
+            return None
+
+        segments = [
+            [start, min(start + segment_size, total_size) - 1, 0]
+            for start in range(0, total_size, segment_size)
+        ]
+        state = {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "total": total_size,
+            "segments": segments,
+        }
+        # Выделяем файл полного размера сразу: сегменты пишутся по своим смещениям
+        await asyncio.get_running_loop().run_in_executor(None, allocate_file, part_path, total_size)
+        _save_part_state(state_path, state)
+
+    total_size = state["total"]
+    progress.set_total(total_size)
+    progress.set_bytes(sum(segment[2] for segment in state["segments"]))
+
+    hasher = SequentialHasher()
+    remaining = collections.deque(segment for segment in state["segments"] if segment[0] + segment[2] <= segment[1])
+
+    async def _worker():
+        # Следующий по порядку сегмент — так недокачанные данные держатся у границы хеша
+        while remaining:
+            await _fetch_segment(session, url, part_path, state, remaining.popleft(), hf_token, progress, hasher)
+
+    workers = [asyncio.ensure_future(_worker()) for _index in range(min(connections, len(remaining)))]
+    try:
+        await asyncio.gather(*workers)
+    except _RangeNotSupported:
+        _remove_quietly(part_path, state_path)
+        return None
+    finally:
+        for worker in workers:
+            worker.cancel()
+        # Сохраняем, сколько скачано в каждом сегменте, чтобы следующая попытка продолжила с этого места
+        if os.path.exists(part_path):
+            _save_part_state(state_path, state)
+
+    # С диска дочитываются только данные прошлых попыток и не поместившиеся в PDM_HASH_BUFFER_MB
+    return await asyncio.get_running_loop().run_in_executor(None, hasher.finish, part_path, total_size)
+
+
+async def _guard_speed(coro, progress):
+    """
+    Выполняет попытку загрузки и прерывает её (SlowSourceError), если за окно PDM_SLOW_SOURCE_WINDOW
+    скачано меньше, чем позволяет PDM_MIN_SOURCE_SPEED_KB.
+    """
+    floor, window = source_speed_floor()
+    task = asyncio.ensure_future(coro)
+    if not floor:
+        return await task
+    try:
+        while True:
+            downloaded = progress.downloaded
+            done, _pending = await asyncio.wait({task}, timeout=window)
+            if done:
+                return task.result()
+            speed = (progress.downloaded - downloaded) / window
+            if speed < floor:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                raise SlowSourceError(f"Source is too slow: {speed / 1024:.0f} KB/s (minimum {floor / 1024:.0f} KB/s)")
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+async def _download_direct(url, target_file_path, hf_token, progress, expected_sha256=None, expected_size=None,
+                           mirrors=None, max_retries=None, token_hosts=None, source=None):
+    """
+    Скачивает файл по прямой ссылке.
+    Данные пишутся в <файл>.part (валидаторы — в <файл>.part.json), при повторах и повторных вызовах
+    загрузка продолжается с места обрыва, а готовый файл атомарно переименовывается в target_file_path.
+    При PDM_SEGMENTS > 1 большие файлы качаются параллельно несколькими Range-запросами.
+    Если известны expected_sha256/expected_size, файл проверяется до переименования;
+    при несовпадении он удаляется и скачивается заново. Возвращает (путь, SHA-256 или None).
+
+    mirrors — другие ссылки на тот же файл. Источники упорядочиваются по таблице оценок (с пробой
+    неизвестных), а при ошибке или скорости ниже PDM_MIN_SOURCE_SPEED_KB загрузка переходит на следующий.
+    Скачанная часть при смене источника сохраняется, если файл проверяется по SHA-256.
+    max_retries — число попыток (по умолчанию PDM_MAX_RETRIES, с зеркалами — не меньше двух на источник).
+    token_hosts — хосты, которым отправляется hf_token (по умолчанию только хост url): зеркала не получают
+    чужой токен. source (url:... / hf:repo@revision:path) запоминается в записи о проверке файла,
+    чтобы соседние узлы находили файл по источнику.
+    """
+    # Повторы по общей политике: паузы с jitter, Retry-After, выключатель хоста
+    policy = RetryPolicy(max_attempts=max_retries)
+    retry_limit = policy.max_attempts
+    retry_delay = policy.base_delay
+    breakers = get_circuit_breakers()
+
+    part_path = target_file_path + ".part"
+    state_path = part_path + ".json"
+    scoreboard = get_source_scoreboard()
+    sources = list(dict.fromkeys([url] + list(mirrors or [])))
+    if token_hosts is None:
+        token_hosts = {host_key(url)}
+    if len(sources) > 1:
+        sources = await scoreboard.rank_sources(sources, hf_token, token_hosts)
+        # Недокачанный файл продолжаем с того же источника (его валидаторы сохранены)
+        resumed_url = _part_state_url(state_path)
+        if resumed_url in sources:
+            sources.remove(resumed_url)
+            sources.insert(0, resumed_url)
+        if not max_retries:
+            retry_limit = max(retry_limit, 2 * len(sources))
+    source_index = 0
+    url = sources[0]
+    round_failures = []
+    use_segments = _segment_settings()[0] > 1 or bool(_load_part_state(state_path, url).get("segments"))
+
+    async def _attempt(url, use_segments):
+        token = source_token(url, hf_token, token_hosts)
+        digest = None
+        if use_segments:
+            digest = await _fetch_segmented(url, part_path, state_path, token, progress)
+        if digest is None:
+            async with get_bandwidth_limiter().connection(urlparse(url).hostname):
+                return False, await _fetch_to_part(url, part_path, state_path, token, progress)
+        return True, digest
+
+    # Пробуем загрузить с повторными попытками
+    for attempt in range(retry_limit):
+        attempt_started = time.monotonic()
+        attempt_bytes = progress.downloaded
+        try:
+            breakers.check(url)
+            attempt_coro = _attempt(url, use_segments)
+            completed, digest = await (_guard_speed(attempt_coro, progress) if len(sources) > 1 else attempt_coro)
+            # Если сегментная загрузка невозможна, дальше качаем в один поток
+            use_segments = completed
+            digest = await verify_download(part_path, digest, expected_sha256, expected_size)
+            scoreboard.record_transfer(url, progress.downloaded - attempt_bytes, time.monotonic() - attempt_started)
+            os.replace(part_path, target_file_path)
+            _remove_quietly(state_path)
+            if digest:
+                get_verification_store().record(target_file_path, digest, source)
+            return target_file_path, digest
+
+        except Exception as e:
+            if isinstance(e, IntegrityError):
+                # Повреждённый файл удаляем; с зеркалами он качается заново со следующего источника
+                _remove_quietly(part_path, state_path)
+                if len(sources) < 2:
+                    if attempt < retry_limit - 1:
+                        record_retry("direct", e, attempt, url, 0)
+                        continue
+                    raise
+            failure = classify(e)
+            breakers.record_failure(url, failure)
+            if len(sources) > 1:
+                # Переходим на следующий источник; пауза — только когда не ответил ни один
+                scoreboard.record_failure(url, e)
+                round_failures.append(failure)
+                round_failed = len(round_failures) >= len(sources)
+                if attempt < retry_limit - 1 and (
+                    not round_failed or any(policy.allows(item) for item in round_failures)
+                ):
+                    if round_failed:
+                        retry_delay = policy.next_delay(
+                            retry_delay, max(round_failures, key=lambda item: item.retry_after or 0)
+                        )
+                        round_failures = []
+                        record_retry("direct", e, attempt, url, retry_delay)
+                        await asyncio.sleep(retry_delay)
+                    else:
+                        record_retry("direct", e, attempt, url, 0)
+                    source_index += 1
+                    next_url = sources[source_index % len(sources)]
+                    if next_url != url:
+                        print(f"[PresetDownloadManager] ⚠️ Переключение на другой источник: {next_url.split('?')[0]} ({e})")
+                        _switch_part_source(part_path, state_path, next_url, bool(expected_sha256))
+                        log_event("source_switch", url=next_url.split("?")[0], previous=url.split("?")[0],
+                                  error=str(e)[:300])
+                        url = next_url
+                        use_segments = _segment_settings()[0] > 1 or bool(
+                            _load_part_state(state_path, url).get("segments")
+                        )
+                    continue
+                raise
+            # Временные ошибки (таймауты, обрывы, 5xx, 429) повторяем, постоянные (401/403/404) — сразу наверх
+            if policy.should_retry(failure, attempt):
+                retry_delay = policy.next_delay(retry_delay, failure)
+                record_retry("direct", e, attempt, url, retry_delay)
+                await asyncio.sleep(retry_delay)
+                continue
+            raise
+
+
+async def _download_with_peers(url, target_file_path, hf_token, progress, expected_sha256=None,
+                               expected_size=None, mirrors=None, source=None, token_hosts=None):
+    """
+    Как _download_direct, но сначала файл ищется у соседних узлов (PDM_PEERS) по SHA-256 или источнику
+    (source — ключ вида url:... / hf:repo@revision:path). Если файл есть у узлов, он качается с них
+    по локальной сети; если его качает узел, начавший раньше, — дожидаемся его. Если узлы не помогли,
+    файл качается из источника (скачанное с узлов сохраняется, когда SHA-256 файла известен заранее).
+    """
+    if not peers_enabled():
+        return await _download_direct(url, target_file_path, hf_token, progress, expected_sha256, expected_size, mirrors,
+                                      token_hosts=token_hosts, source=source)
+
+    part_path = target_file_path + ".part"
+    with claim_download(expected_sha256, source, progress) as started_at:
+        found = await find_peer_sources(expected_sha256, source, started_at)
+        if found:
+            peer_sources, sha256, size = found
+            try:
+                result = await _download_direct(
+                    peer_sources[0], target_file_path, peer_token(), progress, sha256, expected_size or size,
+                    peer_sources[1:], max_retries=len(peer_sources),
+                    token_hosts={host_key(peer_source) for peer_source in peer_sources}, source=source
+                )
+                PEER_DOWNLOADS.inc(result="hit")
+                log_event("peer_download", url=peer_sources[0], sha256=sha256)
+                return result
+            except Exception as e:
+                print(f"[PresetDownloadManager] ⚠️ Не удалось скачать файл с соседних узлов, качаем из источника: {e}")
+                PEER_DOWNLOADS.inc(result="fallback")
+                log_event("peer_fallback", sha256=sha256, error=str(e)[:300])
+                _switch_part_source(part_path, part_path + ".json", url,
+                                    bool(expected_sha256) and normalize_sha256(expected_sha256) == sha256)
+        else:
+            PEER_DOWNLOADS.inc(result="miss")
+        return await _download_direct(url, target_file_path, hf_token, progress, expected_sha256, expected_size, mirrors,
+                                      token_hosts=token_hosts, source=source)
+
+
+def _directory_size(path):
+    """Суммарный размер файлов в папке (включая недокачанные файлы huggingface_hub)"""
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+async def _track_directory_progress(path, progress):
+    """
+    Обновляет прогресс по объёму файлов в папке.
+    huggingface_hub не сообщает о прогрессе, поэтому следим за файлами на диске.
+    """
+    loop = asyncio.get_running_loop()
+    baseline = await loop.run_in_executor(None, _directory_size, path)
+    progress.set_bytes(0)
+    while True:
+        await asyncio.sleep(progress.interval)
+        size = await loop.run_in_executor(None, _directory_size, path)
+        progress.set_bytes(max(progress.downloaded, size - baseline))
+
+
+async def _run_with_directory_progress(path, progress, func, *args, **kwargs):
+    """Выполняет блокирующую загрузку в пуле потоков, отслеживая прогресс по папке"""
+    tracker = asyncio.ensure_future(_track_directory_progress(path, progress))
+    try:
+        return await _run_blocking(func, *args, **kwargs)
+    finally:
+        tracker.cancel()
+
+
+def _lfs_sha256(sibling):
+    """SHA-256 файла из LFS метаданных репозитория (есть только у LFS файлов)"""
+    lfs = getattr(sibling, "lfs", None)
+    if lfs is None:
+        return None
+    sha256 = getattr(lfs, "sha256", None)
+    if sha256 is None and isinstance(lfs, dict):
+        sha256 = lfs.get("sha256")
+    return normalize_sha256(sha256)
+
+
+async def _existing_file_result(target_file_path, expected_sha256=None, expected_size=None):
+    """
+    Если файл уже скачан (и совпадает с ожидаемыми размером/SHA-256), возвращает ответ о пропуске загрузки.
+    Несовпадающий файл удаляется, чтобы скачать его заново.
+    """
+    if not (os.path.exists(target_file_path) and os.path.isfile(target_file_path)):
+        return None
+    try:
+        digest = await verify_file(target_file_path, expected_sha256, expected_size)
+    except IntegrityError as e:
+        print(f"[PresetDownloadManager] ⚠️ {e}, файл будет скачан заново")
+        _remove_quietly(target_file_path)
+        return None
+
+    file_size = os.path.getsize(target_file_path)
+    result = {
+        "status": "success",
+        "path": str(target_file_path),
+        "message": f"File already exists ({file_size} bytes{', SHA-256 verified' if digest else ''}), skipped download"
+    }
+    if digest:
+        result["sha256"] = digest
+    return result
+
+
+async def get_repo_info(model_id, hf_token="", revision=None):
+    """
+    Файлы репозитория HuggingFace (имя, размер, LFS SHA-256) из кэша метаданных.
+    Одновременные запросы одного репозитория объединяются в один вызов model_info.
+    """
+    def _fetch():
+        from huggingface_hub import model_info
+
+        info = model_info(model_id, revision=revision, token=hf_token if hf_token else None, files_metadata=True)
+        return {
+            "sha": getattr(info, "sha", None),
+            "siblings": [
+                {"rfilename": sibling.rfilename, "size": sibling.size, "sha256": _lfs_sha256(sibling)}
+                for sibling in (getattr(info, "siblings", None) or [])
+            ],
+        }
+
+    # Метаданные приватных репозиториев кэшируются отдельно для каждого токена
+    key = f"repo:{model_id}"
+    if revision:
+        key += f"@{revision}"
+    if hf_token:
+        key += ":" + hashlib.sha256(hf_token.encode("utf-8")).hexdigest()[:12]
+    return await get_metadata_cache().get_or_fetch(key, lambda: _run_blocking(_fetch))
+
+
+
+def hf_endpoint():
+    """Адрес HuggingFace (HF_ENDPOINT — зеркало или локальный сервер)"""
+    return os.environ.get("HF_ENDPOINT", "https://huggingface.co").rstrip("/")
+
+
+async def search_models(query, limit=10):
+    """
+    Поиск моделей на HuggingFace; одинаковые запросы (например, при наборе текста) отдаются из кэша.
+    Ответы 429/5xx повторяются по общей политике, но не дольше нескольких секунд — пользователь ждёт ответа.
+    """
+    async def _request():
+        session = await get_session()
+        params = {
+            "search": query,
+            "limit": limit,
+            "sort": "downloads",
+            "direction": -1
+        }
+        async with session.get(f"{hf_endpoint()}/api/models", params=params, proxy=get_proxy()) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def _fetch():
+        return await retry_async(
+            _request, host=hf_endpoint(), path="search",
+            policy=RetryPolicy(max_attempts=3, base_delay=0.5, max_delay=5, max_retry_after=10)
+        )
+
+    return await get_metadata_cache().get_or_fetch(
+        f"search:{limit}:{query.strip().lower()}",
+        _fetch,
+        ttl=float(os.environ.get("PDM_SEARCH_CACHE_TTL", "300"))
+    )
+
+
+_hub_timeout_lock = threading.Lock()
+_hub_timeout_users = 0
+_hub_timeout_saved = None
+
+
+@contextlib.contextmanager
+def _hub_download_timeout(timeout):
+    """
+    hf_hub_download/snapshot_download не принимают timeout=: etag_timeout ограничивает только запрос
+    метаданных, а таймаут чтения самого файла берётся из constants.HF_HUB_DOWNLOAD_TIMEOUT (10 с по умолчанию).
+    На время загрузок менеджера подставляем туда PDM_DOWNLOAD_TIMEOUT (если пользователь не задал
+    HF_HUB_DOWNLOAD_TIMEOUT сам), а когда завершается последняя из них — возвращаем прежнее значение,
+    чтобы не менять таймаут другим пользователям huggingface_hub в процессе.
+    """
+    global _hub_timeout_users, _hub_timeout_saved
+    if os.environ.get("HF_HUB_DOWNLOAD_TIMEOUT"):
+        yield
+        return
+    from huggingface_hub import constants
+
+    with _hub_timeout_lock:
+        if _hub_timeout_users == 0:
+            _hub_timeout_saved = constants.HF_HUB_DOWNLOAD_TIMEOUT
+        _hub_timeout_users += 1
+        constants.HF_HUB_DOWNLOAD_TIMEOUT = timeout
+    try:
+        yield
+    finally:
+        with _hub_timeout_lock:
+            _hub_timeout_users -= 1
+            if _hub_timeout_users == 0:
+                constants.HF_HUB_DOWNLOAD_TIMEOUT = _hub_timeout_saved
+
+
+def _patterns(value):
+    """Шаблоны файлов из пресета: список или строка через запятую (None, если не заданы)"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(",")
+    patterns = [str(pattern).strip() for pattern in value if str(pattern).strip()]
+    return patterns or None
+
+
+def repo_file_patterns(data):
+    """(allow_patterns, ignore_patterns) модели пресета для загрузки всего репозитория"""
+    return _patterns(data.get("allow_patterns")), _patterns(data.get("ignore_patterns"))
+
+
+def filter_repo_files(files, allow_patterns=None, ignore_patterns=None):
+    """Файлы репозитория (записи siblings), подходящие под шаблоны — так же, как их отбирает snapshot_download"""
+    if not allow_patterns and not ignore_patterns:
+        return list(files)
+    from huggingface_hub.utils import filter_repo_objects
+
+    return list(filter_repo_objects(
+        files, allow_patterns=allow_patterns, ignore_patterns=ignore_patterns, key=lambda sibling: sibling["rfilename"]
+    ))
+
+
+class _FileProgress:
+    """Прогресс одного файла внутри общего прогресса загрузки репозитория"""
+
+    def __init__(self, parent, files, name):
+        self._parent = parent
+        self._files = files
+        self._name = name
+        files.setdefault(name, 0)
+
+    def set_total(self, total):
+        # Общий размер репозитория уже известен родительскому прогрессу
+        pass
+
+    @property
+    def downloaded(self):
+        return self._files[self._name]
+
+    def set_bytes(self, downloaded):
+        self._files[self._name] = downloaded
+        self._parent.set_bytes(sum(self._files.values()))
+
+    def advance(self, count):
+        self._files[self._name] += count
+        self._parent.advance(count)
+
+    def finish(self):
+        pass
+
+
+async def _download_repo_files(model_id, target_dir, files, hf_token, progress, workers=1, revision=None,
+                               mirrors=None, token_hosts=None):
+    """
+    Скачивает файлы репозитория собственным загрузчиком (докачка, несколько соединений, ограничение скорости)
+    в target_dir с сохранением структуры папок. files — записи siblings из get_repo_info,
+    mirrors(имя файла) — другие источники файла, token_hosts — хосты, которым отправляется hf_token.
+    """
+    from huggingface_hub import hf_hub_url
+
+    target_root = os.path.normpath(target_dir)
+    semaphore = asyncio.Semaphore(max(1, workers))
+    file_bytes = {}
+
+    async def _download_file(sibling):
+        target_file_path = os.path.normpath(os.path.join(target_root, sibling["rfilename"]))
+        if not target_file_path.startswith(target_root + os.sep):
+            raise ValueError(f"Unsafe file name in repository: {sibling['rfilename']}")
+        file_progress = _FileProgress(progress, file_bytes, sibling["rfilename"])
+        async with semaphore:
+            os.makedirs(os.path.dirname(target_file_path), exist_ok=True)
+            if await _existing_file_result(target_file_path, sibling["sha256"], sibling["size"]):
+                file_progress.set_bytes(sibling["size"] or 0)
+                return
+            await _download_with_peers(
+                hf_hub_url(repo_id=model_id, filename=sibling["rfilename"], revision=revision),
+                target_file_path,
+                hf_token,
+                file_progress,
+                sibling["sha256"],
+                sibling["size"],
+                mirrors(sibling["rfilename"]) if mirrors else None,
+                _hf_source(model_id, revision, sibling["rfilename"]),
+                token_hosts
+            )
+
+    tasks = [asyncio.ensure_future(_download_file(sibling)) for sibling in files]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return target_dir
+
+
+def _hf_source(model_id, revision, path):
+    return f"hf:{model_id}@{revision or 'main'}:{path}"
+
+
+def _blob_source(data):
+    """Источник файла для хранилища по SHA-256: URL или repo/revision/path на HuggingFace"""
+    if data.get("direct_url"):
+        return f"url:{data['direct_url']}"
+    if data.get("model_path"):
+        return _hf_source(data.get("model_id"), data.get("revision"), data["model_path"])
+    return None
+
+
+async def _materialize_from_blob_store(target_file_path, source, expected_sha256, progress):
+    """
+    Если файл уже есть в локальном хранилище (по SHA-256 или источнику), размещает его
+    в целевой папке ссылкой и возвращает ответ о пропуске загрузки.
+    Файл, изменённый после добавления в хранилище, не размещается (PDM_BLOB_VERIFY=1 — сверять и SHA-256).
+    """
+    store = get_blob_store()
+    if store is None:
+        return None
+    verify = os.environ.get("PDM_BLOB_VERIFY", "0") == "1"
+    sha256 = await _run_blocking(store.resolve, expected_sha256, source, verify)
+    if sha256 is None:
+        return None
+    try:
+        method = await _run_blocking(store.materialize, sha256, target_file_path, source)
+    except OSError as e:
+        print(f"[PresetDownloadManager] ⚠️ Не удалось взять файл из хранилища: {e}")
+        return None
+    get_verification_store().record(target_file_path, sha256, source)
+    BLOB_STORE_HITS.inc()
+    progress.finish()
+    return {
+        "status": "success",
+        "path": str(target_file_path),
+        "sha256": sha256,
+        "message": f"Linked from local blob store ({method}), skipped download"
+    }
+
+
+async def download_model(data, progress=None):
+    """
+    Загружает модель из HuggingFace или по прямой ссылке.
+
+    Возвращает словарь с ключами status/path (и message, если загрузка пропущена, sha256 — если файл проверен)
+    и выбрасывает исключение при ошибке. Ход загрузки сообщается через progress (TransferProgress).
+    Если у модели указаны sha256/size, скачанный файл проверяется по ним.
+    Отдельные файлы берутся из локального хранилища по SHA-256 (blob_store), если они уже скачивались.
+    """
+    if progress is None:
+        progress = TransferProgress()
+
+    direct_url = data.get("direct_url")
+    model_id = data.get("model_id")
+    model_path = data.get("model_path", "")
+    save_path = data.get("save_path", "checkpoints")
+    hf_token = data.get("hf_token", "")  # Опциональный API ключ
+    expected_sha256 = normalize_sha256(data.get("sha256"))
+    expected_size = data.get("size") or None
+    blob_source = _blob_source(data)
+
+    base_path = resolve_base_path(save_path)
+
+    # Если указан model_path (конкретный файл), сохраняем напрямую в выбранную папку
+    # Если model_path не указан (вся модель), создаём подпапку с именем модели
+    if not model_path and not direct_url:
+        # Создаём подпапку для модели только если скачиваем всю модель
+        model_name = model_id.split("/")[-1]
+        target_dir = os.path.join(base_path, model_name)
+        os.makedirs(target_dir, exist_ok=True)
+        base_path = target_dir
+
+    downloaded_path = None
+    digest = None
+
+    # Если используется прямая ссылка
+    if direct_url:
+        _kind, target_file_path = resolve_target(data)
+
+        # Проверяем, существует ли файл уже
+        existing = await _existing_file_result(target_file_path, expected_sha256, expected_size)
+        if existing:
+            return existing
+        linked = await _materialize_from_blob_store(target_file_path, blob_source, expected_sha256, progress)
+        if linked:
+            return linked
+
+        downloaded_path, digest = await _download_with_peers(
+            direct_url, target_file_path, hf_token, progress, expected_sha256, expected_size, mirror_urls(data),
+            blob_source, mirror_token_hosts(data, direct_url)
+        )
+    else:
+        # Используем huggingface_hub для загрузки
+        from huggingface_hub import hf_hub_download, snapshot_download
+
+        # Таймауты можно переопределить переменными окружения (повторы — общей политикой, см. retry.py)
+        download_timeout = int(os.environ.get("PDM_DOWNLOAD_TIMEOUT", "300"))
+        snapshot_workers = int(os.environ.get("PDM_SNAPSHOT_WORKERS", "1"))
+
+        # Ветка/тег/коммит, шаблоны файлов и количество параллельных загрузок можно задать в модели пресета
+        revision = data.get("revision") or None
+        allow_patterns, ignore_patterns = repo_file_patterns(data)
+        workers = max(1, int(data.get("workers") or snapshot_workers))
+
+        async def _calculate_required_bytes():
+            """Оценивает размер загрузки (чтобы проверить место на диске) и SHA-256 файла из LFS метаданных."""
+            try:
+                info = await get_repo_info(model_id, hf_token, revision)
+            except Exception as info_error:
+                print(f"[PresetDownloadManager] ⚠️ Не удалось получить размер репозитория: {info_error}")
+                return None, None
+            if not info or not info.get("siblings"):
+                return None, None
+            if model_path:
+                for sibling in info["siblings"]:
+                    if sibling["rfilename"] == model_path:
+                        return sibling["size"], sibling["sha256"]
+                return None, None
+            # Для всего репозитория считаем только файлы, которые пройдут фильтр шаблонов
+            files = filter_repo_files(info["siblings"], allow_patterns, ignore_patterns)
+            if not files:
+                raise ValueError(f"No files in {model_id} match allow_patterns={allow_patterns}, ignore_patterns={ignore_patterns}")
+            return sum((sibling["size"] or 0) for sibling in files), None
+
+        def _ensure_disk_space(required_bytes: int, path=None):
+            """Проверяет, достаточно ли места с запасом 10%."""
+            if not required_bytes:
+                return
+            path = path or base_path
+            try:
+                os.makedirs(path, exist_ok=True)
+                usage = shutil.disk_usage(path)
+            except FileNotFoundError:
+                parent_dir = os.path.dirname(path) or "."
+                usage = shutil.disk_usage(parent_dir)
+            required_with_buffer = int(required_bytes * 1.1)
+            if usage.free < required_with_buffer:
+                raise RuntimeError(
+                    f"Недостаточно свободного места: нужно ~{required_with_buffer / (1024**3):.2f} ГБ, "
+                    f"доступно {usage.free / (1024**3):.2f} ГБ"
+                )
+
+        # Проверяем существование модели перед началом скачивания (для всей модели): папка считается
+        # скачанной, только если в ней есть все файлы репозитория, прошедшие фильтр шаблонов, нужного размера
+        if not model_path:
+            repo_marker = {"model_id": model_id, "revision": revision,
+                           "allow_patterns": allow_patterns, "ignore_patterns": ignore_patterns}
+            try:
+                info = await get_repo_info(model_id, hf_token, revision)
+                remote_files = filter_repo_files(info["siblings"], allow_patterns, ignore_patterns) if info else None
+            except Exception:
+                remote_files = None
+            if remote_files is None:
+                # Без связи с HuggingFace сверяемся со списком файлов, записанным после прошлой загрузки
+                remote_files = _read_repo_marker(base_path, repo_marker)
+            if remote_files and _repo_files_present(base_path, remote_files):
+                return {
+                    "status": "success",
+                    "path": str(base_path),
+                    "message": f"Model already exists ({len(remote_files)} files), skipped download"
+                }
+
+        required_bytes, lfs_sha256 = await _calculate_required_bytes()
+        staging_root = _staging_root(base_path)
+        if required_bytes:
+            _ensure_disk_space(required_bytes)
+            if model_path:
+                # Папка staging обычно на той же файловой системе, но может оказаться точкой монтирования
+                os.makedirs(staging_root, exist_ok=True)
+                if os.stat(staging_root).st_dev != os.stat(base_path).st_dev:
+                    _ensure_disk_space(required_bytes, staging_root)
+            progress.set_total(required_bytes)
+        if model_path:
+            # Для файла репозитория размер и SHA-256 берём из метаданных HF, если они не указаны в пресете
+            expected_sha256 = expected_sha256 or lfs_sha256
+            expected_size = expected_size or required_bytes
+
+        # Проверяем существование файла перед началом скачивания (для model_path)
+        if model_path:
+            _kind, target_file_path = resolve_target(data)
+
+            # Проверяем, существует ли файл уже
+            existing = await _existing_file_result(target_file_path, expected_sha256, expected_size)
+            if existing:
+                return existing
+            linked = await _materialize_from_blob_store(target_file_path, blob_source, expected_sha256, progress)
+            if linked:
+                return linked
+
+        def _download_single_file(token, temp_dir):
+            """Скачивает конкретный файл репозитория в папку staging и переносит его (выполняется в пуле потоков)."""
+            # Определяем имя файла из model_path (уже определено выше, но для ясности)
+            filename = os.path.basename(model_path)
+            if not filename:
+                filename = model_id.split("/")[-1] + ".safetensors"
+
+            target_file_path = os.path.join(base_path, filename)
+
+            # Скачиваем файл в папку staging рядом с целевой папкой
+            temp_file = hf_hub_download(
+                repo_id=model_id,
+                filename=model_path,
+                revision=revision,
+                local_dir=temp_dir,
+                local_dir_use_symlinks=False,
+                resume_download=True,
+                force_download=False,
+                token=token,
+                etag_timeout=download_timeout
+            )
+
+            # Если имя файла не было определено ранее, берем из скачанного файла
+            if not filename or filename == model_id.split("/")[-1] + ".safetensors":
+                filename = os.path.basename(temp_file)
+                target_file_path = os.path.join(base_path, filename)
+
+            # Перемещаем файл в целевую папку (существующий файл заменяется атомарно)
+            try:
+                os.replace(temp_file, target_file_path)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # Staging оказался на другой файловой системе — остаётся только копирование
+                shutil.move(temp_file, target_file_path)
+            return target_file_path
+
+        # Собственный загрузчик умеет качать в несколько соединений, ограничивать скорость, переключаться
+        # между зеркалами и брать файлы у соседних узлов, huggingface_hub — нет, поэтому при этих настройках
+        # файлы репозитория качаются им
+        use_native = (
+            _segment_settings()[0] > 1
+            or get_bandwidth_limiter().is_limited(get_download_host(data))
+            or has_mirrors(data)
+            or peers_enabled()
+        )
+        repo_files = None
+        if use_native and not model_path:
+            try:
+                repo_files = filter_repo_files(
+                    (await get_repo_info(model_id, hf_token, revision))["siblings"], allow_patterns, ignore_patterns
+                )
+            except Exception as info_error:
+                print(f"[PresetDownloadManager] ⚠️ Не удалось получить список файлов репозитория: {info_error}")
+
+        if model_path and use_native:
+            # Файл репозитория качаем по resolve-ссылке собственным загрузчиком — в несколько соединений
+            from huggingface_hub import hf_hub_url
+
+            filename = os.path.basename(model_path) or model_id.split("/")[-1] + ".safetensors"
+            downloaded_path, digest = await _download_with_peers(
+                hf_hub_url(repo_id=model_id, filename=model_path, revision=revision),
+                os.path.join(base_path, filename),
+                hf_token,
+                progress,
+                expected_sha256,
+                expected_size,
+                mirror_urls(data),
+                blob_source,
+                mirror_token_hosts(data, hf_endpoint())
+            )
+        elif repo_files:
+            downloaded_path = await _download_repo_files(
+                model_id, base_path, repo_files, hf_token, progress, workers, revision,
+                lambda filename: mirror_urls(data, filename), mirror_token_hosts(data, hf_endpoint())
+            )
+        else:
+            async def _hub_attempt():
+                """Одна попытка загрузки через huggingface_hub; возвращает (путь, SHA-256 или None)"""
+                # Используем токен, если он указан
+                token = hf_token if hf_token else None
+
+                if model_path:
+                    # Загружаем конкретный файл
+                    # Используем временную папку, чтобы избежать создания подпапок huggingface.
+                    # Она создаётся в папке моделей, а не в системном /tmp (часто это маленький tmpfs на другом диске)
+                    # Папка постоянная: после обрыва следующая попытка докачивает файл
+                    temp_dir = _staging_dir(base_path, model_id, revision, model_path)
+                    os.makedirs(temp_dir, exist_ok=True)
+                    with _hub_download_timeout(download_timeout):
+                        file_path = await _run_with_directory_progress(
+                            temp_dir, progress, _download_single_file, token, temp_dir
+                        )
+                    shutil.rmtree(temp_dir, ignore_errors=True)
+                    try:
+                        os.rmdir(staging_root)
+                    except OSError:
+                        pass
+                    # huggingface_hub качает файл LFS с тем SHA-256, что в метаданных репозитория: файл не
+                    # перечитывается, сверяется размер. Без LFS хеша файл хешируется; неверный удаляем и качаем заново
+                    try:
+                        file_digest = await verify_download(file_path, hub_sha256, expected_sha256, expected_size)
+                    except IntegrityError:
+                        _remove_quietly(file_path)
+                        raise
+                    if file_digest:
+                        get_verification_store().record(file_path, file_digest, blob_source)
+                    return file_path, file_digest
+
+                # Загружаем всю модель (проверка уже выполнена выше)
+                with _hub_download_timeout(download_timeout):
+                    repo_path = await _run_with_directory_progress(
+                        base_path,
+                        progress,
+                        snapshot_download,
+                        repo_id=model_id,
+                        revision=revision,
+                        local_dir=base_path,
+                        local_dir_use_symlinks=False,
+                        resume_download=True,  # Возобновление загрузки
+                        allow_patterns=allow_patterns,
+                        ignore_patterns=(ignore_patterns or []) + ["*.part"],  # Игнорируем частично загруженные файлы
+                        token=token,  # API ключ (если указан)
+                        etag_timeout=download_timeout,
+                        max_workers=workers
+                    )
+                return repo_path, None
+
+            hub_sha256 = normalize_sha256(lfs_sha256) if model_path else None
+            if hub_sha256 and normalize_sha256(expected_sha256) != hub_sha256:
+                # Хеш пресета не совпадает с файлом на HuggingFace — загрузка заведомо не пройдёт проверку
+                raise IntegrityError(
+                    f"SHA-256 mismatch for {model_path}: expected {normalize_sha256(expected_sha256)}, "
+                    f"HuggingFace has {hub_sha256}"
+                )
+
+            # Временные ошибки (таймауты, обрывы, 5xx, 429 с Retry-After) повторяются, 401/403/404 — нет
+            downloaded_path, digest = await retry_async(
+                _hub_attempt, host=get_download_host(data), path="huggingface", url=model_id
+            )
+
+        if downloaded_path is None:
+            raise Exception("Failed to download model")
+        if not model_path:
+            _write_repo_marker(base_path, repo_marker, remote_files)
+
+    # Проверяем, что файл действительно существует перед возвратом успешного ответа
+    if downloaded_path and not os.path.exists(downloaded_path):
+        raise Exception(f"File was downloaded but not found at path: {downloaded_path}")
+
+    # Проверяем, что это файл (не директория)
+    if downloaded_path and os.path.isdir(downloaded_path):
+        # Для директорий (snapshot_download) это нормально
+        pass
+    elif downloaded_path and not os.path.isfile(downloaded_path):
+        raise Exception(f"Downloaded path exists but is not a file: {downloaded_path}")
+
+    # Скачанный файл добавляем в хранилище, чтобы другие папки и повторные установки получали его ссылкой
+    store = get_blob_store()
+    if store is not None and blob_source and digest and os.path.isfile(downloaded_path):
+        await _run_blocking(store.add, downloaded_path, digest, blob_source)
+
+    progress.finish()
+    result = {
+        "status": "success",
+        "path": str(downloaded_path)
+    }
+    if digest:
+        result["sha256"] = digest
+    return result
+
+
+def format_download_error(error):
+    """Формирует понятное сообщение об ошибке загрузки с рекомендациями"""
+    error_msg = str(error)
+
+    if "timeout" in error_msg.lower() or "timed out" in error_msg.lower() or "cas-bridge" in error_msg.lower():
+        return (
+            f"⏱️ Таймаут при загрузке: соединение с HuggingFace прервалось.\n\n"
+            f"💡 Возможные решения:\n"
+            f"1. Используйте прокси/VPN (если доступ к HuggingFace ограничен).\n\n"
+            f"2. Попробуйте загрузить снова — загрузка автоматически возобновится с места остановки.\n"
+            f"   При необходимости увеличьте переменные PDM_MAX_RETRIES и PDM_DOWNLOAD_TIMEOUT.\n\n"
+            f"Оригинальная ошибка: {error_msg}"
+        )
+    if "connection" in error_msg.lower() or "connectionpool" in error_msg.lower():
+        return (
+            f"🔌 Ошибка соединения: не удалось подключиться к HuggingFace.\n\n"
+            f"💡 Проверьте:\n"
+            f"1. Интернет-соединение\n"
+            f"2. Настройки прокси (если требуется)\n"
+            f"3. Ограничения доступа к HuggingFace в вашем регионе\n\n"
+            f"Оригинальная ошибка: {error_msg}"
+        )
+    return error_msg
+
+
+def get_download_host(data):
+    """Возвращает хост, с которого будет выполняться загрузка (для лимитов на хост)"""
+    direct_url = data.get("direct_url")
+    if direct_url:
+        return urlparse(direct_url).netloc.lower() or "direct"
+    return urlparse(hf_endpoint()).netloc.lower() or "huggingface.co"
@@ -0,0 +1,153 @@
+import os
+import queue
+import asyncio
+import threading
+
+
+# Блок чтения и записи без фонового потока (PDM_WRITE_BUFFER_MB=0) — как до BufferedFileWriter
+INLINE_CHUNK_SIZE = 8192
+
+
+def write_buffer_size():
+    """
+    Размер буфера, который передаётся потоку записи за один раз (PDM_WRITE_BUFFER_MB, 1–64 МБ).
+    0 — писать прямо в event loop блоками по 8 КБ (для сравнения в бенчмарках).
+    """
+    size_mb = int(os.environ.get("PDM_WRITE_BUFFER_MB", "4"))
+    if size_mb <= 0:
+        return 0
+    return min(64, max(1, size_mb)) * 1024 * 1024
+
+
+def allocate_file(path, size):
+    """
+    Создаёт файл заданного размера для записи сегментов по смещениям.
+    При PDM_PREALLOCATE=1 место на диске резервируется сразу (posix_fallocate), иначе файл разреженный.
+    """
+    with open(path, 'wb') as f:
+        f.truncate(size)
+        if os.environ.get("PDM_PREALLOCATE", "1") == "1" and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+            except OSError:
+                # Файловая система не поддерживает fallocate — остаётся разреженный файл
+                pass
+
+
+class BufferedFileWriter:
+    """
+    Запись загружаемых данных в файл из отдельного потока.
+
+    Данные копятся в буфере размером buffer_size и передаются потоку записи через ограниченную
+    очередь: event loop не блокируется на системных вызовах записи, а если диск не успевает,
+    write() ждёт свободного места в очереди (backpressure).
+    on_write(data) вызывается в потоке записи для каждого записанного блока.
+    При buffer_size=0 поток не создаётся: каждый блок пишется сразу, в event loop.
+    """
+
+    def __init__(self, path, mode='wb', offset=0, buffer_size=None, max_pending=None, on_write=None):
+        if max_pending is None:
+            max_pending = int(os.environ.get("PDM_WRITE_QUEUE", "4"))
+        self.path = path
+        self.mode = mode
+        self.offset = offset
+        if buffer_size is None:
+            buffer_size = write_buffer_size()
+        self.inline = not buffer_size
+        self.buffer_size = buffer_size or INLINE_CHUNK_SIZE
+        self.max_pending = max(1, max_pending)
+        self.on_write = on_write
+        self._buffer = bytearray()
+        self._queue = queue.Queue()
+        self._error = None
+        self._slots = None
+        self._loop = None
+        self._done = None
+        self._file = None
+
+    async def __aenter__(self):
+        self._loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._done = self._loop.create_future()
+        if self.inline:
+            self._file = open(self.path, self.mode)
+            if self.offset:
+                self._file.seek(self.offset)
+            return self
+        threading.Thread(target=self._run, name="pdm-writer", daemon=True).start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # Даже при ошибке загрузки дописываем уже полученные данные — они нужны для докачки
+        try:
+            await self.close()
+        except Exception:
+            if exc_type is None:
+                raise
+        return False
+
+    async def write(self, data):
+        if self.inline:
+            self._file.write(data)
+            if self.on_write is not None:
+                self.on_write(data)
+            return
+        self._buffer += data
+        if len(self._buffer) >= self.buffer_size:
+            await self._submit()
+
+    async def close(self):
+        """Записывает остаток буфера и ждёт, пока поток записи закончит работу"""
+        if self._done.done():
+            return await self._done
+        if self.inline:
+            self._file.close()
+            self._done.set_result(None)
+            return
+        try:
+            await self._submit()
+        finally:
+            self._queue.put(None)
+        return await asyncio.shield(self._done)
+
+    async def _submit(self):
+        if self._error is not None:
+            raise self._error
+        if not self._buffer:
+            return
+        await self._slots.acquire()
+        self._queue.put(bytes(self._buffer))
+        self._buffer = bytearray()
+
+    def _run(self):
+        try:
+            with open(self.path, self.mode) as f:
+                if self.offset:
+                    f.seek(self.offset)
+                while True:
+                    data = self._queue.get()
+                    if data is None:
+                        break
+                    if self._error is None:
+                        try:
+                            f.write(data)
+                            if self.on_write is not None:
+                                self.on_write(data)
+                        except BaseException as e:
+                            # Продолжаем разбирать очередь, чтобы не заблокировать ожидающий write()
+                            self._error = e
+                    self._loop.call_soon_threadsafe(self._slots.release)
+        except BaseException as e:
+            self._error = self._error or e
+            # Файл не открылся — освобождаем очередь до сигнала завершения
+            while self._queue.get() is not None:
+                self._loop.call_soon_threadsafe(self._slots.release)
+        self._loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if self._done.done():
+            return
+        if self._error is not None:
+            self._done.set_exception(self._error)
+        else:
+            self._done.set_result(None)
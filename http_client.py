@@ -0,0 +1,49 @@
+import os
+import asyncio
+import aiohttp
+
+# Общие HTTP сессии (по одной на event loop): переиспользуют соединения, DNS кэш и TLS между загрузками
+_sessions = {}
+
+
+def get_proxy():
+    """Явный прокси для запросов (PDM_PROXY). Без него используются HTTP(S)_PROXY из окружения."""
+    return os.environ.get("PDM_PROXY") or None
+
+
+def _create_session():
+    connector = aiohttp.TCPConnector(
+        limit=int(os.environ.get("PDM_HTTP_POOL_SIZE", "100")),
+        limit_per_host=int(os.environ.get("PDM_HTTP_POOL_PER_HOST", "16")),
+        ttl_dns_cache=int(os.environ.get("PDM_DNS_CACHE_TTL", "300")),
+        keepalive_timeout=float(os.environ.get("PDM_KEEPALIVE_TIMEOUT", "60")),
+        enable_cleanup_closed=True,
+    )
+    # Общего ограничения на запрос нет (файлы бывают по 20+ ГБ), но подключение и чтение ограничены
+    timeout = aiohttp.ClientTimeout(
+        total=None,
+        connect=float(os.environ.get("PDM_CONNECT_TIMEOUT", "30")),
+        sock_read=float(os.environ.get("PDM_DOWNLOAD_TIMEOUT", "300")),
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, trust_env=True)
+
+
+async def get_session():
+    """Возвращает общую сессию aiohttp для текущего event loop, создавая её при первом обращении"""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = _create_session()
+        _sessions[loop] = session
+    return session
+
+
+async def close_sessions(app=None):
+    """Закрывает сессии текущего event loop (вызывается при остановке PromptServer)"""
+    loop = asyncio.get_running_loop()
+    session = _sessions.pop(loop, None)
+    if session is not None and not session.closed:
+        await session.close()
+    # Сессии остановленных event loop'ов закрыть уже нельзя — просто забываем о них
+    for other_loop in [other for other in _sessions if other.is_closed()]:
+        del _sessions[other_loop]
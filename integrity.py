@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+
+# Размер блока при хешировании файлов с диска
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class IntegrityError(Exception):
+    """Размер или SHA-256 скачанного файла не совпадает с ожидаемым"""
+
+
+def normalize_sha256(value):
+    """Приводит хеш к нижнему регистру; пустые значения и префикс 'sha256:' допускаются"""
+    if not value:
+        return None
+    value = str(value).strip().lower()
+    if value.startswith("sha256:"):
+        value = value[len("sha256:"):]
+    return value or None
+
+
+def sha256_file(path, hasher=None, limit=None):
+    """Хеширует файл (или его первые limit байт) и возвращает hasher"""
+    hasher = hasher or hashlib.sha256()
+    remaining = limit
+    with open(path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            size = HASH_CHUNK_SIZE if remaining is None else min(HASH_CHUNK_SIZE, remaining)
+            data = f.read(size)
+            if not data:
+                break
+            hasher.update(data)
+            if remaining is not None:
+                remaining -= len(data)
+    return hasher
+
+
+class SequentialHasher:
+    """
+    SHA-256 файла, который пишется не по порядку (сегментная загрузка).
+
+    update(offset, data) вызывается для каждого записанного блока, в том числе из потоков записи.
+    Блок с текущей границы хешируется сразу, блоки впереди неё ждут в памяти (не больше max_pending байт),
+    пока граница до них не дойдёт. Не поместившиеся в память блоки и данные, скачанные до этого запуска,
+    finish() дочитывает с диска.
+    """
+
+    def __init__(self, max_pending=None):
+        if max_pending is None:
+            max_pending = int(os.environ.get("PDM_HASH_BUFFER_MB", "256")) * 1024 * 1024
+        self.max_pending = max(0, max_pending)
+        self.offset = 0
+        self.read_bytes = 0
+        self._hasher = hashlib.sha256()
+        self._pending = {}
+        self._pending_bytes = 0
+        self._lock = threading.Lock()
+
+    def update(self, offset, data):
+        with self._lock:
+            if offset == self.offset:
+                self._hasher.update(data)
+                self.offset += len(data)
+                while self.offset in self._pending:
+                    block = self._pending.pop(self.offset)
+                    self._pending_bytes -= len(block)
+                    self._hasher.update(block)
+                    self.offset += len(block)
+            elif offset > self.offset and self._pending_bytes + len(data) <= self.max_pending:
+                self._pending[offset] = bytes(data)
+                self._pending_bytes += len(data)
+
+    def writer(self, offset):
+        """on_write для BufferedFileWriter, пишущего подряд начиная с offset"""
+        position = [offset]
+
+        def on_write(data):
+            self.update(position[0], data)
+            position[0] += len(data)
+
+        return on_write
+
+    def finish(self, path, size):
+        """Дохеширует файл до size байт (пропуски читаются с диска) и возвращает SHA-256"""
+        with self._lock:
+            with open(path, 'rb') as f:
+                while self.offset < size:
+                    block = self._pending.pop(self.offset, None)
+                    if block is None:
+                        following = [offset for offset in self._pending if offset > self.offset]
+                        end = min(following + [size, self.offset + HASH_CHUNK_SIZE])
+                        f.seek(self.offset)
+                        block = f.read(end - self.offset)
+                        if not block:
+                            break
+                        self.read_bytes += len(block)
+                    else:
+                        self._pending_bytes -= len(block)
+                    self._hasher.update(block)
+                    self.offset += len(block)
+            self._pending.clear()
+            self._pending_bytes = 0
+            return self._hasher.hexdigest()
+
+
+def _source_key(source):
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+class VerificationStore:
+    """
+    Записи о проверенных файлах: путь -> размер, mtime и SHA-256.
+    Если файл не менялся с момента проверки, повторно его не хешируем.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._records = None
+
+    def _load(self):
+        if self._records is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._records = json.load(f)
+            except (OSError, ValueError):
+                self._records = {}
+        return self._records
+
+    def _save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._records, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def lookup(self, path):
+        """Возвращает SHA-256 из записи, если файл с тех пор не изменился"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            record = self._load().get(os.path.abspath(path))
+        if record and record.get("size") == stat.st_size and record.get("mtime_ns") == stat.st_mtime_ns:
+            return record.get("sha256")
+        return None
+
+    def find(self, sha256):
+        """Путь к проверенному файлу с таким SHA-256, который с тех пор не менялся (или None)"""
+        with self._lock:
+            paths = [path for path, record in self._load().items() if record.get("sha256") == sha256]
+        for path in paths:
+            if self.lookup(path) == sha256:
+                return path
+        return None
+
+    def find_source(self, source):
+        """(путь, SHA-256) проверенного файла, скачанного из source, который с тех пор не менялся (или None)"""
+        key = _source_key(source)
+        with self._lock:
+            records = [(path, record.get("sha256")) for path, record in self._load().items()
+                       if record.get("source") == key]
+        for path, sha256 in records:
+            if sha256 and self.lookup(path) == sha256:
+                return path, sha256
+        return None
+
+    def record(self, path, sha256, source=None):
+        """
+        Запоминает проверенный файл. source (url:... / hf:repo@revision:path) позволяет найти файл по источнику
+        без хранилища по SHA-256; сохраняется только его хеш, чтобы токены из ссылок не попадали на диск.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        with self._lock:
+            records = self._load()
+            record = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": sha256,
+                "verified_at": time.time(),
+            }
+            previous = records.get(os.path.abspath(path)) or {}
+            if source:
+                record["source"] = _source_key(source)
+            elif previous.get("source") and previous.get("sha256") == sha256:
+                record["source"] = previous["source"]
+            records[os.path.abspath(path)] = record
+            try:
+                self._save()
+            except OSError as e:
+                print(f"[PresetDownloadManager] ⚠️ Не удалось сохранить записи проверки файлов: {e}")
+
+    def forget(self, path):
+        with self._lock:
+            if self._load().pop(os.path.abspath(path), None) is not None:
+                try:
+                    self._save()
+                except OSError:
+                    pass
+
+
+_verification_store = None
+
+
+def get_verification_store():
+    global _verification_store
+    if _verification_store is None:
+        path = os.environ.get("PDM_VERIFY_DB") or os.path.join(os.path.dirname(__file__), "verified.json")
+        _verification_store = VerificationStore(path)
+    return _verification_store
+
+
+async def verify_download(path, digest=None, expected_sha256=None, expected_size=None):
+    """
+    Проверяет скачанный файл по ожидаемому размеру и SHA-256.
+    digest — хеш, уже посчитанный во время загрузки; если его нет, файл хешируется в отдельном потоке.
+    Возвращает SHA-256 (если он известен) или выбрасывает IntegrityError.
+    """
+    expected_sha256 = normalize_sha256(expected_sha256)
+    if expected_size:
+        actual_size = os.path.getsize(path)
+        if actual_size != int(expected_size):
+            raise IntegrityError(
+                f"Size mismatch for {os.path.basename(path)}: expected {expected_size} bytes, got {actual_size}"
+            )
+    if not expected_sha256:
+        return digest
+    if digest is None:
+        loop = asyncio.get_running_loop()
+        digest = (await loop.run_in_executor(None, sha256_file, path)).hexdigest()
+    if digest != expected_sha256:
+        raise IntegrityError(
+            f"SHA-256 mismatch for {os.path.basename(path)}: expected {expected_sha256}, got {digest}"
+        )
+    return digest
+
+
+async def verify_file(path, expected_sha256=None, expected_size=None):
+    """
+    Проверяет уже лежащий на диске файл, используя записи о проверке,
+    чтобы не хешировать повторно неизменившиеся файлы.
+    """
+    store = get_verification_store()
+    digest = store.lookup(path) if normalize_sha256(expected_sha256) else None
+    try:
+        digest = await verify_download(path, digest, expected_sha256, expected_size)
+    except IntegrityError:
+        store.forget(path)
+        raise
+    if digest:
+        store.record(path, digest)
+    return digest
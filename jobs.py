@@ -0,0 +1,310 @@
+import os
+import time
+import uuid
+import asyncio
+import itertools
+import traceback
+from collections import defaultdict
+
+from .downloader import download_model, format_download_error, get_download_host, repo_file_patterns
+from .metrics import JOB_DURATION, JOB_QUEUE_WAIT, JOBS_FINISHED, log_event, registry
+from .progress import TransferProgress
+
+# Статусы задач загрузки
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+FINISHED_STATUSES = {JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED}
+ACTIVE_STATUSES = {JOB_QUEUED, JOB_RUNNING}
+
+# События, которые получают подписчики менеджера (в ComfyUI — websocket клиенты)
+JOB_EVENT = "preset_download_manager.job"
+PROGRESS_EVENT = "preset_download_manager.progress"
+
+_job_sequence = itertools.count()
+
+
+class DownloadJob:
+    """
+    Задача загрузки одной модели в фоновой очереди
+    """
+
+    def __init__(self, params, priority=0):
+        self.id = uuid.uuid4().hex[:12]
+        self.params = dict(params)
+        self.priority = int(priority)
+        self.host = get_download_host(self.params)
+        self.status = JOB_QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.progress = None
+        # Результат завершённой задачи уже получен клиентом через API (задачу можно убрать из истории)
+        self.delivered = False
+        self._sequence = next(_job_sequence)
+        self._task = None
+        self._done = asyncio.Event()
+
+    @property
+    def key(self):
+        """Ключ, по которому определяются одинаковые загрузки"""
+        allow_patterns, ignore_patterns = repo_file_patterns(self.params)
+        return (
+            self.params.get("direct_url") or self.params.get("model_id") or "",
+            self.params.get("model_path") or "",
+            (self.params.get("save_path") or "checkpoints").lower().strip(),
+            self.params.get("revision") or "",
+            tuple(allow_patterns or ()),
+            tuple(ignore_patterns or ()),
+        )
+
+    @property
+    def display_name(self):
+        direct_url = self.params.get("direct_url")
+        if direct_url:
+            return direct_url.rstrip("/").split("/")[-1] or "Direct URL"
+        model_id = self.params.get("model_id") or ""
+        model_path = self.params.get("model_path")
+        return f"{model_id}/{model_path}" if model_path else model_id
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self):
+        """Сериализует задачу для API (без токена доступа)"""
+        params = {key: value for key, value in self.params.items() if key != "hf_token"}
+        return {
+            "id": self.id,
+            "name": self.display_name,
+            "status": self.status,
+            "priority": self.priority,
+            "host": self.host,
+            "params": params,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+            "progress": self.progress_dict(),
+        }
+
+    def progress_dict(self):
+        """Текущий прогресс передачи (None, если загрузка ещё не начиналась)"""
+        if self.progress is None:
+            return None
+        data = self.progress.to_dict()
+        data["job_id"] = self.id
+        data["status"] = self.status
+        return data
+
+
+class DownloadJobManager:
+    """
+    Планировщик фоновых загрузок: очередь с приоритетами и ограничением
+    количества одновременных загрузок (глобально и на один хост).
+
+    Отмена выполняющейся загрузки через huggingface_hub освобождает слот сразу,
+    но поток пула дорабатывает текущий вызов до конца.
+    """
+
+    def __init__(self, max_concurrent=None, max_per_host=None, history_limit=None, history_retention=None):
+        if max_concurrent is None:
+            max_concurrent = os.environ.get("PDM_MAX_CONCURRENT_DOWNLOADS", "2")
+        if max_per_host is None:
+            max_per_host = os.environ.get("PDM_MAX_DOWNLOADS_PER_HOST", "2")
+        if history_limit is None:
+            history_limit = os.environ.get("PDM_JOB_HISTORY", "200")
+        if history_retention is None:
+            history_retention = os.environ.get("PDM_JOB_RETENTION", "120")
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_per_host = max(1, int(max_per_host))
+        self.history_limit = max(0, int(history_limit))
+        self.history_retention = max(0.0, float(history_retention))
+        self._jobs = {}
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Подписывает callback(event, payload) на изменения задач и прогресс загрузок"""
+        self._listeners.append(callback)
+
+    def submit(self, params, priority=0):
+        """Ставит загрузку в очередь. Если такая же загрузка уже активна, возвращает её задачу."""
+        job = DownloadJob(params, priority)
+        for existing in self._jobs.values():
+            if existing.key == job.key and existing.status in ACTIVE_STATUSES:
+                return existing
+        self._jobs[job.id] = job
+        self._notify(JOB_EVENT, job.to_dict())
+        self._schedule()
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def list_jobs(self, status=None):
+        jobs = list(self._jobs.values())
+        if status:
+            jobs = [job for job in jobs if job.status == status]
+        return jobs
+
+    def mark_delivered(self, jobs):
+        """Отмечает, что клиент получил состояние задач; завершённые задачи после этого можно убрать из истории"""
+        for job in jobs:
+            if job.finished:
+                job.delivered = True
+        self._prune_history()
+
+    def cancel(self, job_id):
+        """Отменяет задачу в очереди или выполняющуюся загрузку"""
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+        if job.status == JOB_QUEUED:
+            self._finish(job, JOB_CANCELLED)
+            self._schedule()
+        elif job._task is not None:
+            job._task.cancel()
+        return True
+
+    def set_priority(self, job_id, priority):
+        """Меняет приоритет задачи (больше — раньше) и пересчитывает очередь"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        job.priority = int(priority)
+        self._notify(JOB_EVENT, job.to_dict())
+        self._schedule()
+        return job
+
+    def set_limits(self, max_concurrent=None, max_per_host=None):
+        """Меняет ограничения параллельности во время работы"""
+        if max_concurrent is not None:
+            self.max_concurrent = max(1, int(max_concurrent))
+        if max_per_host is not None:
+            self.max_per_host = max(1, int(max_per_host))
+        self._schedule()
+
+    def limits(self):
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_per_host": self.max_per_host,
+        }
+
+    async def wait(self, job):
+        """Ожидает завершения задачи и возвращает её"""
+        await job._done.wait()
+        return job
+
+    def _schedule(self):
+        """Запускает задачи из очереди, пока есть свободные слоты"""
+        running = [job for job in self._jobs.values() if job.status == JOB_RUNNING]
+        host_counts = defaultdict(int)
+        for job in running:
+            host_counts[job.host] += 1
+
+        queued = sorted(
+            (job for job in self._jobs.values() if job.status == JOB_QUEUED),
+            key=lambda job: (-job.priority, job._sequence)
+        )
+        for job in queued:
+            if len(running) >= self.max_concurrent:
+                break
+            if host_counts[job.host] >= self.max_per_host:
+                continue
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+            JOB_QUEUE_WAIT.observe(job.started_at - job.created_at)
+            log_event("job_started", job_id=job.id, name=job.display_name, host=job.host,
+                      queued_seconds=round(job.started_at - job.created_at, 3))
+            job.progress = TransferProgress(
+                on_update=lambda _progress, job=job: self._notify(PROGRESS_EVENT, job.progress_dict())
+            )
+            self._notify(JOB_EVENT, job.to_dict())
+            job._task = asyncio.ensure_future(self._run(job))
+            running.append(job)
+            host_counts[job.host] += 1
+
+    async def _run(self, job):
+        try:
+            job.result = await download_model(job.params, job.progress)
+            self._finish(job, JOB_COMPLETED)
+        except asyncio.CancelledError:
+            self._finish(job, JOB_CANCELLED)
+        except Exception as e:
+            traceback.print_exc()
+            job.error = format_download_error(e)
+            self._finish(job, JOB_FAILED)
+        finally:
+            job._task = None
+            self._schedule()
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        JOBS_FINISHED.inc(status=status)
+        duration = job.finished_at - job.started_at if job.started_at else None
+        if duration is not None:
+            JOB_DURATION.observe(duration, status=status)
+        log_event(
+            "job_finished",
+            job_id=job.id,
+            name=job.display_name,
+            host=job.host,
+            status=status,
+            duration_seconds=round(duration, 3) if duration is not None else None,
+            bytes=job.progress.downloaded if job.progress else None,
+            error=job.error,
+        )
+        job._done.set()
+        self._notify(JOB_EVENT, job.to_dict())
+        self._prune_history()
+
+    def _notify(self, event, payload):
+        for listener in list(self._listeners):
+            try:
+                listener(event, payload)
+            except Exception:
+                traceback.print_exc()
+
+    def status_counts(self):
+        """Количество задач по статусам (для метрик: глубина очереди, выполняющиеся загрузки)"""
+        counts = {status: 0 for status in ACTIVE_STATUSES}
+        for job in self._jobs.values():
+            if job.status in ACTIVE_STATUSES:
+                counts[job.status] += 1
+        return counts
+
+    def _prune_history(self):
+        """
+        Удаляет самые старые завершённые задачи сверх лимита истории. Задача, результат которой ещё
+        не получен через API, остаётся, пока его не запросят (интерфейс опрашивает список задач),
+        но не дольше history_retention секунд после завершения — на случай, если клиент ушёл.
+        """
+        finished = sorted((job for job in self._jobs.values() if job.finished), key=lambda job: job.finished_at)
+        excess = len(finished) - self.history_limit
+        prune_before = time.time() - self.history_retention
+        for job in finished:
+            if excess <= 0:
+                break
+            if job.delivered or job.finished_at <= prune_before:
+                del self._jobs[job.id]
+                excess -= 1
+
+_job_manager = None
+
+
+def get_job_manager():
+    """Возвращает общий для процесса менеджер задач загрузки"""
+    global _job_manager
+    if _job_manager is None:
+        _job_manager = DownloadJobManager()
+        registry.callback(
+            "pdm_jobs", "Download jobs currently queued or running", _job_manager.status_counts, labels=("status",)
+        )
+    return _job_manager
@@ -0,0 +1,203 @@
+import os
+import time
+import threading
+
+import folder_paths
+
+from .downloader import is_partial_file, resolve_target
+from .integrity import get_verification_store, normalize_sha256
+
+
+class _DirEntry:
+    __slots__ = ("mtime_ns", "files", "subdirs")
+
+    def __init__(self, mtime_ns, files, subdirs):
+        self.mtime_ns = mtime_ns
+        self.files = files  # имя -> (размер, mtime_ns)
+        self.subdirs = subdirs
+
+
+class LocalModelIndex:
+    """
+    Индекс файлов во всех папках моделей (folder_paths): путь, размер, mtime.
+
+    Первое построение и обновления выполняются в фоне. Обновление инкрементальное: папка
+    перечитывается только если изменился её mtime (файлы добавлены, удалены или заменены через
+    os.replace), поэтому повторный проход по большой библиотеке — это stat каждой папки.
+    При запросе статуса папка с изменившимся mtime перечитывается сразу.
+    Скрытые папки (.pdm_staging, .pdm_blobs, .cache) и недокачанные .part файлы не индексируются.
+    """
+
+    def __init__(self, interval=60.0):
+        self.interval = interval
+        self._dirs = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+        self.ready = False
+        self.last_refresh = None
+        self.last_duration = None
+
+    def _roots(self):
+        roots = {folder_paths.models_dir}
+        for paths, _extensions in getattr(folder_paths, "folder_names_and_paths", {}).values():
+            roots.update(paths)
+        return [os.path.normpath(root) for root in roots if root]
+
+    @staticmethod
+    def _scan_dir(path, mtime_ns):
+        files = {}
+        subdirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or is_partial_file(entry.name):
+                    continue
+                try:
+                    if entry.is_dir():
+                        subdirs.append(entry.path)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+                except OSError:
+                    continue
+        return _DirEntry(mtime_ns, files, subdirs)
+
+    def refresh(self):
+        """Инкрементально обновляет индекс"""
+        with self._refresh_lock:
+            started = time.monotonic()
+            with self._lock:
+                dirs = dict(self._dirs)
+            seen_paths = set()
+            seen_inodes = set()
+            stack = self._roots()
+            while stack:
+                path = stack.pop()
+                if path in seen_paths:
+                    continue
+                seen_paths.add(path)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                # Защита от циклов через символические ссылки
+                inode = (stat.st_dev, stat.st_ino)
+                if inode in seen_inodes:
+                    continue
+                seen_inodes.add(inode)
+                entry = dirs.get(path)
+                if entry is None or entry.mtime_ns != stat.st_mtime_ns:
+                    try:
+                        entry = self._scan_dir(path, stat.st_mtime_ns)
+                    except OSError:
+                        continue
+                    dirs[path] = entry
+                stack.extend(entry.subdirs)
+            with self._lock:
+                self._dirs = {path: entry for path, entry in dirs.items() if path in seen_paths}
+            self.ready = True
+            self.last_refresh = time.time()
+            self.last_duration = time.monotonic() - started
+
+    def start(self):
+        """Запускает фоновое построение и периодическое обновление индекса"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="pdm-local-index", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[PresetDownloadManager] ⚠️ Ошибка индексации папок моделей: {e}")
+            time.sleep(self.interval)
+
+    def _fresh_dir(self, directory):
+        """
+        Запись папки из индекса. Если папка изменилась после последнего обновления (или ещё не
+        проиндексирована), она перечитывается сразу — ответ всегда актуален, а стоит один stat.
+        """
+        try:
+            stat = os.stat(directory)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._dirs.get(directory)
+        if entry is None or entry.mtime_ns != stat.st_mtime_ns:
+            try:
+                entry = self._scan_dir(directory, stat.st_mtime_ns)
+            except OSError:
+                return None
+            with self._lock:
+                self._dirs[directory] = entry
+        return entry
+
+    def file_info(self, path):
+        """(размер, mtime_ns) файла или None"""
+        directory, name = os.path.split(os.path.normpath(path))
+        entry = self._fresh_dir(directory)
+        return entry.files.get(name) if entry else None
+
+    def dir_file_count(self, path):
+        """Количество файлов (не скрытых) в папке"""
+        entry = self._fresh_dir(os.path.normpath(path))
+        return len(entry.files) if entry else 0
+
+    def stats(self):
+        with self._lock:
+            dirs = len(self._dirs)
+            files = sum(len(entry.files) for entry in self._dirs.values())
+            total = sum(size for entry in self._dirs.values() for size, _mtime in entry.files.values())
+        return {
+            "ready": self.ready,
+            "directories": dirs,
+            "files": files,
+            "bytes": total,
+            "last_refresh": self.last_refresh,
+            "last_duration": round(self.last_duration, 3) if self.last_duration is not None else None,
+        }
+
+    def model_status(self, model):
+        """Установлена ли модель пресета: путь, размер и (если файл проверялся) SHA-256"""
+        kind, path = resolve_target(model, create=False)
+        if kind == "dir":
+            count = self.dir_file_count(path)
+            return {"path": path, "installed": count > 0, "files": count}
+        info = self.file_info(path)
+        status = {"path": path, "installed": info is not None}
+        if info is not None:
+            status["size"] = info[0]
+            expected_size = model.get("size")
+            if expected_size and int(expected_size) != info[0]:
+                status["installed"] = False
+                status["reason"] = "size mismatch"
+            sha256 = get_verification_store().lookup(path)
+            if sha256:
+                status["sha256"] = sha256
+                expected_sha256 = normalize_sha256(model.get("sha256"))
+                if expected_sha256 and expected_sha256 != sha256:
+                    status["installed"] = False
+                    status["reason"] = "sha256 mismatch"
+        return status
+
+    def preset_status(self, preset):
+        models = [self.model_status(model) for model in preset.get("models") or [] if isinstance(model, dict)]
+        missing = sum(1 for model in models if not model["installed"])
+        return {
+            "id": preset.get("id"),
+            "installed": missing == 0,
+            "missing": missing,
+            "models": models,
+        }
+
+
+_local_index = None
+
+
+def get_local_index():
+    global _local_index
+    if _local_index is None:
+        _local_index = LocalModelIndex(interval=float(os.environ.get("PDM_LOCAL_INDEX_INTERVAL", "60")))
+    return _local_index
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+from .metrics import registry
+
+
+class MetadataCache:
+    """
+    Кэш метаданных HuggingFace (результаты поиска, файлы репозиториев): LRU с ограничением
+    количества записей и временем жизни (TTL).
+
+    Одновременные запросы одного ключа объединяются — к HuggingFace уходит один запрос,
+    остальные ждут его результат. Если обновить устаревшую запись не удалось, отдаётся
+    устаревшее значение. При заданном path записи сохраняются на диск и переживают перезапуск
+    (кроме записей с persist=False — например, ключей с подписанными ссылками).
+    """
+
+    def __init__(self, max_entries=512, ttl=900, path=None):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()  # ключ -> (время истечения, значение)
+        self._transient = set()  # ключи, которые не сохраняются на диск
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "stale": 0, "errors": 0, "evictions": 0}
+        self._load()
+
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for key, (expires_at, value) in sorted(entries.items(), key=lambda item: item[1][0]):
+            # Совсем старые записи (дольше ещё одного TTL после истечения) не загружаем
+            if expires_at + self.ttl > now:
+                self._entries[key] = (expires_at, value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _save(self):
+        if not self.path:
+            return
+        with self._lock:
+            entries = {key: entry for key, entry in self._entries.items() if key not in self._transient}
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"[PresetDownloadManager] ⚠️ Не удалось сохранить кэш метаданных: {e}")
+
+    def get(self, key, allow_stale=False):
+        """Возвращает (найдено, значение); устаревшие записи — только при allow_stale"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at < time.time() and not allow_stale:
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl=None, persist=True):
+        with self._lock:
+            self._entries[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            if persist:
+                self._transient.discard(key)
+            else:
+                self._transient.add(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _entry = self._entries.popitem(last=False)
+                self._transient.discard(evicted)
+                self.stats["evictions"] += 1
+
+    async def get_or_fetch(self, key, fetch, ttl=None, persist=True):
+        """
+        Возвращает значение из кэша или вызывает fetch() (корутина) и кэширует результат.
+        Ошибки не кэшируются; если есть устаревшая запись, при ошибке возвращается она.
+        persist=False — запись хранится только в памяти (ключ может содержать токен).
+
+        Запрос выполняется отдельной задачей, а вызывающие ждут её через asyncio.shield: отмена одного
+        из них (например, отменённой загрузки) не отменяет общий запрос и не задевает остальных.
+        """
+        found, value = self.get(key)
+        if found:
+            self.stats["hits"] += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["misses"] += 1
+            task = self._inflight[key] = asyncio.ensure_future(self._fetch(key, fetch, ttl, persist))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, fetch, ttl, persist):
+        try:
+            value = await fetch()
+        except Exception:
+            self.stats["errors"] += 1
+            found, stale = self.get(key, allow_stale=True)
+            if found:
+                self.stats["stale"] += 1
+                return stale
+            raise
+        else:
+            self.set(key, value, ttl, persist)
+            if self.path and persist:
+                await asyncio.get_running_loop().run_in_executor(None, self._save)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._transient.clear()
+        if self.path:
+            self._save()
+
+    def to_dict(self):
+        with self._lock:
+            entries = len(self._entries)
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["coalesced"]
+        return {
+            **self.stats,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hit_ratio": round((self.stats["hits"] + self.stats["coalesced"]) / lookups, 3) if lookups else None,
+            "persistent": bool(self.path),
+        }
+
+
+_metadata_cache = None
+
+
+def get_metadata_cache():
+    global _metadata_cache
+    if _metadata_cache is None:
+        path = None
+        if os.environ.get("PDM_METADATA_CACHE_PERSIST", "1") == "1":
+            path = os.environ.get("PDM_METADATA_CACHE_FILE") or os.path.join(os.path.dirname(__file__), "metadata_cache.json")
+        _metadata_cache = MetadataCache(
+            max_entries=int(os.environ.get("PDM_METADATA_CACHE_SIZE", "512")),
+            ttl=float(os.environ.get("PDM_METADATA_TTL", "900")),
+            path=path,
+        )
+        registry.callback(
+            "pdm_metadata_cache_lookups_total", "HuggingFace metadata cache lookups, by result",
+            lambda: {result: _metadata_cache.stats[result] for result in ("hits", "misses", "coalesced", "stale", "errors")},
+            kind="counter", labels=("result",)
+        )
+    return _metadata_cache
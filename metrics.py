@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import time
+import bisect
+import threading
+
+# Границы корзин гистограмм (секунды)
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Счётчик, который только растёт (по набору меток)"""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(label, "") for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        if not values and not self.labels:
+            values[()] = 0
+        for key, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labels, key), value
+
+
+class Histogram:
+    """Распределение значений по корзинам (количество, сумма и накопительные счётчики корзин)"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(label, "") for label in self.labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    _format_labels(self.labels + ("le",), key + (_format_value(bound),)),
+                    cumulative,
+                )
+            yield f"{self.name}_sum", _format_labels(self.labels, key), total
+            yield f"{self.name}_count", _format_labels(self.labels, key), cumulative
+
+
+class CallbackMetric:
+    """Значения, которые считываются при каждом запросе метрик (размер очереди, статистика кэшей)"""
+
+    def __init__(self, name, documentation, collect, kind="gauge", labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labels = tuple(labels)
+        self._collect = collect
+
+    def samples(self):
+        try:
+            values = self._collect()
+        except Exception:
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            if value is None:
+                continue
+            key = key if isinstance(key, tuple) else (key,)
+            yield self.name, _format_labels(self.labels, key), value
+
+
+class MetricsRegistry:
+    """Набор метрик подсистемы загрузок; render() отдаёт их в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def callback(self, name, documentation, collect, kind="gauge", labels=()):
+        return self._register(CallbackMetric(name, documentation, collect, kind, labels))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+BYTES_DOWNLOADED = registry.counter(
+    "pdm_downloaded_bytes_total", "Bytes received from download sources", ("host",)
+)
+JOBS_FINISHED = registry.counter(
+    "pdm_jobs_finished_total", "Download jobs finished, by final status", ("status",)
+)
+JOB_DURATION = registry.histogram(
+    "pdm_job_duration_seconds", "Download job run time (from start to finish)", ("status",), DURATION_BUCKETS
+)
+JOB_QUEUE_WAIT = registry.histogram(
+    "pdm_job_queue_wait_seconds", "Time download jobs spent queued before starting", (), DURATION_BUCKETS
+)
+TIME_TO_FIRST_BYTE = registry.histogram(
+    "pdm_time_to_first_byte_seconds", "Time from sending a download request to receiving response headers",
+    ("host",), LATENCY_BUCKETS
+)
+RETRIES = registry.counter(
+    "pdm_retries_total", "Download attempts retried, by cause", ("path", "cause")
+)
+BLOB_STORE_HITS = registry.counter(
+    "pdm_blob_store_hits_total", "Files placed from the local blob store instead of being downloaded"
+)
+PEER_DOWNLOADS = registry.counter(
+    "pdm_peer_downloads_total", "Peer lookups before downloading a file, by result (hit, miss, fallback)", ("result",)
+)
+
+
+def _log_target():
+    """Куда писать JSON события: PDM_JSON_LOG=1 — stdout, путь — файл (по строке на событие), пусто — никуда"""
+    value = os.environ.get("PDM_JSON_LOG", "")
+    if value in ("", "0"):
+        return None
+    return value
+
+
+_log_lock = threading.Lock()
+
+
+def log_event(event, **fields):
+    """Пишет событие подсистемы загрузок одной строкой JSON (если включено PDM_JSON_LOG)"""
+    target = _log_target()
+    if target is None:
+        return
+    line = json.dumps({"ts": round(time.time(), 3), "event": event, **fields}, ensure_ascii=False, default=str)
+    with _log_lock:
+        if target == "1":
+            print(line, file=sys.stdout, flush=True)
+            return
+        try:
+            with open(target, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+        except OSError as e:
+            print(f"[PresetDownloadManager] ⚠️ Не удалось записать JSON лог: {e}")
@@ -0,0 +1,260 @@
+import os
+import time
+import asyncio
+from urllib.parse import urlparse
+
+import aiohttp
+
+from .bandwidth import get_bandwidth_limiter
+from .http_client import get_proxy, get_session
+from .metrics import BYTES_DOWNLOADED
+from .retry import host_key
+
+
+def source_key(url):
+    """Ключ источника в таблице оценок: схема и хост (зеркала одного хоста оцениваются вместе)"""
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}".lower()
+
+
+def _parse_list(value):
+    """Список из пресета (список или строка через запятую)"""
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [item for item in value if item]
+    return [item.strip() for item in str(value).split(",") if item.strip()]
+
+
+def source_speed_floor():
+    """(минимальная скорость источника в байт/с или 0, окно замера в секундах) из PDM_MIN_SOURCE_SPEED_KB / PDM_SLOW_SOURCE_WINDOW"""
+    floor = float(os.environ.get("PDM_MIN_SOURCE_SPEED_KB", "0")) * 1024
+    window = max(1.0, float(os.environ.get("PDM_SLOW_SOURCE_WINDOW", "20")))
+    return floor, window
+
+
+def has_mirrors(data):
+    """Есть ли у модели другие источники (в пресете или, для HuggingFace, в PDM_HF_MIRRORS)"""
+    if _parse_list(data.get("mirrors")):
+        return True
+    return not data.get("direct_url") and bool(_parse_list(os.environ.get("PDM_HF_MIRRORS")))
+
+
+def mirror_urls(data, filename=None):
+    """
+    Другие источники файла модели, кроме основного, в порядке из пресета.
+
+    Для прямой ссылки mirrors — другие ссылки на тот же файл. Для HuggingFace строка в mirrors — адрес
+    зеркала (endpoint, как HF_ENDPOINT), {"url": "..."} — точная ссылка на файл (только для model_path);
+    после зеркал пресета добавляются общие зеркала из PDM_HF_MIRRORS.
+    """
+    mirrors = _parse_list(data.get("mirrors"))
+    if data.get("direct_url"):
+        return [mirror["url"] if isinstance(mirror, dict) else mirror for mirror in mirrors
+                if not isinstance(mirror, dict) or mirror.get("url")]
+
+    from huggingface_hub import hf_hub_url
+
+    filename = filename or data.get("model_path")
+    urls = []
+    for mirror in mirrors + _parse_list(os.environ.get("PDM_HF_MIRRORS")):
+        if isinstance(mirror, dict):
+            if mirror.get("url"):
+                if filename == data.get("model_path"):
+                    urls.append(mirror["url"])
+                continue
+            mirror = mirror.get("endpoint")
+            if not mirror:
+                continue
+        urls.append(hf_hub_url(
+            repo_id=data["model_id"], filename=filename, revision=data.get("revision") or None,
+            endpoint=mirror.rstrip("/")
+        ))
+    return list(dict.fromkeys(urls))
+
+
+def mirror_token_hosts(data, url):
+    """
+    Хосты, которым можно отправлять hf_token пресета: хост основного источника url (HuggingFace/HF_ENDPOINT
+    или прямая ссылка пресета), зеркала пресета с "send_token": true и хосты из PDM_TOKEN_HOSTS.
+    Остальные зеркала (в том числе из PDM_HF_MIRRORS) получают запросы без токена.
+    """
+    hosts = {host_key(url)}
+    hosts.update(host_key(host) for host in _parse_list(os.environ.get("PDM_TOKEN_HOSTS")))
+    for mirror in _parse_list(data.get("mirrors")):
+        if isinstance(mirror, dict) and mirror.get("send_token"):
+            hosts.add(host_key(mirror.get("url") or mirror.get("endpoint")))
+    hosts.discard("")
+    return hosts
+
+
+def source_token(url, token, token_hosts):
+    """token для запроса к url, если хост url есть в token_hosts, иначе пустая строка"""
+    if not token or host_key(url) not in token_hosts:
+        return ""
+    return token
+
+
+class SourceScoreboard:
+    """
+    Оценки источников загрузки: время до первого байта и скорость (по пробам и завершённым загрузкам)
+    и последние ошибки. Загрузка с несколькими источниками начинает с лучшего из них, поэтому
+    следующие задачи сразу идут на самое быстрое зеркало, а не пробуют заново медленное.
+
+    Источник с ошибкой уходит в конец списка на cooldown секунд; оценки старше ttl считаются
+    устаревшими, и источник пробуется снова.
+    """
+
+    def __init__(self, ttl=600.0, cooldown=300.0, smoothing=0.5):
+        self.ttl = ttl
+        self.cooldown = cooldown
+        self.smoothing = smoothing
+        self._scores = {}
+        self._probes = {}
+
+    def _entry(self, url):
+        key = source_key(url)
+        entry = self._scores.get(key)
+        if entry is None:
+            entry = self._scores[key] = {
+                "ttfb": None,
+                "speed": None,
+                "updated_at": None,
+                "probes": 0,
+                "transfers": 0,
+                "failures": 0,
+                "failed_at": None,
+                "last_error": None,
+            }
+        return entry
+
+    def _smooth(self, old, new):
+        return new if old is None else self.smoothing * new + (1 - self.smoothing) * old
+
+    def record_probe(self, url, ttfb, speed):
+        entry = self._entry(url)
+        entry["ttfb"] = self._smooth(entry["ttfb"], ttfb)
+        entry["speed"] = self._smooth(entry["speed"], speed)
+        entry["probes"] += 1
+        entry["updated_at"] = time.time()
+
+    def record_transfer(self, url, size, seconds):
+        """Скорость завершённой загрузки точнее пробы — она тоже входит в оценку"""
+        if size <= 0 or seconds <= 0:
+            return
+        entry = self._entry(url)
+        entry["speed"] = self._smooth(entry["speed"], size / seconds)
+        entry["transfers"] += 1
+        entry["updated_at"] = time.time()
+
+    def record_failure(self, url, error):
+        entry = self._entry(url)
+        entry["failures"] += 1
+        entry["failed_at"] = time.time()
+        entry["last_error"] = str(error)[:300]
+
+    def _recently_failed(self, entry):
+        failed_at = entry["failed_at"]
+        return failed_at is not None and time.time() - failed_at < self.cooldown and \
+            (entry["updated_at"] is None or failed_at >= entry["updated_at"])
+
+    def is_fresh(self, url):
+        entry = self._scores.get(source_key(url))
+        if entry is None:
+            return False
+        if self._recently_failed(entry):
+            return True
+        return entry["updated_at"] is not None and time.time() - entry["updated_at"] < self.ttl
+
+    def rank(self, urls):
+        """Источники от лучшего к худшему: без недавних ошибок, с известной скоростью, быстрее"""
+        def _key(item):
+            index, url = item
+            entry = self._scores.get(source_key(url))
+            if entry is None:
+                return (0, 1, 0.0, index)
+            return (1 if self._recently_failed(entry) else 0, entry["speed"] is None, -(entry["speed"] or 0), index)
+
+        return [url for _index, url in sorted(enumerate(urls), key=_key)]
+
+    async def probe(self, url, hf_token=""):
+        """Проба источника; одновременные пробы одного хоста объединяются"""
+        key = source_key(url)
+        future = self._probes.get(key)
+        if future is None:
+            future = self._probes[key] = asyncio.ensure_future(self._probe(url, hf_token))
+            future.add_done_callback(lambda _future: self._probes.pop(key, None))
+        await asyncio.shield(future)
+
+    async def _probe(self, url, hf_token):
+        sample_size = max(1, int(os.environ.get("PDM_SOURCE_PROBE_KB", "1024"))) * 1024
+        timeout = float(os.environ.get("PDM_SOURCE_PROBE_TIMEOUT", "10"))
+        headers = {"Accept-Encoding": "identity", "Range": f"bytes=0-{sample_size - 1}"}
+        if hf_token:
+            headers["Authorization"] = f"Bearer {hf_token}"
+        host = urlparse(url).hostname
+        try:
+            session = await get_session()
+            async with get_bandwidth_limiter().connection(host):
+                started = time.monotonic()
+                async with session.get(url, headers=headers, allow_redirects=True, proxy=get_proxy(),
+                                       timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                    ttfb = time.monotonic() - started
+                    if response.status not in (200, 206):
+                        raise Exception(f"HTTP {response.status}")
+                    if 'text/html' in response.headers.get('Content-Type', '').lower():
+                        raise Exception("Source returned an HTML page instead of the file")
+                    received = 0
+                    body_started = time.monotonic()
+                    async for chunk in response.content.iter_chunked(64 * 1024):
+                        received += len(chunk)
+                        if received >= sample_size:
+                            break
+                    elapsed = time.monotonic() - body_started
+            BYTES_DOWNLOADED.inc(received, host=host)
+            self.record_probe(url, ttfb, received / max(elapsed, 0.001))
+        except Exception as e:
+            print(f"[PresetDownloadManager] ⚠️ Источник {url.split('?')[0]} недоступен: {e}")
+            self.record_failure(url, e)
+
+    async def rank_sources(self, urls, hf_token="", token_hosts=()):
+        """
+        Пробует источники без свежей оценки и возвращает все источники от лучшего к худшему.
+        hf_token отправляется только хостам из token_hosts (см. mirror_token_hosts).
+        """
+        if len(urls) < 2:
+            return list(urls)
+        stale = {source_key(url): url for url in urls if not self.is_fresh(url)}
+        if stale:
+            await asyncio.gather(*[
+                self.probe(url, source_token(url, hf_token, token_hosts)) for url in stale.values()
+            ])
+        return self.rank(urls)
+
+    def clear(self):
+        self._scores.clear()
+
+    def to_dict(self):
+        return {
+            key: dict(
+                entry,
+                ttfb=round(entry["ttfb"], 3) if entry["ttfb"] is not None else None,
+                speed=round(entry["speed"], 1) if entry["speed"] is not None else None,
+                recently_failed=self._recently_failed(entry),
+            )
+            for key, entry in self._scores.items()
+        }
+
+
+_source_scoreboard = None
+
+
+def get_source_scoreboard():
+    """Общая таблица оценок источников: PDM_SOURCE_SCORE_TTL (с) и PDM_SOURCE_COOLDOWN (с) после ошибки"""
+    global _source_scoreboard
+    if _source_scoreboard is None:
+        _source_scoreboard = SourceScoreboard(
+            ttl=float(os.environ.get("PDM_SOURCE_SCORE_TTL", "600")),
+            cooldown=float(os.environ.get("PDM_SOURCE_COOLDOWN", "300")),
+        )
+    return _source_scoreboard
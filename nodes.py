@@ -1,19 +1,34 @@
 import os
-import json
-import random
-import shutil
-import folder_paths
-from aiohttp import web
+import copy
+import asyncio
+import threading
 import aiohttp
+from aiohttp import web
 from pathlib import Path
 
+from .bandwidth import MB, get_bandwidth_limiter
+from .blob_store import get_blob_store
+from .download_plan import build_plan, execute_plan, plan_response
+from .downloader import cleanup_staging_dirs, search_models
+from .http_client import close_sessions
+from .jobs import get_job_manager
+from .local_index import get_local_index
+from .metadata_cache import get_metadata_cache
+from .metrics import registry
+from .mirrors import get_source_scoreboard
+from . import peers
+from .preset_index import DEFAULT_PAGE_SIZE
+from .preset_store import PresetConflict, PresetNotFound, get_preset_store, preset_version
+from .retry import CircuitOpenError, get_circuit_breakers
+
 class PresetDownloadManager:
     """
     Кастомная нода для управления и загрузки моделей из HuggingFace
     """
     
     def __init__(self):
-        self.presets_file = os.path.join(os.path.dirname(__file__), "presets.json")
+        self.store = get_preset_store()
+        self.presets_file = self.store.path
         self.load_presets()
     
     @classmethod
@@ -33,24 +48,14 @@ class PresetDownloadManager:
         return float("nan")
     
     def load_presets(self):
-        """Загружает пресеты из JSON файла"""
-        if os.path.exists(self.presets_file):
-            try:
-                with open(self.presets_file, 'r', encoding='utf-8') as f:
-                    self.presets = json.load(f)
-            except Exception:
-                self.presets = {"categories": [], "presets": []}
-        else:
-            self.presets = {"categories": [], "presets": []}
-            self.save_presets()
+        """Загружает пресеты (из кэша хранилища, файл перечитывается только если изменился)"""
+        # Копия, чтобы изменения до save_presets не попадали в общий кэш
+        self.presets = copy.deepcopy(self.store.load())
     
     def save_presets(self):
-        """Сохраняет пресеты в JSON файл"""
+        """Сохраняет пресеты в JSON файл (атомарно)"""
         try:
-            # Создаем папку, если её нет
-            os.makedirs(os.path.dirname(self.presets_file), exist_ok=True)
-            with open(self.presets_file, 'w', encoding='utf-8') as f:
-                json.dump(self.presets, f, ensure_ascii=False, indent=2)
+            return self.store.save(self.presets)
         except Exception as e:
             # Логируем ошибку, но не прерываем выполнение
             import traceback
@@ -74,485 +79,559 @@ def setup_routes():
     
     @PromptServer.instance.routes.get("/preset_download_manager/presets")
     async def get_presets(request):
-        manager = PresetDownloadManager()
-        manager.load_presets()
-        return web.json_response(manager.presets)
+        """Документ с пресетами; отдаётся байтами файла из кэша, при совпадении ETag — 304"""
+        body, etag = get_preset_store().snapshot()
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, content_type="application/json", charset="utf-8", headers=headers)
     
     @PromptServer.instance.routes.post("/preset_download_manager/presets")
     async def save_presets(request):
         data = await request.json()
-        manager = PresetDownloadManager()
-        manager.presets = data
+        if not isinstance(data, dict):
+            return web.json_response({
+                "status": "error",
+                "message": "Presets document must be an object"
+            }, status=400)
+        store = get_preset_store()
         try:
-            manager.save_presets()
+            loop = asyncio.get_running_loop()
+            # If-Match (ETag, полученный при чтении) защищает от перезаписи изменений из другой вкладки
+            etag = await loop.run_in_executor(None, store.save, data, request.headers.get("If-Match"))
             # Проверяем, что файл действительно сохранен
-            if os.path.exists(manager.presets_file):
+            if os.path.exists(store.path):
                 return web.json_response({
                     "status": "success",
                     "message": "Presets saved successfully",
-                    "file_path": manager.presets_file
-                })
+                    "file_path": store.path
+                }, headers={"ETag": etag})
             else:
                 return web.json_response({
                     "status": "warning",
                     "message": "Presets saved but file not found. Please check file permissions."
                 }, status=200)
+        except PresetConflict as e:
+            return web.json_response({
+                "status": "error",
+                "message": str(e)
+            }, status=412)
         except Exception as e:
             return web.json_response({
                 "status": "error",
                 "message": f"Failed to save presets: {str(e)}"
             }, status=500)
     
+    async def change_presets(func, *args):
+        """Выполняет изменение в хранилище пресетов и формирует ответ (404/409/400 при ошибках)"""
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(None, func, *args)
+        except PresetNotFound as e:
+            return None, web.json_response({
+                "status": "error",
+                "message": f"Not found: {e.args[0]}"
+            }, status=404)
+        except PresetConflict as e:
+            return None, web.json_response({
+                "status": "error",
+                "message": str(e),
+                "current": e.current
+            }, status=409)
+        except (TypeError, ValueError) as e:
+            return None, web.json_response({
+                "status": "error",
+                "message": str(e)
+            }, status=400)
+        return result, None
+    
+    def request_version(request, data=None):
+        """Версия, с которой клиент начинал изменение (поле version в теле или ?version=)"""
+        version = (data or {}).get("version", request.query.get("version"))
+        return int(version) if version not in (None, "") else None
+    
+    @PromptServer.instance.routes.post("/preset_download_manager/presets/import")
+    async def import_presets(request):
+        """Добавляет пресеты в библиотеку (существующие ID пропускаются, при "replace": true — заменяются)"""
+        data = await request.json()
+        if isinstance(data, list):
+            data = {"presets": data}
+        result, error = await change_presets(
+            get_preset_store().import_presets,
+            data.get("presets"), data.get("categories"), bool(data.get("replace"))
+        )
+        return error or web.json_response({"status": "success", **result})
+    
+    @PromptServer.instance.routes.get("/preset_download_manager/presets/query")
+    async def query_presets(request):
+        """
+        Поиск пресетов по индексу с пагинацией: ?q=&category=&save_path=&model_id=&tag=&page=&page_size=
+        Возвращает страницу пресетов и количество пресетов по категориям.
+        """
+        query = request.query
+        local_index = get_local_index()
+        
+        def run_query():
+            index = get_preset_store().index()
+            predicate = None
+            # ?installed=0 — только пресеты, в которых есть не скачанные модели, ?installed=1 — только скачанные
+            if query.get("installed") in ("0", "1"):
+                wanted = query.get("installed") == "1"
+                predicate = lambda preset: local_index.preset_status(preset)["installed"] == wanted
+            result = index.query(
+                q=query.get("q"),
+                category=query.get("category"),
+                save_path=query.get("save_path"),
+                model_id=query.get("model_id"),
+                tag=query.get("tag"),
+                page=query.get("page", 1),
+                page_size=query.get("page_size", DEFAULT_PAGE_SIZE),
+                predicate=predicate,
+            )
+            if query.get("with_status") == "1":
+                result["status"] = {preset.get("id"): local_index.preset_status(preset) for preset in result["presets"]}
+            return result
+        
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(None, run_query)
+        except ValueError as e:
+            return web.json_response({
+                "status": "error",
+                "message": f"Invalid query: {str(e)}"
+            }, status=400)
+        return web.json_response(result)
+    
+    @PromptServer.instance.routes.post("/preset_download_manager/presets/status")
+    async def presets_status(request):
+        """
+        Статус установки моделей для многих пресетов одним запросом:
+        {"preset_ids": [...]}, {"presets": [...]} или {"models": [...]}; без параметров — все пресеты.
+        """
+        data = await request.json() if request.can_read_body else {}
+        local_index = get_local_index()
+        
+        def collect():
+            if data.get("models") is not None:
+                return {"models": [local_index.model_status(model) for model in data["models"]]}
+            presets = data.get("presets")
+            if presets is None:
+                presets = get_preset_store().load()["presets"]
+                if data.get("preset_ids") is not None:
+                    wanted = set(data["preset_ids"])
+                    presets = [preset for preset in presets if preset.get("id") in wanted]
+            statuses = [local_index.preset_status(preset) for preset in presets]
+            return {
+                "presets": statuses,
+                "installed": sum(1 for status in statuses if status["installed"]),
+                "missing": sum(1 for status in statuses if not status["installed"]),
+            }
+        
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(None, collect)
+        except (TypeError, ValueError, AttributeError) as e:
+            return web.json_response({
+                "status": "error",
+                "message": f"Invalid request: {str(e)}"
+            }, status=400)
+        return web.json_response(result)
+    
+    @PromptServer.instance.routes.get("/preset_download_manager/local_index")
+    async def local_index_stats(request):
+        """Состояние индекса скачанных моделей (количество папок/файлов, время последнего обновления)"""
+        return web.json_response(get_local_index().stats())
+    
+    @PromptServer.instance.routes.get("/preset_download_manager/presets/{preset_id}")
+    async def get_preset(request):
+        preset, error = await change_presets(get_preset_store().get_preset, request.match_info["preset_id"])
+        return error or web.json_response(dict(preset, version=preset_version(preset)))
+    
+    @PromptServer.instance.routes.put("/preset_download_manager/presets/{preset_id}")
+    async def put_preset(request):
+        """Создаёт пресет (без version) или заменяет его целиком (version — текущая версия)"""
+        data = await request.json()
+        try:
+            version = request_version(request, data)
+        except (TypeError, ValueError):
+            return web.json_response({"status": "error", "message": "Invalid version"}, status=400)
+        preset, error = await change_presets(
+            get_preset_store().put_preset, request.match_info["preset_id"], data, version
+        )
+        return error or web.json_response({"status": "success", "preset": preset})
+    
+    @PromptServer.instance.routes.patch("/preset_download_manager/presets/{preset_id}")
+    async def patch_preset(request):
+        """Меняет отдельные поля пресета; при переданной version проверяет, что пресет не изменился"""
+        data = await request.json()
+        try:
+            version = request_version(request, data)
+        except (TypeError, ValueError):
+            return web.json_response({"status": "error", "message": "Invalid version"}, status=400)
+        preset, error = await change_presets(
+            get_preset_store().patch_preset, request.match_info["preset_id"], data, version
+        )
+        return error or web.json_response({"status": "success", "preset": preset})
+    
+    @PromptServer.instance.routes.delete("/preset_download_manager/presets/{preset_id}")
+    async def delete_preset(request):
+        try:
+            version = request_version(request)
+        except (TypeError, ValueError):
+            return web.json_response({"status": "error", "message": "Invalid version"}, status=400)
+        preset, error = await change_presets(
+            get_preset_store().delete_preset, request.match_info["preset_id"], version
+        )
+        return error or web.json_response({"status": "success", "preset": preset})
+    
+    @PromptServer.instance.routes.get("/preset_download_manager/categories")
+    async def list_categories(request):
+        counts, error = await change_presets(get_preset_store().list_categories)
+        return error or web.json_response({
+            "categories": [{"name": name, "count": count} for name, count in counts.items()]
+        })
+    
+    @PromptServer.instance.routes.post("/preset_download_manager/categories")
+    async def add_category(request):
+        data = await request.json()
+        _result, error = await change_presets(get_preset_store().add_category, data.get("name"))
+        return error or web.json_response({"status": "success"})
+    
+    @PromptServer.instance.routes.patch("/preset_download_manager/categories/{name}")
+    async def rename_category(request):
+        """Переименовывает категорию ({"name": "новое имя"}) у всех её пресетов"""
+        data = await request.json()
+        updated, error = await change_presets(
+            get_preset_store().rename_category, request.match_info["name"], data.get("name")
+        )
+        return error or web.json_response({"status": "success", "updated": updated})
+    
+    @PromptServer.instance.routes.delete("/preset_download_manager/categories/{name}")
+    async def delete_category(request):
+        """Удаляет категорию; её пресеты переносятся в Uncategorized (или удаляются при ?presets=delete)"""
+        affected, error = await change_presets(
+            get_preset_store().delete_category,
+            request.match_info["name"],
+            request.query.get("presets") == "delete"
+        )
+        return error or web.json_response({"status": "success", "affected": affected})
+    
     @PromptServer.instance.routes.post("/preset_download_manager/download")
     async def download_model(request):
-        """Загружает модель из HuggingFace или по прямой ссылке"""
+        """Загружает модель из HuggingFace или по прямой ссылке (ожидает завершения загрузки)"""
         data = await request.json()
-        direct_url = data.get("direct_url")
-        model_id = data.get("model_id")
-        model_path = data.get("model_path", "")
-        save_path = data.get("save_path", "checkpoints")
-        hf_token = data.get("hf_token", "")  # Опциональный API ключ
+        job_manager = get_job_manager()
+        job = job_manager.submit(data)
+        await job_manager.wait(job)
+        job_manager.mark_delivered([job])
         
+        if job.status == "completed":
+            return web.json_response(job.result)
+        return web.json_response({
+            "status": "error",
+            "message": job.error or "Download cancelled"
+        }, status=500)
+    
+    @PromptServer.instance.routes.post("/preset_download_manager/plan")
+    async def download_plan(request):
+        """
+        План загрузки пресетов ({"preset_ids": [...]} или {"presets": [...]}; без них — все пресеты):
+        модели без повторов и уже скачанных файлов, порядок (order: largest/smallest/preset)
+        и проверка места по файловым системам. С "execute": true план сразу ставится в очередь;
+        если места не хватает, возвращается 507 (без загрузок), пока не передан "force": true.
+        """
+        data = await request.json() if request.can_read_body else {}
+        presets = data.get("presets")
+        if presets is None:
+            presets = get_preset_store().load()["presets"]
+            if data.get("preset_ids") is not None:
+                wanted = set(data["preset_ids"])
+                presets = [preset for preset in presets if preset.get("id") in wanted]
         try:
-            # Типы папок, которые поддерживаются через folder_paths.get_folder_paths()
-            # Для остальных стандартных папок (например, diffusion_models) используем models_dir
-            supported_folder_types = {
-                "checkpoints": "checkpoints",
-                "loras": "loras",
-                "vae": "vae",
-                "clip": "clip",
-                "controlnet": "controlnet",
-                "upscale_models": "upscale_models",
-                "embeddings": "embeddings",
-                "hypernetworks": "hypernetworks",
-                "diffusers": "diffusers",
-                "onnx": "onnx",
-                "unet": "unet",
-                "clip_vision": "clip_vision",
-                "style_models": "style_models",
-                "vae_approx": "vae_approx",
-                "ipadapter": "ipadapter",
-                "gligen": "gligen",
-                "text_encoders": "text_encoders",
-                "audio_encoders": "audio_encoders",
-                "configs": "configs",
-                "model_patches": "model_patches",
-                "photomaker": "photomaker",
-                "sams": "sams",
-                "vibevoice": "vibevoice"
-            }
-            
-            # Типы папок, для которых get_folder_paths возвращает неправильный путь
-            # Всегда используем models_dir для этих типов
-            force_models_dir_types = {"diffusion_models"}
-            
-            # Определяем путь сохранения
-            save_path_lower = save_path.lower().strip()
-            base_path = None
-            
-            # Для проблемных типов сразу используем models_dir
-            if save_path_lower in force_models_dir_types:
-                pass  # base_path останется None, будет использован fallback
-            # Пробуем получить путь через folder_paths только для поддерживаемых типов
-            elif save_path_lower in supported_folder_types:
-                folder_type = supported_folder_types[save_path_lower]
-                try:
-                    paths = folder_paths.get_folder_paths(folder_type)
-                    if paths and len(paths) > 0 and paths[0] and paths[0].strip():
-                        # Проверяем, что путь действительно содержит название нужной папки
-                        # Это защита от случаев, когда get_folder_paths возвращает неправильный путь
-                        returned_path = paths[0].strip()
-                        if save_path_lower in returned_path.lower():
-                            base_path = returned_path
-                except Exception:
-                    pass
-            
-            # Fallback: используем models_dir с подпапкой
-            # Это работает для всех типов: стандартных, которые не поддерживаются get_folder_paths
-            # (например, diffusion_models), и нестандартных (кастомные папки)
-            if not base_path or not base_path.strip():
-                models_dir = folder_paths.models_dir
-                # Создаём подпапку с именем типа, если её нет
-                target_dir = os.path.join(models_dir, save_path)
-                os.makedirs(target_dir, exist_ok=True)
-                base_path = target_dir
-            
-            # Если указан model_path (конкретный файл), сохраняем напрямую в выбранную папку
-            # Если model_path не указан (вся модель), создаём подпапку с именем модели
-            if not model_path and not direct_url:
-                # Создаём подпапку для модели только если скачиваем всю модель
-                model_name = model_id.split("/")[-1]
-                target_dir = os.path.join(base_path, model_name)
-                os.makedirs(target_dir, exist_ok=True)
-                base_path = target_dir
-            
-            downloaded_path = None
-            last_error = None
-            
-            # Если используется прямая ссылка
-            if direct_url:
-                import time
-                from urllib.parse import urlparse
-                
-                # Параметры для повторных попыток
-                max_retries = 5
-                retry_delay = 10
-                
-                # Определяем имя файла из URL
-                parsed_url = urlparse(direct_url)
-                filename = os.path.basename(parsed_url.path)
-                if not filename or filename == "/":
-                    filename = "downloaded_file"
-                
-                target_file_path = os.path.join(base_path, filename)
-                
-                # Проверяем, существует ли файл уже
-                if os.path.exists(target_file_path) and os.path.isfile(target_file_path):
-                    file_size = os.path.getsize(target_file_path)
-                    downloaded_path = target_file_path
-                    return web.json_response({
-                        "status": "success",
-                        "path": str(downloaded_path),
-                        "message": f"File already exists ({file_size} bytes), skipped download"
-                    })
-                
-                # Пробуем загрузить с повторными попытками
-                for attempt in range(max_retries):
-                    try:
-                        headers = {}
-                        if hf_token:
-                            headers["Authorization"] = f"Bearer {hf_token}"
-                        
-                        async with aiohttp.ClientSession() as session:
-                            async with session.get(direct_url, headers=headers, allow_redirects=True) as response:
-                                if response.status != 200:
-                                    # Проверяем Content-Type перед чтением ответа
-                                    content_type = response.headers.get('Content-Type', '').lower()
-                                    if 'application/json' in content_type:
-                                        try:
-                                            error_data = await response.json()
-                                            error_msg = error_data.get('error', error_data.get('message', str(error_data)))
-                                        except:
-                                            error_text = await response.text()
-                                            if len(error_text) > 500:
-                                                error_text = error_text[:500] + "..."
-                                            error_msg = f"HTTP {response.status}: {error_text}"
-                                    else:
-                                        # Если это HTML или другой тип, читаем только первые 500 символов
-                                        error_text = await response.text()
-                                        if len(error_text) > 500:
-                                            error_text = error_text[:500] + "..."
-                                        error_msg = f"HTTP {response.status}: {error_text}"
-                                    raise Exception(error_msg)
-                                
-                                # Проверяем, что это действительно файл, а не HTML страница
-                                content_type = response.headers.get('Content-Type', '').lower()
-                                
-                                # Если Content-Type указывает на HTML, это ошибка
-                                if 'text/html' in content_type:
-                                    error_text = await response.text()
-                                    if len(error_text) > 500:
-                                        error_text = error_text[:500] + "..."
-                                    raise Exception(f"Server returned HTML page instead of file. This usually means:\n1. The URL requires authentication (check if you need HuggingFace API Token)\n2. The file doesn't exist or was moved\n3. The URL is incorrect\n\nResponse preview: {error_text[:300]}")
-                                
-                                # Читаем первые байты для проверки (независимо от Content-Type)
-                                # Это нужно, так как некоторые серверы могут не указывать правильный Content-Type
-                                first_bytes = await response.content.read(1024)
-                                
-                                # Проверяем, не является ли ответ HTML страницей
-                                if first_bytes.startswith(b'<!DOCTYPE') or first_bytes.startswith(b'<html') or first_bytes.startswith(b'<!doctype') or first_bytes.startswith(b'<HTML'):
-                                    error_text = first_bytes.decode('utf-8', errors='ignore')
-                                    if len(error_text) > 500:
-                                        error_text = error_text[:500] + "..."
-                                    raise Exception(f"Server returned HTML page instead of file. This usually means:\n1. The URL requires authentication (check if you need HuggingFace API Token)\n2. The file doesn't exist or was moved\n3. The URL is incorrect\n\nResponse preview: {error_text[:300]}")
-                                
-                                # Если все хорошо, скачиваем файл
-                                # Начинаем с уже прочитанных байтов
-                                total_size = int(response.headers.get('Content-Length', 0))
-                                downloaded = len(first_bytes)
-                                
-                                with open(target_file_path, 'wb') as f:
-                                    # Записываем первые байты, которые мы уже прочитали
-                                    f.write(first_bytes)
-                                    
-                                    # Продолжаем скачивание остальной части файла
-                                    async for chunk in response.content.iter_chunked(8192):
-                                        f.write(chunk)
-                                        downloaded += len(chunk)
-                        
-                        downloaded_path = target_file_path
-                        break
-                        
-                    except Exception as e:
-                        last_error = e
-                        error_msg = str(e)
-                        
-                        # Проверяем, это таймаут или ошибка соединения
-                        is_timeout = any(keyword in error_msg.lower() for keyword in [
-                            'timeout',
-                            'timed out',
-                            'connection',
-                            'read timeout',
-                            'connectionpool',
-                            'cas-bridge',
-                            'http 524',
-                            '524',
-                            'cloudflare'
-                        ])
-                        
-                        if is_timeout and attempt < max_retries - 1:
-                            time.sleep(retry_delay)
-                            retry_delay = min(retry_delay * 1.5, 60)
-                            continue
-                        else:
-                            raise
-            else:
-                # Используем huggingface_hub для загрузки
-                from huggingface_hub import hf_hub_download, snapshot_download, model_info
-                from huggingface_hub.utils import HfHubHTTPError
-                import time
-                
-                # Параметры для повторных попыток/таймаутов можно переопределить переменными окружения
-                max_retries = int(os.environ.get("PDM_MAX_RETRIES", "5"))
-                retry_delay = int(os.environ.get("PDM_RETRY_DELAY", "10"))
-                max_retry_delay = int(os.environ.get("PDM_MAX_RETRY_DELAY", "60"))
-                download_timeout = int(os.environ.get("PDM_DOWNLOAD_TIMEOUT", "300"))
-                snapshot_workers = int(os.environ.get("PDM_SNAPSHOT_WORKERS", "1"))
-                initial_retry_delay = retry_delay
-                
-                def _calculate_required_bytes():
-                    """Оценивает размер загрузки, чтобы проверить место на диске."""
-                    try:
-                        info = model_info(model_id, token=hf_token if hf_token else None)
-                        if not info or not getattr(info, "siblings", None):
-                            return None
-                        if model_path:
-                            for sibling in info.siblings:
-                                if sibling.rfilename == model_path:
-                                    return sibling.size
-                            return None
-                        return sum((sibling.size or 0) for sibling in info.siblings)
-                    except Exception as info_error:
-                        print(f"[PresetDownloadManager] ⚠️ Не удалось получить размер репозитория: {info_error}")
-                        return None
-                
-                def _ensure_disk_space(required_bytes: int):
-                    """Проверяет, достаточно ли места с запасом 10%."""
-                    if not required_bytes:
-                        return
-                    try:
-                        os.makedirs(base_path, exist_ok=True)
-                        usage = shutil.disk_usage(base_path)
-                    except FileNotFoundError:
-                        parent_dir = os.path.dirname(base_path) or "."
-                        usage = shutil.disk_usage(parent_dir)
-                    required_with_buffer = int(required_bytes * 1.1)
-                    if usage.free < required_with_buffer:
-                        raise RuntimeError(
-                            f"Недостаточно свободного места: нужно ~{required_with_buffer / (1024**3):.2f} ГБ, "
-                            f"доступно {usage.free / (1024**3):.2f} ГБ"
-                        )
-                
-                required_bytes = _calculate_required_bytes()
-                if required_bytes:
-                    _ensure_disk_space(required_bytes)
-                
-                # Проверяем существование файла перед началом скачивания (для model_path)
-                if model_path:
-                    # Определяем имя файла из model_path
-                    filename = os.path.basename(model_path)
-                    if not filename:
-                        # Если не удалось определить имя из пути, используем имя репозитория
-                        filename = model_id.split("/")[-1] + ".safetensors"
-                    
-                    target_file_path = os.path.join(base_path, filename)
-                    
-                    # Проверяем, существует ли файл уже
-                    if os.path.exists(target_file_path) and os.path.isfile(target_file_path):
-                        file_size = os.path.getsize(target_file_path)
-                        downloaded_path = target_file_path
-                        return web.json_response({
-                            "status": "success",
-                            "path": str(downloaded_path),
-                            "message": f"File already exists ({file_size} bytes), skipped download"
-                        })
-                
-                # Проверяем существование модели перед началом скачивания (для всей модели)
-                if not model_path:
-                    model_name = model_id.split("/")[-1]
-                    model_dir = os.path.join(base_path, model_name)
-                    
-                    if os.path.exists(model_dir) and os.path.isdir(model_dir):
-                        # Проверяем, есть ли файлы в папке (игнорируем скрытые файлы и папки)
-                        files = [f for f in os.listdir(model_dir) 
-                                if os.path.isfile(os.path.join(model_dir, f)) and not f.startswith('.')]
-                        if files:
-                            # Модель уже скачана
-                            downloaded_path = model_dir
-                            return web.json_response({
-                                "status": "success",
-                                "path": str(downloaded_path),
-                                "message": f"Model already exists ({len(files)} files), skipped download"
-                            })
-                
-                # Пробуем загрузить с повторными попытками
-                for attempt in range(max_retries):
-                    try:
-                        # Используем токен, если он указан
-                        token = hf_token if hf_token else None
-                        
-                        if model_path:
-                            # Определяем имя файла из model_path (уже определено выше, но для ясности)
-                            filename = os.path.basename(model_path)
-                            if not filename:
-                                filename = model_id.split("/")[-1] + ".safetensors"
-                            
-                            target_file_path = os.path.join(base_path, filename)
-                            
-                            # Загружаем конкретный файл
-                            # Используем временную папку, чтобы избежать создания подпапок huggingface
-                            import tempfile
-                            with tempfile.TemporaryDirectory() as temp_dir:
-                                # Скачиваем файл во временную папку
-                                temp_file = hf_hub_download(
-                                    repo_id=model_id,
-                                    filename=model_path,
-                                    local_dir=temp_dir,
-                                    local_dir_use_symlinks=False,
-                                    resume_download=True,
-                                    force_download=False,
-                                    token=token,
-                                    timeout=download_timeout
-                                )
-                                
-                                # Если имя файла не было определено ранее, берем из скачанного файла
-                                if not filename or filename == model_id.split("/")[-1] + ".safetensors":
-                                    filename = os.path.basename(temp_file)
-                                    target_file_path = os.path.join(base_path, filename)
-                                
-                                # Перемещаем файл напрямую в целевую папку
-                                # Если файл уже существует, удаляем его
-                                if os.path.exists(target_file_path):
-                                    os.remove(target_file_path)
-                                shutil.move(temp_file, target_file_path)
-                                downloaded_path = target_file_path
-                        else:
-                            # Загружаем всю модель (проверка уже выполнена выше)
-                            downloaded_path = snapshot_download(
-                                repo_id=model_id,
-                                local_dir=base_path,
-                                local_dir_use_symlinks=False,
-                                resume_download=True,  # Возобновление загрузки
-                                ignore_patterns=["*.part"],  # Игнорируем частично загруженные файлы
-                                token=token,  # API ключ (если указан)
-                                timeout=download_timeout,
-                                max_workers=snapshot_workers
-                            )
-                        
-                        # Если успешно загрузили, выходим из цикла
-                        break
-                    
-                    except HfHubHTTPError as e:
-                        last_error = e
-                        status_code = getattr(getattr(e, "response", None), "status_code", None)
-                        error_msg = f"HfHubHTTPError ({status_code}): {e}"
-                        
-                        retryable_statuses = {408, 409, 423, 425, 429, 500, 502, 503, 504, 524}
-                        is_retryable = (
-                            status_code in retryable_statuses
-                            or (status_code and 500 <= status_code < 600)
-                            or (status_code is None and "timeout" in str(e).lower())
-                        )
-                        
-                        if is_retryable and attempt < max_retries - 1:
-                            wait_time = min(
-                                max_retry_delay,
-                                retry_delay + random.uniform(0, 3)
-                            )
-                            time.sleep(wait_time)
-                            retry_delay = min(int(retry_delay * 1.5) or initial_retry_delay, max_retry_delay)
-                            continue
-                        raise
-                    
-                    except Exception as e:
-                        last_error = e
-                        error_msg = str(e)
-                        
-                        # Проверяем, это таймаут или ошибка соединения
-                        is_timeout = any(keyword in error_msg.lower() for keyword in [
-                            'timeout',
-                            'timed out',
-                            'connection',
-                            'read timeout',
-                            'connectionpool',
-                            'cas-bridge',
-                            'http 524',
-                            '524',
-                            'cloudflare'
-                        ])
-                        
-                        if is_timeout and attempt < max_retries - 1:
-                            # Если это таймаут и есть еще попытки, ждем и пробуем снова
-                            wait_time = min(
-                                max_retry_delay,
-                                retry_delay + random.uniform(0, 3)
-                            )
-                            time.sleep(wait_time)
-                            retry_delay = min(int(retry_delay * 1.5) or initial_retry_delay, max_retry_delay)
-                            continue
-                        else:
-                            # Если это не таймаут или попытки закончились, выбрасываем ошибку
-                            raise
-                
-                if downloaded_path is None:
-                    raise last_error if last_error else Exception("Failed to download model")
-            
-            # Проверяем, что файл действительно существует перед возвратом успешного ответа
-            if downloaded_path and not os.path.exists(downloaded_path):
-                raise Exception(f"File was downloaded but not found at path: {downloaded_path}")
-            
-            # Проверяем, что это файл (не директория)
-            if downloaded_path and os.path.isdir(downloaded_path):
-                # Для директорий (snapshot_download) это нормально
-                pass
-            elif downloaded_path and not os.path.isfile(downloaded_path):
-                raise Exception(f"Downloaded path exists but is not a file: {downloaded_path}")
-            
+            plan = await build_plan(presets, data.get("order") or "largest", data.get("hf_token") or "")
+        except (TypeError, ValueError, AttributeError, KeyError) as e:
             return web.json_response({
-                "status": "success",
-                "path": str(downloaded_path)
-            })
-        except Exception as e:
-            import traceback
-            error_msg = str(e)
-            traceback.print_exc()
-            
-            # Более понятное сообщение об ошибке с рекомендациями
-            if "timeout" in error_msg.lower() or "timed out" in error_msg.lower() or "cas-bridge" in error_msg.lower():
-                user_message = (
-                    f"⏱️ Таймаут при загрузке: соединение с HuggingFace прервалось.\n\n"
-                    f"💡 Возможные решения:\n"
-                    f"1. Используйте прокси/VPN (если доступ к HuggingFace ограничен).\n\n"
-                    f"2. Попробуйте загрузить снова — загрузка автоматически возобновится с места остановки.\n"
-                    f"   При необходимости увеличьте переменные PDM_MAX_RETRIES и PDM_DOWNLOAD_TIMEOUT.\n\n"
-                    f"Оригинальная ошибка: {error_msg}"
-                )
-            elif "connection" in error_msg.lower() or "connectionpool" in error_msg.lower():
-                user_message = (
-                    f"🔌 Ошибка соединения: не удалось подключиться к HuggingFace.\n\n"
-                    f"💡 Проверьте:\n"
-                    f"1. Интернет-соединение\n"
-                    f"2. Настройки прокси (если требуется)\n"
-                    f"3. Ограничения доступа к HuggingFace в вашем регионе\n\n"
-                    f"Оригинальная ошибка: {error_msg}"
-                )
-            else:
-                user_message = error_msg
-            
+                "status": "error",
+                "message": f"Invalid request: {str(e)}"
+            }, status=400)
+        
+        result = plan_response(plan)
+        if not data.get("execute"):
+            return web.json_response(result)
+        if not plan["ok"] and not data.get("force"):
             return web.json_response({
                 "status": "error",
-                "message": user_message
-            }, status=500)
+                "message": "Not enough free disk space for the selected presets",
+                "plan": result
+            }, status=507)
+        try:
+            jobs = execute_plan(plan, get_job_manager(), data.get("priority", 0))
+        except (TypeError, ValueError) as e:
+            return web.json_response({
+                "status": "error",
+                "message": f"Invalid priority: {str(e)}"
+            }, status=400)
+        return web.json_response({
+            "status": "success",
+            "plan": result,
+            "jobs": [job.to_dict() for job in jobs]
+        })
+    
+    @PromptServer.instance.routes.get("/preset_download_manager/jobs")
+    async def list_jobs(request):
+        """Список задач загрузки (опционально с фильтром ?status=)"""
+        job_manager = get_job_manager()
+        jobs = job_manager.list_jobs(request.query.get("status"))
+        response = web.json_response({
+            "jobs": [job.to_dict() for job in jobs],
+            "limits": job_manager.limits()
+        })
+        job_manager.mark_delivered(jobs)
+        return response
+    
+    @PromptServer.instance.routes.post("/preset_download_manager/jobs")
+    async def create_jobs(request):
+        """Ставит загрузки в очередь и сразу возвращает ID задач"""
+        data = await request.json()
+        priority = data.get("priority", 0)
+        models = data.get("models")
+        if models is None:
+            models = [data]
+        if not isinstance(models, list) or not models:
+            return web.json_response({
+                "status": "error",
+                "message": "No models to download"
+            }, status=400)
+        
+        job_manager = get_job_manager()
+        jobs = [job_manager.submit(model, model.get("priority", priority)) for model in models]
+        return web.json_response({
+            "status": "success",
+            "jobs": [job.to_dict() for job in jobs]
+        })
+    
+    @PromptServer.instance.routes.get("/preset_download_manager/jobs/limits")
+    async def get_job_limits(request):
+        return web.json_response(get_job_manager().limits())
+    
+    @PromptServer.instance.routes.post("/preset_download_manager/jobs/limits")
+    async def set_job_limits(request):
+        """Меняет ограничения параллельности загрузок (глобально и на хост)"""
+        data = await request.json()
+        job_manager = get_job_manager()
+        try:
+            job_manager.set_limits(data.get("max_concurrent"), data.get("max_per_host"))
+        except (TypeError, ValueError) as e:
+            return web.json_response({
+                "status": "error",
+                "message": f"Invalid limits: {str(e)}"
+            }, status=400)
+        return web.json_response(job_manager.limits())
+    
+    @PromptServer.instance.routes.get("/preset_download_manager/bandwidth")
+    async def get_bandwidth_limits(request):
+        return web.json_response(get_bandwidth_limiter().to_dict())
+    
+    @PromptServer.instance.routes.post("/preset_download_manager/bandwidth")
+    async def set_bandwidth_limits(request):
+        """
+        Меняет ограничения скорости (МБ/с) и соединений во время работы:
+        {"limit_mb": 50, "host_limits_mb": {"huggingface.co": 20}, "max_connections_per_host": 4,
+         "host_max_connections": {"huggingface.co": 2}}; 0 или null снимает лимит
+        """
+        data = await request.json()
+        limiter = get_bandwidth_limiter()
+        try:
+            limiter.set_limits(
+                rate=float(data["limit_mb"] or 0) * MB if "limit_mb" in data else None,
+                host_rates={
+                    host: float(value or 0) * MB for host, value in (data.get("host_limits_mb") or {}).items()
+                },
+                max_connections=data.get("max_connections_per_host"),
+                host_connections=data.get("host_max_connections"),
+            )
+        except (TypeError, ValueError, AttributeError) as e:
+            return web.json_response({
+                "status": "error",
+                "message": f"Invalid limits: {str(e)}"
+            }, status=400)
+        return web.json_response(limiter.to_dict())
+    
+    @PromptServer.instance.routes.get("/preset_download_manager/sources")
+    async def get_source_scores(request):
+        """Оценки источников загрузки (скорость, время до первого байта, ошибки) по хостам"""
+        return web.json_response(get_source_scoreboard().to_dict())
+    
+    @PromptServer.instance.routes.post("/preset_download_manager/sources/clear")
+    async def clear_source_scores(request):
+        get_source_scoreboard().clear()
+        return web.json_response({"status": "success"})
+    
+    @PromptServer.instance.routes.get("/preset_download_manager/circuits")
+    async def get_circuits(request):
+        """Автоматические выключатели по хостам: состояние, ошибки подряд, сколько раз выключались"""
+        return web.json_response(get_circuit_breakers().to_dict())
+    
+    @PromptServer.instance.routes.post("/preset_download_manager/circuits/reset")
+    async def reset_circuits(request):
+        get_circuit_breakers().reset()
+        return web.json_response({"status": "success"})
+    
+    @PromptServer.instance.routes.get("/preset_download_manager/peers")
+    async def get_peers_status(request):
+        """Режим узлов: идентификатор узла, раздаёт ли он файлы, соседние узлы и файлы, которые он сейчас качает"""
+        return web.json_response(peers.status())
+    
+    def _peer_request_error(request):
+        if not peers.serving_enabled():
+            return web.json_response({
+                "status": "error",
+                "message": "Peer mode is disabled"
+            }, status=404)
+        if not peers.is_authorized(request):
+            return web.json_response({
+                "status": "error",
+                "message": "Invalid peer token"
+            }, status=401)
+        return None
+    
+    @PromptServer.instance.routes.get("/preset_download_manager/peer/lookup")
+    async def peer_lookup(request):
+        """Поиск файла соседним узлом: ?sha256=...&source=url:...|hf:repo@revision:path"""
+        error = _peer_request_error(request)
+        if error:
+            return error
+        loop = asyncio.get_running_loop()
+        answer = await loop.run_in_executor(
+            None, peers.lookup, request.query.get("sha256"), request.query.get("source")
+        )
+        return web.json_response(answer)
+    
+    @PromptServer.instance.routes.get("/preset_download_manager/peer/blobs/{sha256}")
+    async def peer_blob(request):
+        """Файл по SHA-256 для соседнего узла (с поддержкой Range/If-Range)"""
+        error = _peer_request_error(request)
+        if error:
+            return error
+        loop = asyncio.get_running_loop()
+        found = await loop.run_in_executor(None, peers.find_local_file, request.match_info["sha256"], None)
+        if found is None:
+            return web.json_response({
+                "status": "error",
+                "message": "File not found"
+            }, status=404)
+        return web.FileResponse(found[0], headers={"Content-Type": "application/octet-stream"})
+    
+    @PromptServer.instance.routes.get("/preset_download_manager/jobs/{job_id}")
+    async def get_job(request):
+        job_manager = get_job_manager()
+        job = job_manager.get(request.match_info["job_id"])
+        if job is None:
+            return web.json_response({
+                "status": "error",
+                "message": "Job not found"
+            }, status=404)
+        response = web.json_response(job.to_dict())
+        job_manager.mark_delivered([job])
+        return response
+    
+    @PromptServer.instance.routes.get("/preset_download_manager/jobs/{job_id}/progress")
+    async def get_job_progress(request):
+        """Прогресс загрузки (fallback для клиентов без websocket)"""
+        job = get_job_manager().get(request.match_info["job_id"])
+        if job is None:
+            return web.json_response({
+                "status": "error",
+                "message": "Job not found"
+            }, status=404)
+        return web.json_response(job.progress_dict() or {"job_id": job.id, "status": job.status})
+    
+    @PromptServer.instance.routes.post("/preset_download_manager/jobs/{job_id}/cancel")
+    async def cancel_job(request):
+        job_manager = get_job_manager()
+        job = job_manager.get(request.match_info["job_id"])
+        if job is None or not job_manager.cancel(job.id):
+            return web.json_response({
+                "status": "error",
+                "message": "Job not found or already finished"
+            }, status=404)
+        return web.json_response({
+            "status": "success",
+            "job": job.to_dict()
+        })
+    
+    @PromptServer.instance.routes.post("/preset_download_manager/jobs/{job_id}/priority")
+    async def set_job_priority(request):
+        data = await request.json()
+        try:
+            job = get_job_manager().set_priority(request.match_info["job_id"], data.get("priority", 0))
+        except (TypeError, ValueError) as e:
+            return web.json_response({
+                "status": "error",
+                "message": f"Invalid priority: {str(e)}"
+            }, status=400)
+        if job is None:
+            return web.json_response({
+                "status": "error",
+                "message": "Job not found"
+            }, status=404)
+        return web.json_response({
+            "status": "success",
+            "job": job.to_dict()
+        })
+    
+    @PromptServer.instance.routes.get("/preset_download_manager/blobs")
+    async def get_blob_usage(request):
+        """Отчёт об использовании диска локальным хранилищем файлов по SHA-256"""
+        store = get_blob_store()
+        if store is None:
+            return web.json_response({"enabled": False})
+        loop = asyncio.get_running_loop()
+        usage = await loop.run_in_executor(None, store.usage)
+        return web.json_response({"enabled": True, **usage})
+    
+    @PromptServer.instance.routes.post("/preset_download_manager/blobs/gc")
+    async def collect_blobs(request):
+        """Удаляет давно не использованные файлы хранилища до размера max_bytes (по умолчанию PDM_BLOB_MAX_GB)"""
+        store = get_blob_store()
+        if store is None:
+            return web.json_response({
+                "status": "error",
+                "message": "Blob store is disabled"
+            }, status=400)
+        data = await request.json() if request.can_read_body else {}
+        try:
+            max_bytes = int(data["max_bytes"]) if data.get("max_bytes") is not None else None
+        except (TypeError, ValueError) as e:
+            return web.json_response({
+                "status": "error",
+                "message": f"Invalid max_bytes: {str(e)}"
+            }, status=400)
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, store.gc, max_bytes)
+        return web.json_response({"status": "success", **result})
+    
+    @PromptServer.instance.routes.get("/preset_download_manager/metrics")
+    async def get_metrics(request):
+        """Метрики загрузок в текстовом формате Prometheus"""
+        # Очередь и кэш регистрируют свои метрики при создании
+        get_job_manager()
+        get_metadata_cache()
+        return web.Response(
+            body=registry.render().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+    
+    @PromptServer.instance.routes.get("/preset_download_manager/metadata_cache")
+    async def get_metadata_cache_stats(request):
+        """Счётчики кэша метаданных HuggingFace (попадания, промахи, объединённые запросы)"""
+        return web.json_response(get_metadata_cache().to_dict())
+    
+    @PromptServer.instance.routes.post("/preset_download_manager/metadata_cache/clear")
+    async def clear_metadata_cache(request):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, get_metadata_cache().clear)
+        return web.json_response({"status": "success"})
     
     @PromptServer.instance.routes.get("/preset_download_manager/huggingface/search")
     async def search_huggingface(request):
@@ -561,27 +640,50 @@ def setup_routes():
         limit = int(request.query.get("limit", 10))
         
         try:
-            async with aiohttp.ClientSession() as session:
-                url = "https://huggingface.co/api/models"
-                params = {
-                    "search": query,
-                    "limit": limit,
-                    "sort": "downloads",
-                    "direction": -1
-                }
-                async with session.get(url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return web.json_response(data)
-                    else:
-                        return web.json_response({
-                            "error": "Failed to search HuggingFace"
-                        }, status=response.status)
+            data = await search_models(query, limit)
+            return web.json_response(data)
+        except aiohttp.ClientResponseError as e:
+            return web.json_response({
+                "error": "Failed to search HuggingFace"
+            }, status=e.status)
+        except CircuitOpenError as e:
+            return web.json_response({
+                "error": str(e)
+            }, status=503)
         except Exception as e:
             return web.json_response({
                 "error": str(e)
             }, status=500)
 
+# Фоновая работа запускается один раз, даже если регистрация routes повторялась
+_background_started = False
+
+def start_background_work():
+    """Подписки на сервер и фоновые потоки; запускаются один раз, после регистрации routes"""
+    global _background_started
+    if _background_started:
+        return
+    _background_started = True
+    from server import PromptServer
+    
+    # Изменения задач и прогресс загрузок отправляем в браузер через websocket ComfyUI
+    get_job_manager().add_listener(
+        lambda event, payload: PromptServer.instance.send_sync(event, payload)
+    )
+    
+    # Общая HTTP сессия закрывается вместе с сервером
+    PromptServer.instance.app.on_cleanup.append(close_sessions)
+    
+    # Временные файлы загрузок, прерванных при прошлом запуске, удаляем в фоне
+    threading.Thread(target=cleanup_staging_dirs, name="pdm-staging-cleanup", daemon=True).start()
+    
+    # Файлы хранилища, которые больше не использует ни одна папка моделей, тоже удаляем в фоне
+    if get_blob_store() is not None:
+        threading.Thread(target=get_blob_store().gc, name="pdm-blob-gc", daemon=True).start()
+    
+    # Индекс скачанных моделей строится в фоне
+    get_local_index().start()
+
 # Инициализация routes
 def init_routes():
     """Инициализация routes после загрузки модуля"""
@@ -594,7 +696,11 @@ def init_routes():
         try:
             setup_routes()
         except Exception:
-            pass
+            return
+    try:
+        start_background_work()
+    except Exception as e:
+        print(f"[PresetDownloadManager] ⚠️ Не удалось запустить фоновые задачи: {e}")
 
 # Пытаемся зарегистрировать routes сразу
 init_routes()
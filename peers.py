@@ -0,0 +1,248 @@
+import os
+import re
+import hmac
+import time
+import uuid
+import asyncio
+import contextlib
+import threading
+
+import aiohttp
+
+from .blob_store import get_blob_store
+from .http_client import get_proxy, get_session
+from .integrity import get_verification_store, normalize_sha256
+
+# Идентификатор этого узла: по нему узел узнаёт себя в общем списке PDM_PEERS
+NODE_ID = os.environ.get("PDM_PEER_ID") or uuid.uuid4().hex[:12]
+
+API_PREFIX = "/preset_download_manager/peer"
+
+
+def peer_token():
+    """Общий секрет узлов (PDM_PEER_TOKEN); без него режим узлов выключен"""
+    return os.environ.get("PDM_PEER_TOKEN", "")
+
+
+def peer_urls():
+    """
+    Адреса соседних узлов (ComfyUI) из PDM_PEERS: через запятую или путь к файлу со списком
+    (по адресу в строке). Файл перечитывается при каждом поиске, поэтому его может обновлять оркестратор.
+    """
+    value = os.environ.get("PDM_PEERS", "").strip()
+    if value and os.path.isfile(value):
+        try:
+            with open(value, 'r', encoding='utf-8') as f:
+                value = ",".join(line.split("#")[0].strip() for line in f)
+        except OSError as e:
+            print(f"[PresetDownloadManager] ⚠️ Не удалось прочитать список узлов {value}: {e}")
+            return []
+    return list(dict.fromkeys(url.strip().rstrip("/") for url in value.split(",") if url.strip()))
+
+
+def serving_enabled():
+    return bool(peer_token())
+
+
+def peers_enabled():
+    """Искать ли файлы у соседних узлов перед загрузкой из источника"""
+    return bool(peer_token() and peer_urls())
+
+
+def is_authorized(request):
+    """Запрос узла с верным токеном (Authorization: Bearer <PDM_PEER_TOKEN>)"""
+    token = peer_token()
+    header = request.headers.get("Authorization", "")
+    if not token or not header.startswith("Bearer "):
+        return False
+    return hmac.compare_digest(header[len("Bearer "):].encode("utf-8"), token.encode("utf-8"))
+
+
+def blob_url(peer, sha256):
+    return f"{peer}{API_PREFIX}/blobs/{sha256}"
+
+
+# Файлы, которые этот узел сейчас качает: ключ ("sha256:..." или "source:...") -> [(время начала, прогресс)]
+_claims = {}
+_claims_lock = threading.Lock()
+
+
+def _claim_keys(sha256=None, source=None):
+    keys = []
+    if normalize_sha256(sha256):
+        keys.append(f"sha256:{normalize_sha256(sha256)}")
+    if source:
+        keys.append(f"source:{source}")
+    return keys
+
+
+@contextlib.contextmanager
+def claim_download(sha256=None, source=None, progress=None):
+    """
+    Отмечает, что файл качается на этом узле: узлы, начавшие позже, ждут его, а не качают файл сами.
+    progress (TransferProgress) сообщается ждущим узлам, чтобы они заметили зависшую загрузку.
+    Возвращает время начала загрузки.
+    """
+    claim = (time.time(), progress)
+    keys = _claim_keys(sha256, source)
+    with _claims_lock:
+        for key in keys:
+            _claims.setdefault(key, []).append(claim)
+    try:
+        yield claim[0]
+    finally:
+        with _claims_lock:
+            for key in keys:
+                claims = _claims.get(key)
+                if claims:
+                    claims.remove(claim)
+                    if not claims:
+                        del _claims[key]
+
+
+def _claimed_since(sha256=None, source=None):
+    """(время начала самой ранней загрузки файла на этом узле, скачано байт) или None"""
+    with _claims_lock:
+        claims = [claim for key in _claim_keys(sha256, source) for claim in _claims.get(key, [])]
+    if not claims:
+        return None
+    started_at, progress = min(claims, key=lambda claim: claim[0])
+    return started_at, progress.downloaded if progress is not None else None
+
+
+def find_local_file(sha256=None, source=None):
+    """
+    Готовый файл на этом узле по SHA-256 или источнику: из хранилища по SHA-256 или среди
+    проверенных файлов в папках моделей (они запоминаются и по источнику, поэтому хранилище не обязательно).
+    Возвращает (путь, SHA-256) или None.
+    """
+    sha256 = normalize_sha256(sha256)
+    if sha256 and not re.fullmatch(r"[0-9a-f]{64}", sha256):
+        return None
+    store = get_blob_store()
+    if store is not None:
+        found = store.resolve(sha256, source)
+        if found:
+            return store.blob_path(found), found
+    if sha256:
+        path = get_verification_store().find(sha256)
+        if path:
+            return path, sha256
+    if source:
+        found = get_verification_store().find_source(source)
+        if found and (not sha256 or found[1] == sha256):
+            return found
+    return None
+
+
+def lookup(sha256=None, source=None):
+    """Ответ узла на поиск файла: есть ли он, а если нет — качается ли он сейчас и с какого момента"""
+    answer = {"node": NODE_ID, "available": False}
+    found = find_local_file(sha256, source)
+    if found:
+        path, found_sha256 = found
+        try:
+            answer.update(available=True, sha256=found_sha256, size=os.path.getsize(path))
+        except OSError:
+            pass
+        return answer
+    claimed = _claimed_since(sha256, source)
+    if claimed is not None:
+        started_at, downloaded = claimed
+        answer.update(downloading=True, started_at=started_at, downloaded=downloaded)
+    return answer
+
+
+def status():
+    with _claims_lock:
+        downloading = sorted(_claims)
+    return {
+        "node": NODE_ID,
+        "serving": serving_enabled(),
+        "peers": peer_urls(),
+        "downloading": downloading,
+    }
+
+
+async def _query_peer(session, peer, params, timeout):
+    try:
+        async with session.get(
+            f"{peer}{API_PREFIX}/lookup", params=params, proxy=get_proxy(),
+            headers={"Authorization": f"Bearer {peer_token()}"},
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as response:
+            if response.status != 200:
+                raise Exception(f"HTTP {response.status}")
+            answer = await response.json()
+    except Exception as e:
+        print(f"[PresetDownloadManager] ⚠️ Узел {peer} не ответил: {e}")
+        return None
+    if not isinstance(answer, dict) or answer.get("node") == NODE_ID:
+        return None
+    return dict(answer, peer=peer)
+
+
+async def query_peers(sha256=None, source=None):
+    """Опрашивает все узлы из PDM_PEERS (таймаут PDM_PEER_TIMEOUT) и возвращает их ответы"""
+    params = {}
+    if normalize_sha256(sha256):
+        params["sha256"] = normalize_sha256(sha256)
+    if source:
+        params["source"] = source
+    timeout = float(os.environ.get("PDM_PEER_TIMEOUT", "3"))
+    session = await get_session()
+    answers = await asyncio.gather(*[_query_peer(session, peer, params, timeout) for peer in peer_urls()])
+    return [answer for answer in answers if answer]
+
+
+async def find_peer_sources(sha256=None, source=None, started_at=None):
+    """
+    Ищет готовый файл у соседних узлов. Возвращает (ссылки на файл у узлов, SHA-256, размер) или None.
+
+    Если файла ни у кого нет, но его уже качает узел, начавший раньше (started_at этого узла), ждём
+    до PDM_PEER_WAIT секунд, пока он закончит: так из интернета файл скачивается один раз на кластер.
+    Узел, у которого загрузка не продвигается PDM_PEER_STALL_TIMEOUT секунд (завис или упал, но ещё
+    отвечает), больше не ждём.
+    """
+    sha256 = normalize_sha256(sha256)
+    own_order = (started_at if started_at is not None else time.time(), NODE_ID)
+    deadline = time.monotonic() + float(os.environ.get("PDM_PEER_WAIT", "600"))
+    poll_interval = float(os.environ.get("PDM_PEER_POLL_INTERVAL", "2"))
+    stall_timeout = float(os.environ.get("PDM_PEER_STALL_TIMEOUT", "60"))
+    waiting_for = None
+    # (узел, начало его загрузки) -> (последнее значение downloaded, когда оно изменилось)
+    last_progress = {}
+    while True:
+        answers = await query_peers(sha256, source)
+        holders = [
+            answer for answer in answers
+            if answer.get("available") and normalize_sha256(answer.get("sha256"))
+            and (not sha256 or normalize_sha256(answer["sha256"]) == sha256)
+        ]
+        if holders:
+            found_sha256 = normalize_sha256(holders[0]["sha256"])
+            holders = [answer for answer in holders if normalize_sha256(answer["sha256"]) == found_sha256]
+            return [blob_url(answer["peer"], found_sha256) for answer in holders], found_sha256, holders[0].get("size")
+        now = time.monotonic()
+        earlier = []
+        for answer in answers:
+            if not answer.get("downloading") or (answer.get("started_at") or 0, answer["node"]) >= own_order:
+                continue
+            key = (answer["peer"], answer.get("started_at"))
+            previous = last_progress.get(key)
+            if previous is None or previous[0] != answer.get("downloaded"):
+                last_progress[key] = (answer.get("downloaded"), now)
+            elif answer.get("downloaded") is not None and now - previous[1] >= stall_timeout:
+                if waiting_for == answer["peer"]:
+                    print(f"[PresetDownloadManager] ⚠️ Загрузка на узле {answer['peer']} не продвигается "
+                          f"{stall_timeout:g} с, больше её не ждём")
+                    waiting_for = None
+                continue
+            earlier.append(answer)
+        earlier.sort(key=lambda answer: answer.get("started_at") or 0)
+        if not earlier or now >= deadline:
+            return None
+        if waiting_for != earlier[0]["peer"]:
+            waiting_for = earlier[0]["peer"]
+            print(f"[PresetDownloadManager] Файл уже качает узел {waiting_for}, ждём его")
+        await asyncio.sleep(poll_interval)
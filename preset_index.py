@@ -0,0 +1,112 @@
+import re
+import bisect
+from urllib.parse import urlparse
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _tokens(text):
+    return _TOKEN_RE.findall(str(text).lower()) if text else []
+
+
+class PresetIndex:
+    """
+    Индекс пресетов для поиска и фильтрации на сервере.
+
+    Строится один раз для версии документа (etag): для категорий, save_path, model_id и тегов хранятся
+    множества позиций пресетов, для слов из названия и источников моделей — отсортированный список слов,
+    так что поиск по префиксу — это бинарный поиск, а не перебор всех пресетов.
+    """
+
+    def __init__(self, document, etag=None):
+        self.etag = etag
+        self.presets = list(document.get("presets", []))
+        self.by_category = {}
+        self.by_save_path = {}
+        self.by_model_id = {}
+        self.by_tag = {}
+        self._by_token = {}
+        # Категории из списка categories показываем даже без пресетов
+        for category in document.get("categories", []):
+            self.by_category.setdefault(category, set())
+
+        for position, preset in enumerate(self.presets):
+            self.by_category.setdefault(preset.get("category") or "Uncategorized", set()).add(position)
+            for tag in preset.get("tags") or []:
+                self.by_tag.setdefault(str(tag).lower(), set()).add(position)
+            words = _tokens(preset.get("name")) + _tokens(preset.get("id"))
+            for model in preset.get("models") or []:
+                if not isinstance(model, dict):
+                    continue
+                if model.get("save_path"):
+                    self.by_save_path.setdefault(model["save_path"], set()).add(position)
+                if model.get("model_id"):
+                    self.by_model_id.setdefault(model["model_id"].lower(), set()).add(position)
+                    words += _tokens(model["model_id"])
+                words += _tokens(model.get("model_path"))
+                if model.get("direct_url"):
+                    words += _tokens(urlparse(model["direct_url"]).path.rsplit("/", 1)[-1])
+            for word in words:
+                self._by_token.setdefault(word, set()).add(position)
+        self._tokens = sorted(self._by_token)
+
+    def _match_prefix(self, prefix):
+        """Позиции пресетов, в которых есть слово, начинающееся с prefix"""
+        matches = set()
+        start = bisect.bisect_left(self._tokens, prefix)
+        for token in self._tokens[start:]:
+            if not token.startswith(prefix):
+                break
+            matches |= self._by_token[token]
+        return matches
+
+    def query(self, q=None, category=None, save_path=None, model_id=None, tag=None,
+              page=1, page_size=DEFAULT_PAGE_SIZE, predicate=None):
+        """
+        Возвращает страницу пресетов, подходящих под все фильтры, и количество пресетов по категориям
+        (с учётом всех фильтров, кроме самой категории — чтобы можно было переключаться между категориями).
+        predicate(preset) — дополнительный фильтр (например, "только не скачанные").
+        """
+        page_size = min(MAX_PAGE_SIZE, max(1, int(page_size)))
+        page = max(1, int(page))
+
+        matched = None
+        filters = [
+            (self.by_save_path, save_path),
+            (self.by_model_id, model_id.lower() if model_id else None),
+            (self.by_tag, tag.lower() if tag else None),
+        ]
+        for index, value in filters:
+            if value:
+                positions = index.get(value, set())
+                matched = positions if matched is None else matched & positions
+        for word in _tokens(q):
+            positions = self._match_prefix(word)
+            matched = positions if matched is None else matched & positions
+        if matched is None:
+            matched = set(range(len(self.presets)))
+        if predicate is not None:
+            matched = {position for position in matched if predicate(self.presets[position])}
+
+        categories = [
+            {"name": name, "count": len(positions & matched)}
+            for name, positions in self.by_category.items()
+        ]
+        if category:
+            matched = matched & self.by_category.get(category, set())
+
+        positions = sorted(matched)
+        total = len(positions)
+        start = (page - 1) * page_size
+        return {
+            "presets": [self.presets[position] for position in positions[start:start + page_size]],
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "pages": max(1, (total + page_size - 1) // page_size),
+            "categories": categories,
+            "total_presets": len(self.presets),
+        }
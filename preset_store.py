@@ -0,0 +1,367 @@
+import os
+import copy
+import json
+import uuid
+import hashlib
+import threading
+
+from .preset_index import PresetIndex
+
+
+# Категория, в которую попадают пресеты без категории
+DEFAULT_CATEGORY = "Uncategorized"
+
+
+class PresetNotFound(KeyError):
+    """Пресет или категория не найдены"""
+
+
+class PresetConflict(Exception):
+    """
+    Пресет изменён с тех пор, как клиент его прочитал (версия не совпадает),
+    или создаётся пресет с уже существующим ID. current — текущее состояние на сервере.
+    """
+
+    def __init__(self, message, current=None):
+        super().__init__(message)
+        self.current = current
+
+
+def preset_version(preset):
+    """Версия пресета; у пресетов, сохранённых до появления версий, она равна 1"""
+    return preset.get("version") or 1
+
+
+def _empty_document():
+    return {"categories": [], "presets": []}
+
+
+class PresetStore:
+    """
+    Общий для процесса кэш presets.json.
+
+    Разобранный документ и исходные байты файла хранятся в памяти и перечитываются только
+    при изменении mtime/размера файла (например, если его отредактировали вручную).
+    ETag считается по содержимому, поэтому клиент может получать 304 вместо всего документа.
+    Запись идёт во временный файл с заменой через os.replace под блокировкой,
+    так что одновременные сохранения не портят файл.
+
+    Отдельные пресеты меняются через put/patch/delete_preset с проверкой версии
+    (оптимистичная блокировка): устаревшее изменение отклоняется PresetConflict, а не перезаписывает чужое.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._stat_key = None
+        self._document = None
+        self._raw = None
+        self._etag = None
+        self._index = None
+
+    def _file_stat_key(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _refresh(self):
+        """Перечитывает файл, если он изменился с момента последнего чтения (вызывается под блокировкой)"""
+        stat_key = self._file_stat_key()
+        if self._document is not None and stat_key == self._stat_key:
+            return
+        if stat_key is None:
+            # Файла ещё нет — создаём пустой
+            self._write(_empty_document())
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+            document = json.loads(raw)
+            if not isinstance(document, dict):
+                raise ValueError("presets.json must contain an object")
+        except (OSError, ValueError) as e:
+            print(f"[PresetDownloadManager] ⚠️ Не удалось прочитать пресеты: {e}")
+            document = _empty_document()
+            raw = json.dumps(document, ensure_ascii=False).encode('utf-8')
+        document.setdefault("categories", [])
+        document.setdefault("presets", [])
+        self._set(document, raw, stat_key)
+
+    def _set(self, document, raw, stat_key):
+        self._document = document
+        self._raw = raw
+        self._etag = '"' + hashlib.sha1(raw).hexdigest()[:20] + '"'
+        self._stat_key = stat_key
+
+    def _write(self, document):
+        raw = json.dumps(document, ensure_ascii=False, indent=2).encode('utf-8')
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(raw)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._set(document, raw, self._file_stat_key())
+
+    def load(self):
+        """
+        Возвращает документ с пресетами. Документ общий для всех вызовов, изменять его нельзя;
+        изменения создают новый документ, поэтому полученный можно обходить без блокировки.
+        """
+        with self._lock:
+            self._refresh()
+            return self._document
+
+    def snapshot(self):
+        """Возвращает (байты JSON документа, ETag) без повторной сериализации"""
+        with self._lock:
+            self._refresh()
+            return self._raw, self._etag
+
+    def index(self):
+        """Индекс для поиска по текущей версии документа (перестраивается после изменений)"""
+        with self._lock:
+            self._refresh()
+            if self._index is None or self._index.etag != self._etag:
+                self._index = PresetIndex(self._document, self._etag)
+            return self._index
+
+    def save(self, document, if_match=None):
+        """
+        Атомарно сохраняет документ и возвращает новый ETag.
+        Если передан if_match, документ сохраняется только если текущий ETag с ним совпадает.
+        """
+        if not isinstance(document, dict):
+            raise ValueError("Presets document must be an object")
+        # Копия: вызывающий может продолжать менять свой документ, а общий меняться не должен
+        document = copy.deepcopy(document)
+        document.setdefault("categories", [])
+        document.setdefault("presets", [])
+        with self._lock:
+            if if_match is not None:
+                self._refresh()
+                if if_match != self._etag:
+                    raise PresetConflict("Presets were changed by another client")
+            self._write(document)
+            return self._etag
+
+    def _modify(self, func):
+        """
+        Изменяет копию документа под блокировкой и сохраняет её; опубликованный документ не меняется.
+        Функции изменения заменяют пресеты новыми словарями, поэтому достаточно скопировать списки.
+        Если проверка или запись не удалась, текущий документ остаётся прежним.
+        """
+        with self._lock:
+            self._refresh()
+            document = dict(self._document,
+                            categories=list(self._document["categories"]),
+                            presets=list(self._document["presets"]))
+            result = func(document)
+            self._write(document)
+            return result
+
+    def _find(self, document, preset_id):
+        for index, preset in enumerate(document["presets"]):
+            if preset.get("id") == preset_id:
+                return index, preset
+        return None, None
+
+    @staticmethod
+    def _check_version(preset, version):
+        if version is not None and int(version) != preset_version(preset):
+            raise PresetConflict(
+                f"Preset {preset.get('id')} was changed (version {preset_version(preset)}, expected {version})",
+                preset
+            )
+
+    @staticmethod
+    def _validate(preset):
+        if not isinstance(preset, dict):
+            raise ValueError("Preset must be an object")
+        if not isinstance(preset.get("models", []), list):
+            raise ValueError("Preset models must be a list")
+
+    def get_preset(self, preset_id):
+        with self._lock:
+            self._refresh()
+            _index, preset = self._find(self._document, preset_id)
+            if preset is None:
+                raise PresetNotFound(preset_id)
+            return preset
+
+    def put_preset(self, preset_id, preset, version=None):
+        """
+        Создаёт пресет или полностью заменяет существующий.
+        Замена требует version (текущую версию пресета), иначе — конфликт.
+        """
+        self._validate(preset)
+
+        def apply(document):
+            index, current = self._find(document, preset_id)
+            new_preset = {key: value for key, value in preset.items() if key != "version"}
+            new_preset["id"] = preset_id
+            new_preset.setdefault("category", DEFAULT_CATEGORY)
+            new_preset.setdefault("models", [])
+            if current is None:
+                new_preset["version"] = 1
+                document["presets"].append(new_preset)
+            else:
+                if version is None:
+                    raise PresetConflict(f"Preset {preset_id} already exists", current)
+                self._check_version(current, version)
+                new_preset["version"] = preset_version(current) + 1
+                document["presets"][index] = new_preset
+            return new_preset
+
+        return self._modify(apply)
+
+    def patch_preset(self, preset_id, fields, version=None):
+        """Меняет отдельные поля пресета (остальные поля сохраняются)"""
+        self._validate(fields)
+
+        def apply(document):
+            index, current = self._find(document, preset_id)
+            if current is None:
+                raise PresetNotFound(preset_id)
+            self._check_version(current, version)
+            new_preset = dict(current)
+            new_preset.update({key: value for key, value in fields.items() if key not in ("id", "version")})
+            new_preset["version"] = preset_version(current) + 1
+            document["presets"][index] = new_preset
+            return new_preset
+
+        return self._modify(apply)
+
+    def delete_preset(self, preset_id, version=None):
+        def apply(document):
+            index, current = self._find(document, preset_id)
+            if current is None:
+                raise PresetNotFound(preset_id)
+            self._check_version(current, version)
+            del document["presets"][index]
+            return current
+
+        return self._modify(apply)
+
+    def import_presets(self, presets, categories=None, replace=False):
+        """
+        Добавляет пресеты в библиотеку: пресеты с новыми ID добавляются, с существующими — заменяются
+        (если replace), иначе пропускаются. Возвращает количество добавленных/заменённых/пропущенных.
+        """
+        if not isinstance(presets, list):
+            raise ValueError("presets must be a list")
+        for preset in presets:
+            self._validate(preset)
+
+        def apply(document):
+            counts = {"added": 0, "replaced": 0, "skipped": 0}
+            positions = {preset.get("id"): index for index, preset in enumerate(document["presets"])}
+            for preset in presets:
+                new_preset = dict(preset)
+                new_preset.setdefault("category", DEFAULT_CATEGORY)
+                new_preset.setdefault("models", [])
+                preset_id = new_preset.get("id")
+                if not preset_id:
+                    preset_id = new_preset["id"] = f"preset-{uuid.uuid4().hex[:12]}"
+                index = positions.get(preset_id)
+                if index is None:
+                    new_preset["version"] = 1
+                    positions[preset_id] = len(document["presets"])
+                    document["presets"].append(new_preset)
+                    counts["added"] += 1
+                elif replace:
+                    new_preset["version"] = preset_version(document["presets"][index]) + 1
+                    document["presets"][index] = new_preset
+                    counts["replaced"] += 1
+                else:
+                    counts["skipped"] += 1
+            for category in categories or []:
+                if category not in document["categories"]:
+                    document["categories"].append(category)
+            return counts
+
+        return self._modify(apply)
+
+    def list_categories(self):
+        """Категории (из списка categories и из пресетов) с количеством пресетов"""
+        with self._lock:
+            self._refresh()
+            counts = {category: 0 for category in self._document["categories"]}
+            for preset in self._document["presets"]:
+                category = preset.get("category") or DEFAULT_CATEGORY
+                counts[category] = counts.get(category, 0) + 1
+        return counts
+
+    def add_category(self, name):
+        if not name or not isinstance(name, str):
+            raise ValueError("Category name is required")
+
+        def apply(document):
+            if name not in document["categories"]:
+                document["categories"].append(name)
+
+        self._modify(apply)
+
+    def rename_category(self, name, new_name):
+        """Переименовывает категорию у всех её пресетов (версии пресетов увеличиваются)"""
+        if not new_name or not isinstance(new_name, str):
+            raise ValueError("New category name is required")
+
+        def apply(document):
+            found = name in document["categories"]
+            document["categories"] = [new_name if category == name else category for category in document["categories"]]
+            # После переименования категории могут совпасть — убираем дубликаты
+            document["categories"] = list(dict.fromkeys(document["categories"]))
+            updated = 0
+            for index, preset in enumerate(document["presets"]):
+                if (preset.get("category") or DEFAULT_CATEGORY) == name:
+                    document["presets"][index] = dict(preset, category=new_name, version=preset_version(preset) + 1)
+                    updated += 1
+            if not found and not updated:
+                raise PresetNotFound(name)
+            return updated
+
+        return self._modify(apply)
+
+    def delete_category(self, name, delete_presets=False):
+        """Удаляет категорию; её пресеты удаляются или переносятся в Uncategorized"""
+        def apply(document):
+            found = name in document["categories"]
+            document["categories"] = [category for category in document["categories"] if category != name]
+            affected = 0
+            presets = []
+            for preset in document["presets"]:
+                if (preset.get("category") or DEFAULT_CATEGORY) == name:
+                    affected += 1
+                    if delete_presets:
+                        continue
+                    preset = dict(preset, category=DEFAULT_CATEGORY, version=preset_version(preset) + 1)
+                presets.append(preset)
+            if not found and not affected:
+                raise PresetNotFound(name)
+            document["presets"] = presets
+            return affected
+
+        return self._modify(apply)
+
+
+_preset_store = None
+_preset_store_lock = threading.Lock()
+
+
+def get_preset_store():
+    global _preset_store
+    with _preset_store_lock:
+        if _preset_store is None:
+            _preset_store = PresetStore(os.path.join(os.path.dirname(__file__), "presets.json"))
+        return _preset_store
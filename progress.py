@@ -0,0 +1,87 @@
+import os
+import time
+
+
+class TransferProgress:
+    """
+    Прогресс передачи одного файла/репозитория: байты, скорость, ETA.
+
+    Обновления приходят часто (на каждый чанк), а наружу (on_update) отдаются
+    не чаще, чем раз в interval секунд, чтобы не забивать websocket.
+    """
+
+    def __init__(self, total=None, on_update=None, interval=None, smoothing=0.3):
+        if interval is None:
+            interval = float(os.environ.get("PDM_PROGRESS_INTERVAL", "0.5"))
+        self.total = total or None
+        self.downloaded = 0
+        self.speed = 0.0
+        self.smoothed_speed = 0.0
+        self.on_update = on_update
+        self.interval = max(0.05, interval)
+        self.smoothing = smoothing
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self._sample_time = self.started_at
+        self._sample_bytes = 0
+        self._last_emit = 0.0
+
+    def set_total(self, total):
+        self.total = total or None
+        self._maybe_emit()
+
+    def set_bytes(self, downloaded):
+        """Устанавливает абсолютное количество скачанных байт (например, после повтора или докачки)"""
+        if downloaded < self._sample_bytes:
+            # Счётчик сброшен (новая попытка) — начинаем замер скорости заново
+            self._sample_bytes = downloaded
+            self._sample_time = time.monotonic()
+        self.downloaded = downloaded
+        self._maybe_emit()
+
+    def advance(self, count):
+        self.downloaded += count
+        self._maybe_emit()
+
+    def finish(self):
+        """Принудительно отправляет финальное состояние"""
+        if self.total and self.downloaded < self.total:
+            self.downloaded = self.total
+        self.finished_at = time.monotonic()
+        self._maybe_emit(force=True)
+
+    @property
+    def eta(self):
+        if not self.total or self.smoothed_speed <= 0:
+            return None
+        return max(0.0, (self.total - self.downloaded) / self.smoothed_speed)
+
+    def to_dict(self):
+        return {
+            "downloaded": self.downloaded,
+            "total": self.total,
+            "percent": round(self.downloaded * 100.0 / self.total, 2) if self.total else None,
+            "speed": round(self.speed, 1),
+            "smoothed_speed": round(self.smoothed_speed, 1),
+            "eta": round(self.eta, 1) if self.eta is not None else None,
+            "elapsed": round((self.finished_at or time.monotonic()) - self.started_at, 1),
+        }
+
+    def _maybe_emit(self, force=False):
+        now = time.monotonic()
+        elapsed = now - self._sample_time
+        if elapsed >= self.interval:
+            # Мгновенная скорость за последний интервал и экспоненциально сглаженная скорость
+            self.speed = (self.downloaded - self._sample_bytes) / elapsed
+            if self.smoothed_speed <= 0:
+                self.smoothed_speed = self.speed
+            else:
+                self.smoothed_speed = self.smoothing * self.speed + (1 - self.smoothing) * self.smoothed_speed
+            self._sample_time = now
+            self._sample_bytes = self.downloaded
+
+        if self.on_update is None:
+            return
+        if force or now - self._last_emit >= self.interval:
+            self._last_emit = now
+            self.on_update(self)
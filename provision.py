@@ -0,0 +1,268 @@
+"""
+Загрузка моделей пресетов из командной строки, без запуска ComfyUI и веб-сервера.
+
+Нужна для образов и init-контейнеров: модели скачиваются до того, как нода начнёт принимать задачи.
+Используются те же план (дедупликация, пропуск уже скачанных, проверка места), очередь
+и загрузчик, что и в интерфейсе, а пути сохранения определяются через folder_paths ComfyUI.
+
+    python custom_nodes/ComfyUI-PresetDownloadManager/provision.py --category SDXL --workers 4
+    python custom_nodes/ComfyUI-PresetDownloadManager/provision.py --presets custom-presets.json --name "Flux GGUF"
+
+Итог печатается одним JSON документом (stdout или --output). Код выхода: 0 — все модели на месте,
+1 — часть загрузок не удалась, 2 — ошибка параметров или файла пресетов, 3 — не хватает места на диске.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import contextlib
+import importlib
+
+# Запуск файлом (python .../provision.py): папка расширения подключается как пакет,
+# чтобы работали относительные импорты модулей расширения
+if not __package__:
+    import types
+
+    _package = types.ModuleType("preset_download_manager")
+    _package.__path__ = [os.path.dirname(os.path.abspath(__file__))]
+    sys.modules.setdefault("preset_download_manager", _package)
+    __package__ = "preset_download_manager"
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_NO_SPACE = 3
+
+
+class ProvisionError(Exception):
+    """Ошибка параметров или файла пресетов (код выхода 2)"""
+
+
+def default_presets_path():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "presets.json")
+
+
+def load_presets(path):
+    """Пресеты из файла: документ {"categories": [...], "presets": [...]} или просто список пресетов"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            document = json.load(f)
+    except OSError as e:
+        raise ProvisionError(f"Cannot read presets file {path}: {e}")
+    except ValueError as e:
+        raise ProvisionError(f"Invalid JSON in presets file {path}: {e}")
+    presets = document.get("presets") if isinstance(document, dict) else document
+    if not isinstance(presets, list):
+        raise ProvisionError(f"No presets list in {path}")
+    return [preset for preset in presets if isinstance(preset, dict)]
+
+
+def select_presets(presets, names=(), categories=(), select_all=False):
+    """
+    Пресеты по именам или ID и по категориям (без учёта регистра).
+    Имя, которое не нашлось, — ошибка: опечатка в команде сборки не должна тихо оставлять ноду без модели.
+    """
+    if select_all:
+        return list(presets)
+    wanted_names = {name.strip().lower() for name in names if name.strip()}
+    wanted_categories = {category.strip().lower() for category in categories if category.strip()}
+    if not wanted_names and not wanted_categories:
+        raise ProvisionError("Nothing selected: pass --name, --category or --all")
+
+    selected = []
+    found_names = set()
+    for preset in presets:
+        keys = {str(preset.get("name") or "").lower(), str(preset.get("id") or "").lower()}
+        matched_names = keys & wanted_names
+        found_names |= matched_names
+        category = str(preset.get("category") or "Uncategorized").lower()
+        if matched_names or category in wanted_categories:
+            selected.append(preset)
+
+    missing = sorted(wanted_names - found_names)
+    if missing:
+        raise ProvisionError(f"Presets not found: {', '.join(missing)}")
+    if not selected:
+        raise ProvisionError("No presets in the selected categories")
+    return selected
+
+
+def _log(message, quiet=False):
+    if not quiet:
+        print(f"[PresetDownloadManager] {message}", file=sys.stderr, flush=True)
+
+
+async def provision(presets, workers=2, per_host=None, order="largest", hf_token="", force=False,
+                    dry_run=False, quiet=False):
+    """
+    Скачивает модели пресетов и возвращает итог (словарь для JSON).
+    Загрузки идут через ту же очередь, что и в ComfyUI, не больше workers одновременно
+    (и не больше per_host с одного хоста).
+    """
+    from .http_client import close_sessions
+
+    started = time.monotonic()
+    try:
+        summary, code = await _provision(
+            presets, workers, per_host, order, hf_token, force, dry_run, quiet
+        )
+    finally:
+        await close_sessions()
+    summary["seconds"] = round(time.monotonic() - started, 3)
+    _log(f"Finished in {summary['seconds']} s", quiet)
+    return summary, code
+
+
+async def _provision(presets, workers, per_host, order, hf_token, force, dry_run, quiet):
+    from .download_plan import build_plan, execute_plan, plan_response
+    from .jobs import JOB_COMPLETED, DownloadJobManager
+
+    plan = await build_plan(presets, order, hf_token)
+    public_plan = plan_response(plan)
+    summary = {
+        "ok": plan["ok"],
+        "presets": [preset.get("name") or preset.get("id") for preset in presets],
+        "planned": len(plan["downloads"]),
+        "present": len(plan["present"]),
+        "duplicates": plan["duplicates"],
+        "total_bytes": plan["total_bytes"],
+        "unknown_size": plan["unknown_size"],
+        "filesystems": plan["filesystems"],
+    }
+    _log(
+        f"{len(plan['downloads'])} to download ({plan['total_bytes'] / 1024 ** 3:.2f} GB), "
+        f"{len(plan['present'])} already present",
+        quiet,
+    )
+
+    if not plan["ok"] and not force:
+        summary["error"] = "Not enough disk space"
+        summary["downloads"] = public_plan["downloads"]
+        return summary, EXIT_NO_SPACE
+    if dry_run:
+        summary["downloads"] = public_plan["downloads"]
+        summary["present_models"] = plan["present"]
+        return summary, EXIT_OK
+
+    manager = DownloadJobManager(
+        max_concurrent=workers,
+        max_per_host=per_host or workers,
+        history_limit=len(plan["downloads"]),
+    )
+
+    def _on_event(event, payload):
+        if event.endswith(".job") and payload["status"] != "queued":
+            detail = f": {payload['error']}" if payload.get("error") else ""
+            _log(f"{payload['status']}: {payload['name']}{detail}", quiet)
+
+    manager.add_listener(_on_event)
+    jobs = execute_plan(plan, manager)
+    await asyncio.gather(*[manager.wait(job) for job in jobs])
+
+    downloads = []
+    for item, public_item, job in zip(plan["downloads"], public_plan["downloads"], jobs):
+        result = job.result or {}
+        downloads.append({
+            "name": job.display_name,
+            "target": item["target"],
+            "presets": item["presets"],
+            "status": job.status,
+            "path": result.get("path"),
+            "sha256": result.get("sha256"),
+            "message": result.get("message"),
+            "error": job.error,
+            "bytes": job.progress.downloaded if job.progress else 0,
+            "seconds": round(job.finished_at - job.started_at, 3) if job.started_at else None,
+            "model": public_item["model"],
+        })
+    failed = [download for download in downloads if download["status"] != JOB_COMPLETED]
+    summary.update({
+        "ok": not failed,
+        "completed": len(downloads) - len(failed),
+        "failed": len(failed),
+        "downloaded_bytes": sum(download["bytes"] for download in downloads),
+        "downloads": downloads,
+        "present_models": plan["present"],
+    })
+    return summary, EXIT_OK if not failed else EXIT_FAILED
+
+
+def _setup_comfyui(comfyui_dir):
+    """Делает folder_paths ComfyUI доступным и подгружает extra_model_paths.yaml, как это делает main.py"""
+    comfyui_dir = os.path.abspath(comfyui_dir)
+    if comfyui_dir not in sys.path:
+        sys.path.insert(0, comfyui_dir)
+    try:
+        importlib.import_module("folder_paths")
+    except ImportError as e:
+        raise ProvisionError(f"ComfyUI folder_paths not found in {comfyui_dir} (use --comfyui-dir): {e}")
+    extra_config = os.path.join(comfyui_dir, "extra_model_paths.yaml")
+    if os.path.isfile(extra_config):
+        try:
+            from utils.extra_config import load_extra_path_config
+            load_extra_path_config(extra_config)
+        except Exception as e:
+            print(f"[PresetDownloadManager] ⚠️ Не удалось загрузить {extra_config}: {e}", file=sys.stderr)
+
+
+def build_parser():
+    # По умолчанию расширение лежит в ComfyUI/custom_nodes/<папка>
+    default_comfyui_dir = os.environ.get("COMFYUI_DIR") or os.path.dirname(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    parser = argparse.ArgumentParser(description="Download preset models without starting ComfyUI")
+    parser.add_argument("--presets", default=default_presets_path(), help="presets file (default: presets.json)")
+    parser.add_argument("--name", action="append", default=[], help="preset name or ID (repeatable)")
+    parser.add_argument("--category", action="append", default=[], help="preset category (repeatable)")
+    parser.add_argument("--all", action="store_true", help="all presets in the file")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("PDM_MAX_CONCURRENT_DOWNLOADS", "2")),
+                        help="parallel downloads")
+    parser.add_argument("--per-host", type=int, default=None, help="parallel downloads per host (default: --workers)")
+    parser.add_argument("--order", default="largest", help="largest, smallest or preset")
+    parser.add_argument("--hf-token", default=os.environ.get("HF_TOKEN", ""),
+                        help="HuggingFace token for models without their own (default: $HF_TOKEN)")
+    parser.add_argument("--comfyui-dir", default=default_comfyui_dir, help="ComfyUI root (default: $COMFYUI_DIR)")
+    parser.add_argument("--force", action="store_true", help="download even if the disk space check fails")
+    parser.add_argument("--dry-run", action="store_true", help="only print the plan")
+    parser.add_argument("--output", help="write the JSON summary to this file instead of stdout")
+    parser.add_argument("--quiet", action="store_true", help="no progress lines on stderr")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        presets = select_presets(load_presets(args.presets), args.name, args.category, args.all)
+        if args.workers < 1:
+            raise ProvisionError("--workers must be at least 1")
+        _setup_comfyui(args.comfyui_dir)
+        # Сообщения загрузчика идут в stderr, чтобы в stdout был только итоговый JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            summary, code = asyncio.run(provision(
+                presets,
+                workers=args.workers,
+                per_host=args.per_host,
+                order=args.order,
+                hf_token=args.hf_token,
+                force=args.force,
+                dry_run=args.dry_run,
+                quiet=args.quiet,
+            ))
+    except (ProvisionError, ValueError) as e:
+        summary, code = {"ok": False, "error": str(e)}, EXIT_USAGE
+    except KeyboardInterrupt:
+        return 130
+
+    text = json.dumps(summary, indent=2, ensure_ascii=False, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,399 @@
+import os
+import time
+import errno
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import aiohttp
+
+from .integrity import IntegrityError
+from .metrics import RETRIES, log_event, registry
+
+# Коды ответа, после которых повтор бесполезен: нет доступа, нет файла, неверный запрос
+FATAL_STATUSES = {400, 401, 402, 403, 404, 405, 406, 410, 411, 413, 414, 415, 422, 451}
+# Временные ошибки сервера (5xx и 524 Cloudflare) и перегрузка
+TRANSIENT_STATUSES = {408, 423, 425, 500, 502, 504, 520, 521, 522, 523, 524, 525, 526, 527, 529, 530}
+
+
+# Локальные ошибки, которые повтор не исправит: неверные данные пресета, нет прав на запись, кончилось место
+LOCAL_FATAL_ERRORS = (ValueError, TypeError, KeyError, PermissionError, IsADirectoryError, NotADirectoryError)
+LOCAL_FATAL_ERRNOS = {errno.ENOSPC, errno.EDQUOT, errno.EROFS}
+
+
+class HTTPStatusError(Exception):
+    """Сервер ответил кодом ошибки; retry_after — подсказка сервера (секунды), если была"""
+
+    def __init__(self, message, status, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class SlowSourceError(Exception):
+    """Скорость источника ниже PDM_MIN_SOURCE_SPEED_KB — загрузку стоит продолжить с другого источника"""
+
+
+class CircuitOpenError(Exception):
+    """Хост недоступен: после серии ошибок запросы к нему не отправляются до истечения паузы"""
+
+    def __init__(self, host, retry_in):
+        super().__init__(
+            f"Host {host} is unavailable after repeated failures, not retrying for {retry_in:.0f} s"
+        )
+        self.host = host
+        self.retry_in = retry_in
+
+
+def parse_retry_after(value):
+    """Retry-After в секундах (число или HTTP дата), None — если заголовка нет или он не разобран"""
+    if not value:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def _library_errors():
+    """Классы таймаутов и сетевых ошибок aiohttp и HTTP клиентов huggingface_hub (requests или httpx)"""
+    timeouts = [asyncio.TimeoutError, TimeoutError]
+    connections = [ConnectionError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError]
+    try:
+        import requests
+
+        timeouts.append(requests.exceptions.Timeout)
+        connections += [requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError]
+    except ImportError:
+        pass
+    try:
+        import httpx
+
+        timeouts.append(httpx.TimeoutException)
+        connections += [httpx.NetworkError, httpx.RemoteProtocolError]
+    except ImportError:
+        pass
+    return tuple(timeouts), tuple(connections)
+
+
+_error_classes = None
+
+
+def _status_of(error):
+    status = getattr(error, "status", None)
+    if not isinstance(status, int):
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def _retry_after_of(error):
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        return retry_after
+    headers = getattr(error, "headers", None) or getattr(getattr(error, "response", None), "headers", None)
+    try:
+        return parse_retry_after(headers.get("Retry-After")) if headers else None
+    except AttributeError:
+        return None
+
+
+class Failure:
+    """
+    Классификация ошибки для политики повторов.
+
+    kind: fatal (повтор бесполезен), rate_limited (429), unavailable (503), server, timeout, connection,
+    integrity, slow_source, circuit_open, local (локальная ошибка, повтор бесполезен), other (неизвестная
+    ошибка — повторяется не больше PDM_MAX_UNKNOWN_RETRIES раз). host_failure — ошибка говорит
+    о недоступности хоста (учитывается автоматическим выключателем).
+    """
+
+    __slots__ = ("kind", "status", "retryable", "retry_after", "host_failure", "cause")
+
+    def __init__(self, kind, retryable, status=None, retry_after=None, host_failure=False):
+        self.kind = kind
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+        self.host_failure = host_failure
+        if status == 524:
+            self.cause = "cloudflare_524"
+        elif status is not None:
+            self.cause = f"http_{status}"
+        else:
+            self.cause = kind
+
+
+def _classify_one(error):
+    global _error_classes
+    if isinstance(error, IntegrityError):
+        return Failure("integrity", True)
+    if isinstance(error, SlowSourceError):
+        return Failure("slow_source", True)
+    if isinstance(error, CircuitOpenError):
+        return Failure("circuit_open", False)
+    status = _status_of(error)
+    if status is not None:
+        retry_after = _retry_after_of(error)
+        if status == 429:
+            return Failure("rate_limited", True, status, retry_after)
+        if status == 503:
+            return Failure("unavailable", True, status, retry_after, host_failure=True)
+        if status in FATAL_STATUSES or (400 <= status < 500 and status not in TRANSIENT_STATUSES):
+            return Failure("fatal", False, status)
+        if status in TRANSIENT_STATUSES or status >= 500:
+            return Failure("server", True, status, retry_after, host_failure=True)
+    if _error_classes is None:
+        _error_classes = _library_errors()
+    timeouts, connections = _error_classes
+    if isinstance(error, timeouts):
+        return Failure("timeout", True, host_failure=True)
+    if isinstance(error, connections):
+        return Failure("connection", True, host_failure=True)
+    return None
+
+
+def _is_local_fatal(error):
+    if isinstance(error, LOCAL_FATAL_ERRORS):
+        return True
+    return isinstance(error, OSError) and error.errno in LOCAL_FATAL_ERRNOS
+
+
+def classify(error):
+    """
+    Классифицирует ошибку по типу исключения и коду ответа (не по тексту сообщения).
+    Обёртки (например, ошибки huggingface_hub поверх сетевых) разбираются по цепочке причин.
+    Если в цепочке нет ни кода ответа, ни сетевой ошибки, локальные ошибки (LOCAL_FATAL_ERRORS, нет места)
+    не повторяются, а остальные неизвестные ошибки повторяются с ограниченным числом попыток.
+    """
+    chain = []
+    current = error
+    while current is not None and all(current is not item for item in chain):
+        chain.append(current)
+        failure = _classify_one(current)
+        if failure is not None:
+            return failure
+        current = current.__cause__ or current.__context__
+    if any(_is_local_fatal(item) for item in chain):
+        return Failure("local", False)
+    return Failure("other", True)
+
+
+def retry_cause(error):
+    """Причина повтора для метрик и логов: integrity, timeout, cloudflare_524, http_<код>, connection, ..."""
+    return classify(error).cause
+
+
+def record_retry(path, error, attempt, url=None, delay=None):
+    cause = retry_cause(error)
+    RETRIES.inc(path=path, cause=cause)
+    # Параметры запроса в ссылке могут содержать токены — в лог их не пишем
+    log_event("retry", path=path, cause=cause, attempt=attempt + 1, url=url.split("?")[0] if url else None,
+              delay=round(delay, 3) if delay is not None else None, error=str(error)[:300])
+
+
+class RetryPolicy:
+    """
+    Общая политика повторов: число попыток и паузы с decorrelated jitter
+    (следующая пауза — случайная между base_delay и утроенной предыдущей, не больше max_delay).
+    Если сервер прислал Retry-After, ждём столько, сколько он просит; если дольше max_retry_after — не повторяем.
+    Неизвестные ошибки (kind "other") повторяются не больше max_unknown_retries раз.
+    """
+
+    def __init__(self, max_attempts=None, base_delay=None, max_delay=None, max_retry_after=None,
+                 max_unknown_retries=None):
+        self.max_attempts = max(1, int(max_attempts or os.environ.get("PDM_MAX_RETRIES", "5")))
+        # До общей политики по умолчанию было 10 с (каждая следующая пауза ×1.5); см. README
+        self.base_delay = float(base_delay if base_delay is not None else os.environ.get("PDM_RETRY_DELAY", "2"))
+        self.max_delay = max(self.base_delay, float(
+            max_delay if max_delay is not None else os.environ.get("PDM_MAX_RETRY_DELAY", "60")
+        ))
+        self.max_retry_after = float(
+            max_retry_after if max_retry_after is not None else os.environ.get("PDM_MAX_RETRY_AFTER", "300")
+        )
+        self.max_unknown_retries = max(0, int(
+            max_unknown_retries if max_unknown_retries is not None else os.environ.get("PDM_MAX_UNKNOWN_RETRIES", "2")
+        ))
+
+    def allows(self, failure):
+        """Стоит ли вообще повторять после такой ошибки"""
+        if not failure.retryable:
+            return False
+        return failure.retry_after is None or failure.retry_after <= self.max_retry_after
+
+    def should_retry(self, failure, attempt):
+        """attempt — номер неудавшейся попытки (с нуля)"""
+        if failure.kind == "other" and attempt >= self.max_unknown_retries:
+            return False
+        return attempt < self.max_attempts - 1 and self.allows(failure)
+
+    def next_delay(self, previous, failure):
+        """Пауза перед следующей попыткой; previous — предыдущая пауза (или base_delay)"""
+        if failure.kind == "integrity":
+            # Повреждённый файл уже удалён — качаем заново сразу
+            return 0.0
+        if failure.retry_after is not None:
+            return failure.retry_after
+        return min(self.max_delay, random.uniform(self.base_delay, max(self.base_delay, previous * 3)))
+
+
+def host_key(value):
+    """
+    Ключ хоста для выключателей: имя хоста в нижнем регистре и порт, если он не стандартный.
+    value — ссылка или host[:port], поэтому вызовы с URL и с get_download_host() попадают в один счётчик.
+    """
+    if not value:
+        return ""
+    parsed = urlparse(value if "//" in value else f"//{value}")
+    host = parsed.hostname or ""
+    try:
+        port = parsed.port
+    except ValueError:
+        port = None
+    return f"{host}:{port}" if host and port and port not in (80, 443) else host
+
+
+class CircuitBreakers:
+    """
+    Автоматические выключатели по хостам. После threshold ошибок подряд (таймауты, обрывы, 5xx)
+    хост считается недоступным на reset_timeout секунд: задачи к нему сразу завершаются ошибкой,
+    а не ждут в паузах между повторами. После паузы пропускается один пробный запрос (остальные
+    по-прежнему завершаются сразу): его ошибка снова выключает хост, ответ возвращает хост в работу.
+    Если проба не вернула результат за reset_timeout (например, задачу отменили), пропускается следующая.
+
+    Хосты можно передавать ссылкой или host[:port] — ключ нормализуется host_key().
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def check(self, host):
+        """Выбрасывает CircuitOpenError, если хост выключен или его пробный запрос ещё не завершён"""
+        host = host_key(host)
+        if not host or not self.threshold:
+            return
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None or state["opened_at"] is None:
+                return
+            now = time.monotonic()
+            if state["half_open"]:
+                retry_in = state["probe_at"] + self.reset_timeout - now
+            else:
+                retry_in = state["opened_at"] + self.reset_timeout - now
+            if retry_in <= 0:
+                # Этот запрос — проба; остальные ждут её результата
+                state.update(half_open=True, probe_at=now)
+                return
+        raise CircuitOpenError(host, retry_in)
+
+    def record_success(self, host):
+        host = host_key(host)
+        if not host:
+            return
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is not None:
+                if state["opened_at"] is not None:
+                    log_event("circuit_closed", host=host)
+                state.update(failures=0, opened_at=None, half_open=False, probe_at=None)
+
+    def record_failure(self, host, failure):
+        host = host_key(host)
+        if not host or not self.threshold or failure.kind == "circuit_open":
+            return
+        if not failure.host_failure:
+            if failure.status is not None:
+                # Хост ответил (например, 404 или 429) — он доступен
+                self.record_success(host)
+            return
+        with self._lock:
+            state = self._hosts.setdefault(host, {
+                "failures": 0, "opened_at": None, "half_open": False, "probe_at": None, "trips": 0, "last_error": None
+            })
+            state["failures"] += 1
+            state["last_error"] = failure.cause
+            if state["half_open"] or (state["opened_at"] is None and state["failures"] >= self.threshold):
+                state.update(opened_at=time.monotonic(), half_open=False)
+                state["trips"] += 1
+                opened = True
+            else:
+                opened = False
+        if opened:
+            print(f"[PresetDownloadManager] ⚠️ Хост {host} недоступен ({failure.cause}), "
+                  f"загрузки с него приостановлены на {self.reset_timeout:.0f} с")
+            log_event("circuit_open", host=host, cause=failure.cause)
+
+    def reset(self):
+        with self._lock:
+            self._hosts.clear()
+
+    def to_dict(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                host: {
+                    "state": "closed" if state["opened_at"] is None
+                    else "half_open" if state["half_open"] or now - state["opened_at"] >= self.reset_timeout
+                    else "open",
+                    "failures": state["failures"],
+                    "trips": state["trips"],
+                    "last_error": state["last_error"],
+                }
+                for host, state in self._hosts.items()
+            }
+
+
+_circuit_breakers = None
+
+
+def get_circuit_breakers():
+    """Общие выключатели: PDM_CIRCUIT_THRESHOLD ошибок подряд (0 — выключены), пауза PDM_CIRCUIT_RESET секунд"""
+    global _circuit_breakers
+    if _circuit_breakers is None:
+        _circuit_breakers = CircuitBreakers(
+            threshold=int(os.environ.get("PDM_CIRCUIT_THRESHOLD", "5")),
+            reset_timeout=float(os.environ.get("PDM_CIRCUIT_RESET", "30")),
+        )
+        registry.callback(
+            "pdm_circuit_open", "Hosts whose circuit breaker is open (1) or closed (0)",
+            lambda: {
+                host: int(state["state"] == "open") for host, state in _circuit_breakers.to_dict().items()
+            },
+            labels=("host",)
+        )
+    return _circuit_breakers
+
+
+async def retry_async(func, host=None, path="other", url=None, policy=None):
+    """
+    Выполняет func() (корутину) по общей политике повторов: временные ошибки повторяются с паузами,
+    постоянные (401/403/404, ошибки в данных) выбрасываются сразу, ошибки хоста учитываются выключателем.
+    """
+    policy = policy or RetryPolicy()
+    breakers = get_circuit_breakers()
+    delay = policy.base_delay
+    for attempt in range(policy.max_attempts):
+        breakers.check(host)
+        try:
+            result = await func()
+        except Exception as e:
+            failure = classify(e)
+            breakers.record_failure(host, failure)
+            if not policy.should_retry(failure, attempt):
+                raise
+            delay = policy.next_delay(delay, failure)
+            record_retry(path, e, attempt, url, delay)
+            await asyncio.sleep(delay)
+            continue
+        breakers.record_success(host)
+        return result
@@ -0,0 +1,80 @@
+"""
+Общие фикстуры тестов. ComfyUI не нужен: модули пакета загружаются из папки репозитория
+без __init__.py (он регистрирует routes), folder_paths подменяется временной папкой моделей.
+"""
+import os
+import sys
+import types
+import importlib
+
+import pytest
+from aiohttp import web
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = "preset_download_manager"
+
+
+@pytest.fixture
+def models_dir(tmp_path):
+    path = tmp_path / "models"
+    (path / "checkpoints").mkdir(parents=True)
+    return path
+
+
+@pytest.fixture
+def pdm(tmp_path, models_dir, monkeypatch):
+    """
+    Функция, загружающая модуль пакета: pdm("retry") — модуль preset_download_manager.retry.
+    Каждый тест получает свежие модули (общие объекты вроде get_circuit_breakers() не переходят между тестами).
+    """
+    for key, value in {
+        "HF_HOME": str(tmp_path / "hf_home"),
+        "HF_HUB_DISABLE_TELEMETRY": "1",
+        "PDM_METADATA_CACHE_PERSIST": "0",
+        "PDM_VERIFY_DB": str(tmp_path / "verified.json"),
+        "PDM_BLOB_STORE": "0",
+        "PDM_JSON_LOG": "0",
+    }.items():
+        monkeypatch.setenv(key, value)
+    for key in ("PDM_SEGMENTS", "PDM_PEERS", "PDM_PEER_TOKEN", "PDM_BANDWIDTH_LIMIT_MB"):
+        monkeypatch.delenv(key, raising=False)
+
+    folder_paths = types.ModuleType("folder_paths")
+    folder_paths.models_dir = str(models_dir)
+    folder_paths.folder_names_and_paths = {}
+    folder_paths.get_folder_paths = lambda folder_name: [str(models_dir / folder_name)]
+    package = types.ModuleType(PACKAGE)
+    package.__path__ = [REPO_ROOT]
+    monkeypatch.setitem(sys.modules, "folder_paths", folder_paths)
+    monkeypatch.setitem(sys.modules, PACKAGE, package)
+    for name in [name for name in sys.modules if name.startswith(f"{PACKAGE}.")]:
+        monkeypatch.delitem(sys.modules, name)
+
+    return lambda name: importlib.import_module(f"{PACKAGE}.{name}")
+
+
+class PromptServer:
+    """Заглушка server.PromptServer ComfyUI: routes, в которые nodes регистрирует API"""
+    instance = None
+
+    def __init__(self):
+        self.app = web.Application()
+        self.routes = web.RouteTableDef()
+
+    def send_sync(self, event, payload):
+        pass
+
+
+@pytest.fixture
+def routes(pdm, tmp_path, monkeypatch):
+    """Routes API пакета (nodes.setup_routes) с пресетами во временном presets.json"""
+    server = types.ModuleType("server")
+    server.PromptServer = PromptServer
+    PromptServer.instance = PromptServer()
+    monkeypatch.setitem(sys.modules, "server", server)
+
+    # Импорт nodes регистрирует routes в PromptServer.instance.routes
+    pdm("nodes")
+    preset_store = pdm("preset_store")
+    preset_store._preset_store = preset_store.PresetStore(str(tmp_path / "presets.json"))
+    return PromptServer.instance.routes
@@ -0,0 +1,116 @@
+"""Ограничение скорости (token bucket) и соединений с хостом (bandwidth.py)"""
+import asyncio
+
+import pytest
+
+MB = 1024 * 1024
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def bandwidth(pdm):
+    return pdm("bandwidth")
+
+
+@pytest.fixture
+def clock(bandwidth, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(bandwidth, "time", clock)
+    return clock
+
+
+def test_unlimited_bucket_never_waits(bandwidth, clock):
+    bucket = bandwidth.TokenBucket()
+    assert bucket.reserve(100 * MB) == 0
+
+
+def test_rate_and_debt(bandwidth, clock):
+    bucket = bandwidth.TokenBucket(MB)
+    assert bucket.burst == MB
+    # Запас в начале пуст: первый чанк ждёт своё время
+    assert bucket.reserve(MB // 2) == pytest.approx(0.5)
+    # Большой чанк уходит в долг целиком, и ждать приходится, пока он не погасится
+    assert bucket.reserve(2 * MB) == pytest.approx(2.5)
+    clock.now += 1
+    assert bucket.reserve(0) == pytest.approx(1.5)
+    clock.now += 1.5
+    assert bucket.reserve(0) == 0
+
+
+def test_refill_is_capped_by_burst(bandwidth, clock):
+    bucket = bandwidth.TokenBucket(MB)
+    clock.now += 60
+    assert bucket.reserve(MB) == 0
+    assert bucket.reserve(MB // 2) == pytest.approx(0.5)
+    # Для малых скоростей запас не меньше 64 КБ
+    assert bandwidth.TokenBucket(1024).burst == 64 * 1024
+
+
+def test_set_rate_keeps_debt(bandwidth, clock):
+    bucket = bandwidth.TokenBucket(MB)
+    bucket.reserve(2 * MB)
+    bucket.set_rate(2 * MB)
+    assert bucket.reserve(0) == pytest.approx(1.0)
+    bucket.set_rate(0)
+    assert bucket.reserve(10 * MB) == 0
+    # После снятия лимита долг забыт: остаётся минимальный запас в 64 КБ
+    bucket.set_rate(MB)
+    assert bucket.reserve(MB) == pytest.approx((MB - 64 * 1024) / MB)
+
+
+def test_host_limits_match_subdomains(bandwidth, clock, monkeypatch):
+    limiter = bandwidth.BandwidthLimiter(rate=4 * MB, host_rates={"HuggingFace.co": MB})
+    assert limiter.is_limited("example.com")
+    assert limiter._match(limiter.host_rates, "cdn-lfs.huggingface.co:443") == ("huggingface.co", MB)
+    assert limiter._match(limiter.host_rates, "nothuggingface.co") == (None, None)
+
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(bandwidth.asyncio, "sleep", sleep)
+    asyncio.run(limiter.throttle("cdn-lfs.huggingface.co", 2 * MB))
+    asyncio.run(limiter.throttle("example.com", 2 * MB))
+    # Хост ограничен сильнее общего лимита: ждём по его ведру (с начальным запасом 64 КБ);
+    # общий долг растёт от обоих хостов
+    assert delays == [pytest.approx((2 * MB - 64 * 1024) / MB), pytest.approx(1.0)]
+
+    limiter.set_limits(rate=0, host_rates={"huggingface.co": 0})
+    assert not limiter.is_limited("huggingface.co")
+
+
+def test_connection_limit_waits_for_slot(bandwidth):
+    limiter = bandwidth.BandwidthLimiter(max_connections=2, host_connections={"slow.example.com": 1})
+
+    async def scenario():
+        order = []
+        release = asyncio.Event()
+
+        async def connect(host, name):
+            async with limiter.connection(host):
+                order.append(name)
+                await release.wait()
+
+        tasks = [asyncio.ensure_future(connect("example.com", index)) for index in range(3)]
+        tasks.append(asyncio.ensure_future(connect("a.slow.example.com", "slow")))
+        await asyncio.sleep(0.01)
+        assert order == [0, 1, "slow"]
+        assert limiter.to_dict()["active_connections"] == {"example.com": 2, "slow.example.com": 1}
+
+        # Увеличение лимита сразу пропускает ожидающего
+        limiter.set_limits(max_connections=3)
+        await asyncio.sleep(0.01)
+        assert order == [0, 1, "slow", 2]
+        release.set()
+        await asyncio.gather(*tasks)
+        assert limiter.to_dict()["active_connections"] == {}
+
+    asyncio.run(scenario())
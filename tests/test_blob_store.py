@@ -0,0 +1,176 @@
+"""Хранилище файлов по SHA-256: размещение ссылками, учёт использования и сборка мусора (blob_store.py)"""
+import os
+import shutil
+import hashlib
+
+import pytest
+
+
+@pytest.fixture
+def blob_store(pdm):
+    return pdm("blob_store")
+
+
+@pytest.fixture
+def store(blob_store, tmp_path):
+    return blob_store.BlobStore(str(tmp_path / "store"))
+
+
+def write_model(path, data=b"weights" * 1000):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return hashlib.sha256(data).hexdigest()
+
+
+@pytest.fixture
+def no_hardlinks(blob_store, monkeypatch):
+    """Файловая система без жёстких ссылок, но с reflink (как Btrfs/XFS между подтомами): у копии свой inode"""
+    def refuse(src, dst):
+        raise OSError("hardlinks are not supported")
+
+    monkeypatch.setattr(blob_store.os, "link", refuse)
+    monkeypatch.setattr(blob_store, "_reflink", shutil.copyfile)
+
+
+def test_place_file_hardlink_replaces_target(blob_store, tmp_path):
+    src = tmp_path / "src.bin"
+    dst = tmp_path / "dst.bin"
+    src.write_bytes(b"new")
+    dst.write_bytes(b"old")
+    assert blob_store.place_file(str(src), str(dst)) == "hardlink"
+    assert dst.read_bytes() == b"new"
+    assert os.stat(src).st_ino == os.stat(dst).st_ino
+    assert not list(tmp_path.glob("*.link"))
+
+
+def test_place_file_fallbacks(blob_store, tmp_path, monkeypatch):
+    src = tmp_path / "src.bin"
+    src.write_bytes(b"data")
+
+    def refuse(*args):
+        raise OSError("not supported")
+
+    monkeypatch.setattr(blob_store.os, "link", refuse)
+    monkeypatch.setattr(blob_store, "_reflink", refuse)
+    assert blob_store.place_file(str(src), str(tmp_path / "none.bin"), allow_copy=False) is None
+    assert not (tmp_path / "none.bin").exists()
+    assert blob_store.place_file(str(src), str(tmp_path / "copy.bin")) == "copy"
+    assert (tmp_path / "copy.bin").read_bytes() == b"data"
+    assert not list(tmp_path.glob("*.link"))
+
+
+def test_add_resolve_materialize(store, models_dir):
+    model = str(models_dir / "checkpoints" / "model.safetensors")
+    sha256 = write_model(model)
+    assert store.add(model, sha256, "url:https://example.com/model.safetensors")
+    assert os.stat(model).st_ino == os.stat(store.blob_path(sha256)).st_ino
+
+    assert store.resolve(sha256) == sha256
+    assert store.resolve(source="url:https://example.com/model.safetensors") == sha256
+    assert store.resolve(source="url:https://example.com/other") is None
+
+    other = str(models_dir / "clip" / "model.safetensors")
+    assert store.materialize(sha256, other) == "hardlink"
+    usage = store.usage()
+    assert (usage["blobs"], usage["files"][0]["links"], usage["unreferenced_bytes"]) == (1, 2, 0)
+
+
+def test_add_links_to_existing_blob(store, models_dir):
+    first = str(models_dir / "checkpoints" / "a.safetensors")
+    second = str(models_dir / "loras" / "a.safetensors")
+    sha256 = write_model(first)
+    write_model(second)
+    store.add(first, sha256)
+    assert store.add(second, sha256)
+    assert os.stat(second).st_ino == os.stat(store.blob_path(sha256)).st_ino
+    assert store.usage()["files"][0]["links"] == 2
+
+
+def test_gc_removes_only_unused_blobs(store, models_dir):
+    kept = str(models_dir / "checkpoints" / "kept.safetensors")
+    dropped = str(models_dir / "checkpoints" / "dropped.safetensors")
+    kept_sha = write_model(kept, b"kept")
+    dropped_sha = write_model(dropped, b"dropped")
+    store.add(kept, kept_sha)
+    store.add(dropped, dropped_sha)
+
+    os.remove(dropped)
+    result = store.gc()
+    assert result["removed"] == [dropped_sha]
+    assert result["freed_bytes"] == len(b"dropped")
+    assert not os.path.exists(store.blob_path(dropped_sha))
+    assert store.resolve(kept_sha) == kept_sha
+
+
+def test_reflinked_blob_survives_add(store, models_dir, no_hardlinks):
+    """У reflink-копии st_nlink == 1 — использование видно только по ссылкам в индексе"""
+    model = str(models_dir / "checkpoints" / "model.safetensors")
+    sha256 = write_model(model)
+    assert store.add(model, sha256, "url:https://example.com/model.safetensors")
+    assert os.stat(store.blob_path(sha256)).st_nlink == 1
+    assert store.resolve(sha256) == sha256
+    assert store.gc()["removed"] == []
+
+    os.remove(model)
+    assert store.gc()["removed"] == [sha256]
+    assert store.resolve(sha256) is None
+
+
+def test_replaced_hardlink_is_not_a_reference(store, models_dir):
+    model = str(models_dir / "checkpoints" / "model.safetensors")
+    sha256 = write_model(model)
+    store.add(model, sha256)
+    # Модель заменили другим файлом с тем же именем — хранилище она больше не использует
+    os.remove(model)
+    write_model(model, b"another model")
+    assert store.gc()["removed"] == [sha256]
+
+
+def test_gc_with_limit_is_lru(store, models_dir):
+    # С ограничением размера неиспользуемые файлы остаются кэшем
+    store.max_bytes = 10 ** 6
+    shas = []
+    for index in range(3):
+        path = str(models_dir / "checkpoints" / f"{index}.bin")
+        shas.append(write_model(path, bytes([index]) * 100))
+        store.add(path, shas[-1])
+        os.remove(path)
+    store.resolve(shas[0])
+    store.materialize(shas[0], str(models_dir / "checkpoints" / "again.bin"))
+    os.remove(models_dir / "checkpoints" / "again.bin")
+    # shas[1] использовался раньше всех
+    assert store.gc(max_bytes=200)["removed"] == [shas[1]]
+    assert store.gc(max_bytes=100)["removed"] == [shas[2]]
+
+
+def test_gc_skips_kept_blob(store, models_dir):
+    model = str(models_dir / "checkpoints" / "model.safetensors")
+    sha256 = write_model(model)
+    store.add(model, sha256)
+    os.remove(model)
+    assert store.gc(keep=(sha256,))["removed"] == []
+    assert store.gc()["removed"] == [sha256]
+
+
+def test_edited_blob_is_not_linked(store, models_dir):
+    model = str(models_dir / "checkpoints" / "model.safetensors")
+    sha256 = write_model(model)
+    store.add(model, sha256)
+    # Модель изменили на месте через жёсткую ссылку
+    with open(model, "ab") as f:
+        f.write(b"edit")
+    assert store.resolve(sha256) is None
+    assert not os.path.exists(store.blob_path(sha256))
+
+
+def test_verify_detects_same_size_edit(store, models_dir):
+    model = str(models_dir / "checkpoints" / "model.safetensors")
+    sha256 = write_model(model, b"a" * 100)
+    store.add(model, sha256)
+    stat = os.stat(model)
+    with open(model, "r+b") as f:
+        f.write(b"b")
+    os.utime(model, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert store.resolve(sha256) == sha256
+    assert store.resolve(sha256, verify=True) is None
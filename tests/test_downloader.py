@@ -0,0 +1,480 @@
+"""Загрузка файлов: докачка, сегменты, хеш во время загрузки, staging huggingface_hub (downloader.py)"""
+import os
+import json
+import random
+import asyncio
+import hashlib
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+DATA = random.Random(0).randbytes(5 * 1024 * 1024 + 123)
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+@pytest.fixture
+def downloader(pdm, monkeypatch):
+    monkeypatch.setenv("PDM_RETRY_DELAY", "0")
+    downloader = pdm("downloader")
+
+    async def no_repo_info(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(downloader, "get_repo_info", no_repo_info)
+    return downloader
+
+
+class FileServer:
+    """
+    Файл по HTTP с поддержкой Range/If-Range; requests — заголовки всех запросов,
+    errors — код ответа на следующий запрос диапазона с этого начала.
+    """
+
+    def __init__(self, body=DATA, etag='"v1"', last_modified=None, ranges=True, shift=0):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.ranges = ranges
+        self.shift = shift
+        self.requests = []
+        self.errors = {}
+
+    async def handle(self, request):
+        self.requests.append(request.headers)
+        headers = {key: value for key, value in (("ETag", self.etag), ("Last-Modified", self.last_modified)) if value}
+        value = request.headers.get("Range")
+        if_range = request.headers.get("If-Range")
+        if value and self.ranges and if_range in (None, self.etag, self.last_modified):
+            start, end = value.split("=")[1].split("-")
+            start = int(start) + self.shift
+            if start in self.errors:
+                return web.Response(status=self.errors.pop(start))
+            end = min(int(end) if end else len(self.body) - 1, len(self.body) - 1)
+            if start >= len(self.body):
+                return web.Response(status=416, headers={"Content-Range": f"bytes */{len(self.body)}"})
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(self.body)}"
+            return web.Response(body=self.body[start:end + 1], status=206, headers=headers,
+                                content_type="application/octet-stream")
+        return web.Response(body=self.body, headers=headers, content_type="application/octet-stream")
+
+    def serve(self, pdm, scenario):
+        """Запускает сервер и выполняет scenario(url файла)"""
+        http_client = pdm("http_client")
+
+        async def run():
+            app = web.Application()
+            app.router.add_get("/model.bin", self.handle)
+            async with TestServer(app) as server:
+                try:
+                    return await scenario(str(server.make_url("/model.bin")))
+                finally:
+                    await http_client.close_sessions()
+
+        return asyncio.run(run())
+
+
+def fetch_part(pdm, server, part, offset=None, **state):
+    """_fetch_to_part с недокачанным файлом из offset первых байт DATA и его состоянием state"""
+    downloader = pdm("downloader")
+    progress = pdm("progress").TransferProgress()
+
+    async def scenario(url):
+        if offset is not None:
+            part.write_bytes(DATA[:offset])
+            with open(f"{part}.json", "w") as f:
+                json.dump(dict(state, url=url), f)
+        return await downloader._fetch_to_part(url, str(part), f"{part}.json", "", progress)
+
+    return server.serve(pdm, scenario)
+
+
+def test_fetch_resumes_with_range_and_if_range(pdm, tmp_path):
+    server = FileServer()
+    part = tmp_path / "model.bin.part"
+    assert fetch_part(pdm, server, part, 1000, etag='"v1"', total=len(DATA)) == SHA256
+    assert part.read_bytes() == DATA
+    assert [(headers["Range"], headers["If-Range"]) for headers in server.requests] == [("bytes=1000-", '"v1"')]
+
+
+def test_fetch_weak_etag_uses_last_modified(pdm, tmp_path):
+    modified = "Wed, 21 Oct 2026 07:28:00 GMT"
+    server = FileServer(etag='W/"v1"', last_modified=modified)
+    part = tmp_path / "model.bin.part"
+    assert fetch_part(pdm, server, part, 1000, etag='W/"v1"', last_modified=modified) == SHA256
+    assert server.requests[0]["If-Range"] == modified
+
+
+def test_fetch_restarts_when_file_changed(pdm, tmp_path):
+    """If-Range не совпал — сервер отдаёт новый файл целиком (200), старая часть отбрасывается"""
+    server = FileServer(etag='"v2"')
+    part = tmp_path / "model.bin.part"
+    part_state = tmp_path / "model.bin.part.json"
+    assert fetch_part(pdm, server, part, 1000, etag='"v1"', total=len(DATA)) == SHA256
+    assert part.read_bytes() == DATA
+    assert len(server.requests) == 1
+    assert json.loads(part_state.read_text())["etag"] == '"v2"'
+
+
+def test_fetch_without_range_support(pdm, tmp_path):
+    server = FileServer(ranges=False)
+    part = tmp_path / "model.bin.part"
+    assert fetch_part(pdm, server, part, 1000, etag='"v1"') == SHA256
+    assert part.read_bytes() == DATA
+
+
+def test_fetch_416_for_complete_file(pdm, tmp_path):
+    server = FileServer()
+    part = tmp_path / "model.bin.part"
+    assert fetch_part(pdm, server, part, len(DATA), etag='"v1"', total=len(DATA)) is None
+    assert part.read_bytes() == DATA
+    assert len(server.requests) == 1
+
+
+def test_fetch_416_for_changed_file(pdm, tmp_path):
+    """Файл на сервере стал короче уже скачанной части — загрузка начинается заново"""
+    server = FileServer(body=DATA[:500])
+    part = tmp_path / "model.bin.part"
+    assert fetch_part(pdm, server, part, 1000, etag='"v1"', total=len(DATA)) == hashlib.sha256(DATA[:500]).hexdigest()
+    assert part.read_bytes() == DATA[:500]
+    assert [headers.get("Range") for headers in server.requests] == ["bytes=1000-", None]
+
+
+def test_fetch_unexpected_content_range(pdm, tmp_path):
+    server = FileServer(shift=10)
+    part = tmp_path / "model.bin.part"
+    assert fetch_part(pdm, server, part, 1000, etag='"v1"') == SHA256
+    assert part.read_bytes() == DATA
+    assert [headers.get("Range") for headers in server.requests] == ["bytes=1000-", None]
+
+
+def test_fetch_part_without_state_starts_over(pdm, tmp_path):
+    server = FileServer()
+    part = tmp_path / "model.bin.part"
+    part.write_bytes(b"stale")
+    assert fetch_part(pdm, server, part) == SHA256
+    assert part.read_bytes() == DATA
+    assert "Range" not in server.requests[0]
+
+
+def test_segmented_download_hashes_while_writing(pdm, tmp_path, monkeypatch):
+    monkeypatch.setenv("PDM_SEGMENTS", "3")
+    monkeypatch.setenv("PDM_MIN_SEGMENT_SIZE_MB", "1")
+    downloader = pdm("downloader")
+    integrity = pdm("integrity")
+    hashers = []
+
+    class RecordingHasher(integrity.SequentialHasher):
+        def __init__(self):
+            super().__init__()
+            hashers.append(self)
+
+    def no_second_pass(*args, **kwargs):
+        raise AssertionError("the downloaded file was hashed again")
+
+    monkeypatch.setattr(downloader, "SequentialHasher", RecordingHasher)
+    monkeypatch.setattr(integrity, "sha256_file", no_second_pass)
+    server = FileServer()
+    target = tmp_path / "model.bin"
+    progress = pdm("progress").TransferProgress()
+    assert server.serve(pdm, lambda url: downloader._download_direct(
+        url, str(target), "", progress, expected_sha256=SHA256, expected_size=len(DATA)
+    )) == (str(target), SHA256)
+    assert target.read_bytes() == DATA
+    # Проба Range и по запросу на каждый мегабайт
+    assert len(server.requests) == 1 + 6
+    assert [hasher.read_bytes for hasher in hashers] == [0]
+
+
+@pytest.fixture
+def segments(monkeypatch):
+    monkeypatch.setenv("PDM_SEGMENTS", "3")
+    monkeypatch.setenv("PDM_MIN_SEGMENT_SIZE_MB", "1")
+    monkeypatch.setenv("PDM_RETRY_DELAY", "0")
+
+
+def fetch_segmented(pdm, server, part, between=None):
+    """
+    _fetch_segmented; с between — две попытки подряд с одного адреса (состояние .part.json привязано к нему),
+    между ними вызывается between(). Возвращает результат последней попытки или исключение первой.
+    """
+    downloader = pdm("downloader")
+    progress = pdm("progress").TransferProgress()
+
+    async def scenario(url):
+        def fetch():
+            return downloader._fetch_segmented(url, str(part), f"{part}.json", "", progress)
+
+        if between is None:
+            return await fetch()
+        try:
+            await fetch()
+        except Exception as e:
+            between(e)
+        else:
+            between(None)
+        return await fetch()
+
+    return server.serve(pdm, scenario)
+
+
+def test_segments_cover_file(pdm, tmp_path, segments):
+    server = FileServer()
+    part = tmp_path / "model.bin.part"
+    assert fetch_segmented(pdm, server, part) == SHA256
+    assert part.read_bytes() == DATA
+    state = json.loads((tmp_path / "model.bin.part.json").read_text())
+    mb = 1024 * 1024
+    assert [segment[:2] for segment in state["segments"]] == [
+        [start, min(start + mb, len(DATA)) - 1] for start in range(0, len(DATA), mb)
+    ]
+    assert all(segment[2] == segment[1] - segment[0] + 1 for segment in state["segments"])
+    # Проба Range и по запросу на сегмент
+    assert sorted(int(headers["Range"].split("=")[1].split("-")[0]) for headers in server.requests[1:]) == list(
+        range(0, len(DATA), mb)
+    )
+
+
+def test_segmented_resume_after_failed_segment(pdm, tmp_path, segments):
+    server = FileServer()
+    mb = 1024 * 1024
+    server.errors[3 * mb] = 404
+    part = tmp_path / "model.bin.part"
+    done = set()
+
+    def after_failure(error):
+        assert "404" in str(error)
+        state = json.loads((tmp_path / "model.bin.part.json").read_text())
+        assert state["segments"][3][2] == 0
+        done.update(segment[0] for segment in state["segments"] if segment[0] + segment[2] > segment[1])
+        assert 0 in done
+        server.requests.clear()
+
+    assert fetch_segmented(pdm, server, part, after_failure) == SHA256
+    assert part.read_bytes() == DATA
+    # Вторая попытка запрашивает только недокачанные сегменты, без повторной пробы Range
+    requested = {int(headers["Range"].split("=")[1].split("-")[0]) for headers in server.requests}
+    assert not requested & done
+    assert 3 * mb in requested
+
+
+def test_segmented_falls_back_to_single_stream(pdm, tmp_path, segments):
+    part = tmp_path / "model.bin.part"
+    assert fetch_segmented(pdm, FileServer(ranges=False), part) is None
+    assert not part.exists()
+    # Меньше двух сегментов — одного соединения достаточно
+    assert fetch_segmented(pdm, FileServer(body=DATA[:1024 * 1024]), part) is None
+    assert not part.exists()
+
+
+def test_segmented_keeps_single_stream_part(pdm, tmp_path, segments):
+    part = tmp_path / "model.bin.part"
+    part.write_bytes(DATA[:1000])
+    server = FileServer()
+    assert fetch_segmented(pdm, server, part) is None
+    assert part.read_bytes() == DATA[:1000]
+    assert server.requests == []
+
+
+def test_segmented_file_changed_on_server(pdm, tmp_path, segments):
+    """Сегмент получил 200 вместо 206 (If-Range не совпал) — сегменты не согласованы, файл удаляется"""
+    server = FileServer()
+    part = tmp_path / "model.bin.part"
+    state_path = tmp_path / "model.bin.part.json"
+
+    def change_file(error):
+        state = json.loads(state_path.read_text())
+        state["segments"][-1][2] = 0
+        state_path.write_text(json.dumps(state))
+        server.etag = '"v2"'
+
+    assert fetch_segmented(pdm, server, part, change_file) is None
+    assert not part.exists() and not state_path.exists()
+
+
+def test_hub_retry_resumes_in_same_staging_dir(downloader, models_dir, monkeypatch):
+    import huggingface_hub
+
+    calls = []
+
+    def flaky_hf_hub_download(repo_id, filename, local_dir, **kwargs):
+        # Как huggingface_hub: недокачанный файл лежит в local_dir и продолжается следующим вызовом
+        partial = os.path.join(local_dir, filename + ".incomplete")
+        calls.append((local_dir, os.path.exists(partial)))
+        if len(calls) == 1:
+            with open(partial, "wb") as f:
+                f.write(b"wei")
+            raise ConnectionResetError("connection reset")
+        os.replace(partial, os.path.join(local_dir, filename))
+        with open(os.path.join(local_dir, filename), "ab") as f:
+            f.write(b"ghts")
+        return os.path.join(local_dir, filename)
+
+    monkeypatch.setattr(huggingface_hub, "hf_hub_download", flaky_hf_hub_download)
+    result = asyncio.run(downloader.download_model({
+        "model_id": "org/model", "model_path": "model.safetensors", "save_path": "checkpoints",
+    }))
+
+    assert result["status"] == "success"
+    assert (models_dir / "checkpoints" / "model.safetensors").read_bytes() == b"weights"
+    assert len(calls) == 2
+    assert calls[0][0] == calls[1][0] and calls[1][1]
+    # После успешной загрузки staging удаляется
+    assert not (models_dir / "checkpoints" / downloader.STAGING_DIR_NAME).exists()
+
+
+def test_failed_hub_download_keeps_staging_dir(downloader, models_dir, monkeypatch):
+    import huggingface_hub
+
+    def missing(repo_id, filename, local_dir, **kwargs):
+        with open(os.path.join(local_dir, filename + ".incomplete"), "wb") as f:
+            f.write(b"wei")
+        raise PermissionError("denied")
+
+    monkeypatch.setattr(huggingface_hub, "hf_hub_download", missing)
+    with pytest.raises(Exception):
+        asyncio.run(downloader.download_model({
+            "model_id": "org/model", "model_path": "model.safetensors", "save_path": "checkpoints",
+        }))
+    staging = downloader._staging_dir(str(models_dir / "checkpoints"), "org/model", None, "model.safetensors")
+    assert os.path.exists(os.path.join(staging, "model.safetensors.incomplete"))
+
+    # Папка прошлого запуска удаляется при старте сервера
+    monkeypatch.setattr(downloader, "_started_at", os.path.getmtime(staging) + 1)
+    assert downloader.cleanup_staging_dirs() == 1
+    assert not (models_dir / "checkpoints" / downloader.STAGING_DIR_NAME).exists()
+
+
+@pytest.fixture
+def hub_file(downloader, monkeypatch):
+    """hf_hub_download пишет DATA; метаданные репозитория сообщают LFS SHA-256 файла"""
+    import huggingface_hub
+
+    async def repo_info(*args, **kwargs):
+        return {"siblings": [{"rfilename": "model.safetensors", "size": len(DATA), "sha256": SHA256}]}
+
+    calls = []
+
+    def hf_hub_download(repo_id, filename, local_dir, **kwargs):
+        calls.append(filename)
+        path = os.path.join(local_dir, filename)
+        with open(path, "wb") as f:
+            f.write(DATA)
+        return path
+
+    monkeypatch.setattr(downloader, "get_repo_info", repo_info)
+    monkeypatch.setattr(huggingface_hub, "hf_hub_download", hf_hub_download)
+    return calls
+
+
+def test_hub_file_uses_lfs_sha256_without_rehashing(pdm, downloader, hub_file, models_dir, monkeypatch):
+    def no_second_pass(*args, **kwargs):
+        raise AssertionError("the downloaded file was hashed again")
+
+    monkeypatch.setattr(pdm("integrity"), "sha256_file", no_second_pass)
+    result = asyncio.run(downloader.download_model({
+        "model_id": "org/model", "model_path": "model.safetensors", "save_path": "checkpoints",
+    }))
+    assert result["status"] == "success"
+    path = str(models_dir / "checkpoints" / "model.safetensors")
+    assert downloader.get_verification_store().lookup(path) == SHA256
+
+
+def test_hub_file_preset_sha256_mismatch_fails_before_download(downloader, hub_file):
+    with pytest.raises(Exception, match="SHA-256 mismatch"):
+        asyncio.run(downloader.download_model({
+            "model_id": "org/model", "model_path": "model.safetensors", "save_path": "checkpoints",
+            "sha256": "0" * 64,
+        }))
+    assert hub_file == []
+
+
+def test_hub_read_timeout_is_restored_after_download(downloader, hub_file, monkeypatch):
+    import huggingface_hub
+    from huggingface_hub import constants
+
+    monkeypatch.delenv("HF_HUB_DOWNLOAD_TIMEOUT", raising=False)
+    monkeypatch.setenv("PDM_DOWNLOAD_TIMEOUT", "123")
+    monkeypatch.setattr(constants, "HF_HUB_DOWNLOAD_TIMEOUT", 10)
+    seen = []
+    download = huggingface_hub.hf_hub_download
+
+    def hf_hub_download(*args, **kwargs):
+        seen.append(constants.HF_HUB_DOWNLOAD_TIMEOUT)
+        return download(*args, **kwargs)
+
+    monkeypatch.setattr(huggingface_hub, "hf_hub_download", hf_hub_download)
+    result = asyncio.run(downloader.download_model({
+        "model_id": "org/model", "model_path": "model.safetensors", "save_path": "checkpoints",
+    }))
+    assert result["status"] == "success"
+    # Таймаут чтения меняется только на время загрузки, другие пользователи huggingface_hub его не видят
+    assert seen == [123]
+    assert constants.HF_HUB_DOWNLOAD_TIMEOUT == 10
+
+
+REPO_FILES = {"config.json": b"{}", "unet/model.safetensors": b"weights", "vae/model.safetensors": b"vae"}
+
+
+@pytest.fixture
+def hub_repo(downloader, monkeypatch):
+    """snapshot_download записывает REPO_FILES (с учётом шаблонов); online=False — HuggingFace недоступен"""
+    import huggingface_hub
+
+    state = {"online": True, "calls": 0}
+
+    async def repo_info(*args, **kwargs):
+        if not state["online"]:
+            raise ConnectionError("offline")
+        return {"siblings": [{"rfilename": name, "size": len(data), "sha256": None} for name, data in REPO_FILES.items()]}
+
+    def snapshot_download(repo_id, local_dir, allow_patterns=None, ignore_patterns=None, **kwargs):
+        state["calls"] += 1
+        for name in downloader.filter_repo_files([{"rfilename": name} for name in REPO_FILES], allow_patterns):
+            path = os.path.join(local_dir, name["rfilename"])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(REPO_FILES[name["rfilename"]])
+        return local_dir
+
+    monkeypatch.setattr(downloader, "get_repo_info", repo_info)
+    monkeypatch.setattr(huggingface_hub, "snapshot_download", snapshot_download)
+    return state
+
+
+def download_repo(downloader, **data):
+    """Сообщение результата загрузки репозитория (пустое, если модель скачивалась)"""
+    result = asyncio.run(downloader.download_model(dict({"model_id": "org/model", "save_path": "checkpoints"}, **data)))
+    assert result["status"] == "success"
+    return result.get("message", "")
+
+
+def test_partial_repo_is_not_skipped(downloader, hub_repo, models_dir):
+    model_dir = models_dir / "checkpoints" / "model"
+    (model_dir / "unet").mkdir(parents=True)
+    (model_dir / "config.json").write_bytes(b"{}")
+    (model_dir / "unet" / "model.safetensors").write_bytes(b"wei")
+    assert "skipped" not in download_repo(downloader)
+    assert hub_repo["calls"] == 1
+    assert (model_dir / "unet" / "model.safetensors").read_bytes() == b"weights"
+
+    assert "already exists (3 files)" in download_repo(downloader)
+    assert hub_repo["calls"] == 1
+
+
+def test_repo_check_uses_patterns(downloader, hub_repo, models_dir):
+    assert "skipped" not in download_repo(downloader, allow_patterns="unet/*")
+    assert "already exists (1 files)" in download_repo(downloader, allow_patterns="unet/*")
+    # Другие шаблоны — другие файлы, которых ещё нет
+    assert "skipped" not in download_repo(downloader, allow_patterns="vae/*")
+    assert hub_repo["calls"] == 2
+
+
+def test_repo_check_offline_uses_marker(downloader, hub_repo, models_dir):
+    download_repo(downloader)
+    hub_repo["online"] = False
+    assert "already exists (3 files)" in download_repo(downloader)
+    # Файл удалили — список прошлой загрузки больше не сходится с папкой
+    os.remove(models_dir / "checkpoints" / "model" / "vae" / "model.safetensors")
+    download_repo(downloader)
+    assert hub_repo["calls"] == 2
@@ -0,0 +1,90 @@
+"""Проверка скачанных файлов: SHA-256 во время загрузки и записи о проверке (integrity.py)"""
+import os
+import asyncio
+import hashlib
+
+import pytest
+
+
+@pytest.fixture
+def integrity(pdm):
+    return pdm("integrity")
+
+
+DATA = bytes(range(256)) * 64
+
+
+def test_sequential_hasher_out_of_order(integrity, tmp_path):
+    path = tmp_path / "file.bin"
+    path.write_bytes(DATA)
+    hasher = integrity.SequentialHasher(max_pending=len(DATA))
+    blocks = [(offset, DATA[offset:offset + 1000]) for offset in range(0, len(DATA), 1000)]
+    for offset, block in reversed(blocks):
+        hasher.update(offset, block)
+    assert hasher.offset == len(DATA)
+    assert hasher.finish(str(path), len(DATA)) == hashlib.sha256(DATA).hexdigest()
+    assert hasher.read_bytes == 0
+
+
+def test_sequential_hasher_writer_and_disk_fallback(integrity, tmp_path):
+    path = tmp_path / "file.bin"
+    path.write_bytes(DATA)
+    # Памяти хватает на один блок — остальное дочитывается с диска
+    hasher = integrity.SequentialHasher(max_pending=1000)
+    second = hasher.writer(8000)
+    second(DATA[8000:9000])
+    second(DATA[9000:10000])
+    first = hasher.writer(0)
+    first(DATA[:4000])
+    assert hasher.offset == 4000
+    assert hasher.finish(str(path), len(DATA)) == hashlib.sha256(DATA).hexdigest()
+    assert hasher.read_bytes == len(DATA) - 4000 - 1000
+
+
+def test_verify_download(integrity, tmp_path):
+    path = tmp_path / "file.bin"
+    path.write_bytes(DATA)
+    sha256 = hashlib.sha256(DATA).hexdigest()
+    assert asyncio.run(integrity.verify_download(str(path), None, "SHA256:" + sha256.upper(), len(DATA))) == sha256
+    with pytest.raises(integrity.IntegrityError):
+        asyncio.run(integrity.verify_download(str(path), None, sha256, len(DATA) + 1))
+    with pytest.raises(integrity.IntegrityError):
+        asyncio.run(integrity.verify_download(str(path), "0" * 64, sha256))
+
+
+def test_verify_file_uses_record(integrity, tmp_path, monkeypatch):
+    path = tmp_path / "file.bin"
+    path.write_bytes(DATA)
+    sha256 = hashlib.sha256(DATA).hexdigest()
+    assert asyncio.run(integrity.verify_file(str(path), sha256)) == sha256
+
+    def no_hashing(*args, **kwargs):
+        raise AssertionError("unchanged file was hashed again")
+
+    monkeypatch.setattr(integrity, "sha256_file", no_hashing)
+    assert asyncio.run(integrity.verify_file(str(path), sha256)) == sha256
+    os.utime(path, ns=(0, 0))
+    with pytest.raises(AssertionError):
+        asyncio.run(integrity.verify_file(str(path), sha256))
+
+
+def test_peer_lookup_by_source_without_blob_store(pdm, integrity, tmp_path):
+    peers = pdm("peers")
+    assert pdm("blob_store").get_blob_store() is None
+    path = tmp_path / "file.bin"
+    path.write_bytes(DATA)
+    sha256 = hashlib.sha256(DATA).hexdigest()
+    source = "url:https://example.com/file.bin?token=secret"
+    store = integrity.get_verification_store()
+    store.record(str(path), sha256, source)
+    # Повторная проверка без источника его не стирает
+    store.record(str(path), sha256)
+
+    assert peers.find_local_file(source=source) == (str(path), sha256)
+    assert peers.find_local_file(sha256="0" * 64, source=source) is None
+    assert peers.lookup(source="url:https://example.com/other.bin")["available"] is False
+    # Источник хранится только в виде хеша: токен из ссылки не попадает на диск
+    assert "secret" not in (tmp_path / "verified.json").read_text()
+
+    path.write_bytes(DATA[:100])
+    assert peers.find_local_file(source=source) is None
@@ -0,0 +1,43 @@
+"""История задач загрузки: завершённые задачи хранятся, пока клиент не получит их результат (jobs.py)"""
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def jobs(pdm, monkeypatch):
+    jobs = pdm("jobs")
+
+    async def download_model(params, progress):
+        return {"status": "success", "path": params["direct_url"]}
+
+    monkeypatch.setattr(jobs, "download_model", download_model)
+    return jobs
+
+
+def run_jobs(manager, count):
+    async def scenario():
+        submitted = [manager.submit({"direct_url": f"https://example.com/{index}.bin"}) for index in range(count)]
+        for job in submitted:
+            await manager.wait(job)
+        return submitted
+
+    return asyncio.run(scenario())
+
+
+def test_finished_jobs_stay_until_delivered(jobs):
+    manager = jobs.DownloadJobManager(max_concurrent=1, history_limit=1, history_retention=3600)
+    first, second, third = run_jobs(manager, 3)
+    # Сверх лимита истории, но результат ещё никто не получил
+    assert [job.id for job in manager.list_jobs()] == [first.id, second.id, third.id]
+
+    manager.mark_delivered([second])
+    assert [job.id for job in manager.list_jobs()] == [first.id, third.id]
+    manager.mark_delivered(manager.list_jobs())
+    assert [job.id for job in manager.list_jobs()] == [third.id]
+
+
+def test_undelivered_jobs_expire_after_retention(jobs):
+    manager = jobs.DownloadJobManager(max_concurrent=1, history_limit=1, history_retention=0)
+    _first, _second, third = run_jobs(manager, 3)
+    assert [job.id for job in manager.list_jobs()] == [third.id]
@@ -0,0 +1,26 @@
+"""Кэш метаданных: записи только в памяти не сохраняются на диск (metadata_cache.py)"""
+import json
+import asyncio
+
+
+def test_transient_entries_are_not_persisted(pdm, tmp_path):
+    metadata_cache = pdm("metadata_cache")
+    path = tmp_path / "metadata_cache.json"
+    cache = metadata_cache.MetadataCache(path=str(path))
+
+    async def fetch():
+        return 42
+
+    async def scenario():
+        await cache.get_or_fetch("repo:org/model", fetch)
+        await cache.get_or_fetch("head:https://example.com/file.bin?token=secret", fetch, persist=False)
+        await cache.get_or_fetch("search:10:sdxl", fetch)
+
+    asyncio.run(scenario())
+    assert set(json.loads(path.read_text())) == {"repo:org/model", "search:10:sdxl"}
+    assert cache.get("head:https://example.com/file.bin?token=secret") == (True, 42)
+
+    # После перезапуска подписанной ссылки в кэше нет
+    restarted = metadata_cache.MetadataCache(path=str(path))
+    assert restarted.get("head:https://example.com/file.bin?token=secret") == (False, None)
+    assert restarted.get("repo:org/model") == (True, 42)
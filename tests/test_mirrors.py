@@ -0,0 +1,110 @@
+"""Источники загрузки: зеркала пресета и кому отправляется hf_token (mirrors.py)"""
+import asyncio
+import hashlib
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+DATA = b"weights" * 4096
+
+
+@pytest.fixture
+def mirrors(pdm):
+    return pdm("mirrors")
+
+
+def test_token_hosts_default_to_main_source(mirrors, monkeypatch):
+    monkeypatch.setenv("PDM_HF_MIRRORS", "https://hf-mirror.com")
+    data = {"model_id": "org/model", "model_path": "model.safetensors", "mirrors": ["https://mirror.example.org"]}
+    hosts = mirrors.mirror_token_hosts(data, "https://huggingface.co")
+    assert hosts == {"huggingface.co"}
+    for url in mirrors.mirror_urls(data):
+        assert mirrors.source_token(url, "hf_secret", hosts) == ""
+    assert mirrors.source_token("https://huggingface.co/org/model/resolve/main/model.safetensors", "hf_secret", hosts) == "hf_secret"
+
+
+def test_token_hosts_allow_list(mirrors, monkeypatch):
+    monkeypatch.setenv("PDM_TOKEN_HOSTS", "hf-mirror.com, cdn.example.com:8443")
+    data = {"direct_url": "https://example.com/model.safetensors", "mirrors": [
+        "https://untrusted.example.org/model.safetensors",
+        {"url": "https://trusted.example.org/model.safetensors", "send_token": True},
+        {"endpoint": "https://hf.example.net", "send_token": True},
+    ]}
+    assert mirrors.mirror_token_hosts(data, data["direct_url"]) == {
+        "example.com", "hf-mirror.com", "cdn.example.com:8443", "trusted.example.org", "hf.example.net",
+    }
+
+
+def file_app(received, body=DATA):
+    """Источник файла, запоминающий заголовок Authorization каждого запроса"""
+    async def handler(request):
+        received.append(request.headers.get("Authorization"))
+        data = body
+        status = 200
+        if request.headers.get("Range"):
+            start, end = request.headers["Range"].split("=")[1].split("-")
+            data = body[int(start):int(end) + 1 if end else None]
+            status = 206
+        return web.Response(body=data, status=status, content_type="application/octet-stream")
+
+    app = web.Application()
+    app.router.add_get("/model.safetensors", handler)
+    return app
+
+
+def test_mirrors_do_not_receive_token(pdm, tmp_path):
+    downloader = pdm("downloader")
+    http_client = pdm("http_client")
+    progress = pdm("progress").TransferProgress()
+    main, mirror = [], []
+
+    async def scenario():
+        async with TestServer(file_app(main)) as main_server, TestServer(file_app(mirror)) as mirror_server:
+            main_url = str(main_server.make_url("/model.safetensors"))
+            mirror_url = str(mirror_server.make_url("/model.safetensors"))
+            data = {"direct_url": main_url, "mirrors": [mirror_url]}
+            target = str(tmp_path / "model.safetensors")
+            try:
+                await downloader._download_direct(
+                    main_url, target, "hf_secret", progress, hashlib.sha256(DATA).hexdigest(), len(DATA),
+                    [mirror_url], token_hosts=downloader.mirror_token_hosts(data, main_url)
+                )
+            finally:
+                await http_client.close_sessions()
+
+    asyncio.run(scenario())
+    assert (tmp_path / "model.safetensors").read_bytes() == DATA
+    assert main and set(main) == {"Bearer hf_secret"}
+    assert mirror and set(mirror) == {None}
+
+
+def test_corrupt_source_switches_to_mirror(pdm, tmp_path):
+    """Файл с неверным SHA-256 качается заново со следующего источника, а не с того же"""
+    downloader = pdm("downloader")
+    http_client = pdm("http_client")
+    progress = pdm("progress").TransferProgress()
+    corrupt, mirror = [], []
+
+    async def scenario():
+        async with TestServer(file_app(corrupt, b"x" * len(DATA))) as corrupt_server, \
+                TestServer(file_app(mirror)) as mirror_server:
+            corrupt_url = str(corrupt_server.make_url("/model.safetensors"))
+            mirror_url = str(mirror_server.make_url("/model.safetensors"))
+            # Свежие оценки: повреждённый источник «быстрее» и пробуется первым, без проб
+            scoreboard = downloader.get_source_scoreboard()
+            scoreboard.record_probe(corrupt_url, 0.01, 10 ** 9)
+            scoreboard.record_probe(mirror_url, 0.01, 10 ** 6)
+            try:
+                await downloader._download_direct(
+                    corrupt_url, str(tmp_path / "model.safetensors"), "", progress,
+                    hashlib.sha256(DATA).hexdigest(), len(DATA), [mirror_url]
+                )
+            finally:
+                await http_client.close_sessions()
+            return scoreboard.to_dict()
+
+    scores = asyncio.run(scenario())
+    assert (tmp_path / "model.safetensors").read_bytes() == DATA
+    assert len(corrupt) == 1 and len(mirror) == 1
+    assert [entry["failures"] for entry in scores.values()] == [1, 0]
@@ -0,0 +1,79 @@
+"""
+HTTP API остаётся отзывчивым, пока huggingface_hub качает файл: блокирующий hf_hub_download
+выполняется в пуле потоков, а не в event loop PromptServer.
+
+ComfyUI не нужен: folder_paths и PromptServer подменяются (conftest.py), пакет загружается из папки репозитория.
+"""
+import os
+import time
+import types
+import asyncio
+import threading
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+# Сколько может занять GET /presets, пока идёт загрузка (без блокировки — миллисекунды)
+RESPONSE_LIMIT_SECONDS = 0.5
+
+
+@pytest.fixture
+def package(pdm, routes):
+    return types.SimpleNamespace(downloader=pdm("downloader"), http_client=pdm("http_client"), routes=routes)
+
+
+def test_presets_respond_while_hf_hub_download_blocks(package, monkeypatch):
+    import huggingface_hub
+
+    started = threading.Event()
+    release = threading.Event()
+    blocked_at = []
+
+    def blocking_hf_hub_download(repo_id, filename, local_dir, **kwargs):
+        blocked_at.append(time.perf_counter())
+        started.set()
+        release.wait(10)
+        path = os.path.join(local_dir, filename)
+        with open(path, "wb") as f:
+            f.write(b"weights")
+        return path
+
+    async def no_repo_info(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(huggingface_hub, "hf_hub_download", blocking_hf_hub_download)
+    monkeypatch.setattr(package.downloader, "get_repo_info", no_repo_info)
+
+    async def scenario():
+        app = web.Application()
+        app.add_routes(package.routes)
+        async with TestClient(TestServer(app)) as client:
+            response = await client.post("/preset_download_manager/jobs", json={"models": [{
+                "model_id": "org/model", "model_path": "model.safetensors", "save_path": "checkpoints",
+            }]})
+            assert response.status == 200
+            job_id = (await response.json())["jobs"][0]["id"]
+            loop = asyncio.get_running_loop()
+            try:
+                assert await loop.run_in_executor(None, started.wait, 5), "hf_hub_download was not called"
+
+                # Время считается с начала блокирующего вызова: если он занял event loop, ответ придёт только после него
+                response = await client.get("/preset_download_manager/presets")
+                await response.read()
+                elapsed = time.perf_counter() - blocked_at[0]
+                assert response.status == 200
+                assert elapsed < RESPONSE_LIMIT_SECONDS, f"GET /presets took {elapsed:.3f} s during a download"
+            finally:
+                release.set()
+
+            deadline = time.monotonic() + 10
+            while True:
+                job = await (await client.get(f"/preset_download_manager/jobs/{job_id}")).json()
+                if job["status"] not in ("queued", "running") or time.monotonic() > deadline:
+                    break
+                await asyncio.sleep(0.05)
+            assert job["status"] == "completed", job
+        await package.http_client.close_sessions()
+
+    asyncio.run(scenario())
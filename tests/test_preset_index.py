@@ -0,0 +1,82 @@
+"""Поиск пресетов: префиксы слов, фильтры, количество по категориям и страницы (preset_index.py)"""
+import pytest
+
+DOCUMENT = {
+    "categories": ["Base", "Video", "Empty"],
+    "presets": [
+        {"id": "sdxl", "name": "SDXL Base", "category": "Base", "tags": ["XL"], "models": [
+            {"model_id": "stabilityai/stable-diffusion-xl-base-1.0", "model_path": "sd_xl_base_1.0.safetensors",
+             "save_path": "checkpoints"},
+        ]},
+        {"id": "flux", "name": "Flux Dev", "category": "Base", "models": [
+            {"model_id": "black-forest-labs/FLUX.1-dev", "model_path": "flux1-dev.safetensors", "save_path": "unet"},
+            {"direct_url": "https://example.com/files/ae.safetensors?token=1", "save_path": "vae"},
+        ]},
+        {"id": "wan", "name": "Wan Video", "category": "Video", "tags": ["video", "XL"], "models": [
+            {"model_id": "Wan-AI/Wan2.1", "model_path": "wan.safetensors", "save_path": "diffusion_models"},
+        ]},
+        {"id": "misc", "name": "Stable misc", "models": ["not a model"]},
+    ],
+}
+
+
+@pytest.fixture
+def index(pdm):
+    return pdm("preset_index").PresetIndex(DOCUMENT, '"etag"')
+
+
+def ids(result):
+    return [preset["id"] for preset in result["presets"]]
+
+
+def test_prefix_search(index):
+    assert ids(index.query(q="sta")) == ["sdxl", "misc"]
+    # Все слова запроса должны найтись (каждое — по префиксу)
+    assert ids(index.query(q="stable base")) == ["sdxl"]
+    # Слова из model_id, model_path и имени файла прямой ссылки (без query)
+    assert ids(index.query(q="forest")) == ["flux"]
+    assert ids(index.query(q="ae")) == ["flux"]
+    assert ids(index.query(q="token")) == []
+    assert ids(index.query(q="WAN2")) == ["wan"]
+    assert ids(index.query(q="nothing")) == []
+
+
+def test_filters(index):
+    assert ids(index.query(save_path="vae")) == ["flux"]
+    assert ids(index.query(model_id="wan-ai/wan2.1")) == ["wan"]
+    assert ids(index.query(tag="xl")) == ["sdxl", "wan"]
+    assert ids(index.query(tag="xl", q="video")) == ["wan"]
+    assert ids(index.query(predicate=lambda preset: preset["id"] != "sdxl", category="Base")) == ["flux"]
+
+
+def test_category_facets(index):
+    result = index.query(tag="xl", category="Base")
+    assert ids(result) == ["sdxl"]
+    # Количество по категориям считается без фильтра по категории — с учётом остальных фильтров
+    assert result["categories"] == [
+        {"name": "Base", "count": 1}, {"name": "Video", "count": 1}, {"name": "Empty", "count": 0},
+        {"name": "Uncategorized", "count": 0},
+    ]
+    assert ids(index.query(category="Uncategorized")) == ["misc"]
+    assert index.query(category="Missing")["total"] == 0
+
+
+def test_pagination(index):
+    first = index.query(page_size=3)
+    assert (ids(first), first["total"], first["pages"], first["total_presets"]) == (["sdxl", "flux", "wan"], 4, 2, 4)
+    assert ids(index.query(page=2, page_size=3)) == ["misc"]
+    assert ids(index.query(page=3, page_size=3)) == []
+    # Некорректные значения ограничиваются допустимым диапазоном
+    clamped = index.query(page="0", page_size="100000")
+    assert (clamped["page"], clamped["page_size"]) == (1, 500)
+    with pytest.raises(ValueError):
+        index.query(page="x")
+
+
+def test_store_rebuilds_index_after_change(pdm, tmp_path):
+    store = pdm("preset_store").PresetStore(str(tmp_path / "presets.json"))
+    store.save(dict(DOCUMENT))
+    index = store.index()
+    assert store.index() is index
+    store.patch_preset("misc", {"name": "Renamed"})
+    assert ids(store.index().query(q="renamed")) == ["misc"]
@@ -0,0 +1,159 @@
+"""Хранилище пресетов: версии пресетов, If-Match и конфликты изменений (preset_store.py, API в nodes.py)"""
+import json
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+PRESET = {"name": "SDXL", "category": "Base", "models": [{"model_id": "org/sdxl", "save_path": "checkpoints"}]}
+
+
+@pytest.fixture
+def preset_store(pdm):
+    return pdm("preset_store")
+
+
+@pytest.fixture
+def store(preset_store, tmp_path):
+    return preset_store.PresetStore(str(tmp_path / "presets.json"))
+
+
+def test_put_creates_and_replaces_with_version(store, preset_store):
+    created = store.put_preset("sdxl", PRESET)
+    assert (created["id"], created["version"]) == ("sdxl", 1)
+    # Повторное создание с тем же ID — конфликт, а не перезапись
+    with pytest.raises(preset_store.PresetConflict) as conflict:
+        store.put_preset("sdxl", dict(PRESET, name="Other"))
+    assert conflict.value.current["name"] == "SDXL"
+
+    replaced = store.put_preset("sdxl", dict(PRESET, name="SDXL 1.0"), version=1)
+    assert (replaced["name"], replaced["version"]) == ("SDXL 1.0", 2)
+    with pytest.raises(preset_store.PresetConflict):
+        store.put_preset("sdxl", PRESET, version=1)
+
+
+def test_patch_keeps_other_fields_and_checks_version(store, preset_store):
+    store.put_preset("sdxl", PRESET)
+    patched = store.patch_preset("sdxl", {"name": "Renamed", "id": "ignored", "version": 99}, version=1)
+    assert (patched["id"], patched["name"], patched["category"], patched["version"]) == ("sdxl", "Renamed", "Base", 2)
+    assert patched["models"] == PRESET["models"]
+
+    # Вторая вкладка правит по устаревшей версии — изменение отклоняется
+    with pytest.raises(preset_store.PresetConflict) as conflict:
+        store.patch_preset("sdxl", {"name": "Stale"}, version=1)
+    assert conflict.value.current["version"] == 2
+    assert store.get_preset("sdxl")["name"] == "Renamed"
+    # Без version изменение применяется к текущей версии
+    assert store.patch_preset("sdxl", {"category": "XL"})["version"] == 3
+
+    with pytest.raises(preset_store.PresetNotFound):
+        store.patch_preset("missing", {"name": "x"})
+    with pytest.raises(ValueError):
+        store.patch_preset("sdxl", {"models": "not a list"})
+
+
+def test_delete_checks_version(store, preset_store):
+    store.put_preset("sdxl", PRESET)
+    store.patch_preset("sdxl", {"name": "Renamed"})
+    with pytest.raises(preset_store.PresetConflict):
+        store.delete_preset("sdxl", version=1)
+    assert store.delete_preset("sdxl", version=2)["name"] == "Renamed"
+    with pytest.raises(preset_store.PresetNotFound):
+        store.get_preset("sdxl")
+
+
+def test_legacy_presets_have_version_one(store, preset_store, tmp_path):
+    (tmp_path / "presets.json").write_text(json.dumps({"categories": [], "presets": [dict(PRESET, id="old")]}))
+    assert preset_store.preset_version(store.get_preset("old")) == 1
+    assert store.patch_preset("old", {"name": "New"}, version=1)["version"] == 2
+
+
+def test_import_and_categories(store):
+    store.put_preset("sdxl", PRESET)
+    counts = store.import_presets([dict(PRESET, id="sdxl", name="Imported"), {"name": "Flux"}], ["Extra"])
+    assert counts == {"added": 1, "replaced": 0, "skipped": 1}
+    assert store.import_presets([dict(PRESET, id="sdxl", name="Imported")], replace=True)["replaced"] == 1
+    assert store.get_preset("sdxl")["version"] == 2
+    assert store.list_categories() == {"Extra": 0, "Base": 1, "Uncategorized": 1}
+
+    assert store.rename_category("Base", "XL") == 1
+    assert store.get_preset("sdxl")["version"] == 3
+    assert store.delete_category("XL") == 1
+    assert store.get_preset("sdxl")["category"] == "Uncategorized"
+
+
+def test_save_if_match(store, preset_store):
+    _raw, etag = store.snapshot()
+    new_etag = store.save({"presets": [dict(PRESET, id="sdxl")]}, if_match=etag)
+    assert new_etag != etag
+    with pytest.raises(preset_store.PresetConflict):
+        store.save({"presets": []}, if_match=etag)
+    assert store.get_preset("sdxl")
+
+
+def test_file_edited_outside(store, tmp_path):
+    store.put_preset("sdxl", PRESET)
+    document = json.loads((tmp_path / "presets.json").read_text())
+    document["presets"][0]["name"] = "Edited"
+    (tmp_path / "presets.json").write_text(json.dumps(document) + "\n")
+    assert store.get_preset("sdxl")["name"] == "Edited"
+
+
+def api(routes, scenario):
+    async def run():
+        app = web.Application()
+        app.add_routes(routes)
+        async with TestClient(TestServer(app)) as client:
+            return await scenario(client)
+
+    return asyncio.run(run())
+
+
+def test_api_if_match_and_conflicts(routes):
+    async def scenario(client):
+        url = "/preset_download_manager/presets"
+        response = await client.get(url)
+        etag = response.headers["ETag"]
+        assert (await client.get(url, headers={"If-None-Match": etag})).status == 304
+
+        # Сохранение всего документа с устаревшим If-Match — 412
+        response = await client.post(url, json={"presets": [dict(PRESET, id="sdxl")]}, headers={"If-Match": etag})
+        assert response.status == 200
+        response = await client.post(url, json={"presets": []}, headers={"If-Match": etag})
+        assert response.status == 412
+
+        response = await client.put(f"{url}/flux", json={"name": "Flux", "models": []})
+        assert (response.status, (await response.json())["preset"]["version"]) == (200, 1)
+        assert (await client.put(f"{url}/flux", json={"name": "Flux 2"})).status == 409
+
+        response = await client.patch(f"{url}/flux", json={"name": "Flux 1", "version": 1})
+        assert (await response.json())["preset"]["version"] == 2
+        response = await client.patch(f"{url}/flux", json={"name": "Stale", "version": 1})
+        assert response.status == 409
+        assert (await response.json())["current"]["name"] == "Flux 1"
+        assert (await client.patch(f"{url}/flux", json={"version": "x"})).status == 400
+
+        assert (await client.delete(f"{url}/flux?version=1")).status == 409
+        assert (await client.delete(f"{url}/flux?version=2")).status == 200
+        assert (await client.get(f"{url}/flux")).status == 404
+
+    api(routes, scenario)
+
+
+def test_changes_do_not_touch_loaded_document(store):
+    store.put_preset("sdxl", PRESET)
+    loaded = store.load()
+    presets = loaded["presets"]
+    # Документ, который обходят в другом потоке, не меняется при правках — они создают новый
+    store.put_preset("flux", dict(PRESET, name="Flux"))
+    store.patch_preset("sdxl", {"name": "Renamed"})
+    store.delete_category("Base")
+    assert [preset["name"] for preset in presets] == ["SDXL"]
+    assert loaded["presets"] is presets and presets[0]["category"] == "Base"
+    assert [preset["name"] for preset in store.load()["presets"]] == ["Renamed", "Flux"]
+
+    document = {"presets": [dict(PRESET, id="own")]}
+    store.save(document)
+    document["presets"].clear()
+    assert store.get_preset("own")
@@ -0,0 +1,247 @@
+"""Классификация ошибок, политика повторов и автоматические выключатели (retry.py)"""
+import time
+import errno
+import types
+import asyncio
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+import pytest
+
+
+@pytest.fixture
+def retry(pdm):
+    return pdm("retry")
+
+
+def http_error(retry, status, retry_after=None):
+    return retry.HTTPStatusError(f"HTTP {status}", status, retry_after)
+
+
+@pytest.mark.parametrize("status, kind, retryable, host_failure", [
+    (429, "rate_limited", True, False),
+    (503, "unavailable", True, True),
+    (500, "server", True, True),
+    (524, "server", True, True),
+    (408, "server", True, True),
+    (401, "fatal", False, False),
+    (404, "fatal", False, False),
+    (409, "fatal", False, False),
+    (418, "fatal", False, False),
+])
+def test_classify_by_status(retry, status, kind, retryable, host_failure):
+    failure = retry.classify(http_error(retry, status))
+    assert (failure.kind, failure.retryable, failure.host_failure, failure.status) == (kind, retryable, host_failure, status)
+
+
+def test_cloudflare_524_cause(retry):
+    assert retry.classify(http_error(retry, 524)).cause == "cloudflare_524"
+    assert retry.classify(http_error(retry, 502)).cause == "http_502"
+
+
+def test_status_from_response_object(retry):
+    """Ошибки requests/httpx (и huggingface_hub поверх них) несут код в response.status_code"""
+    error = Exception("Too many requests")
+    error.response = types.SimpleNamespace(status_code=429, headers={"Retry-After": "7"})
+    failure = retry.classify(error)
+    assert failure.kind == "rate_limited"
+    assert failure.retry_after == 7.0
+
+
+def test_network_errors(retry):
+    assert retry.classify(asyncio.TimeoutError()).kind == "timeout"
+    assert retry.classify(aiohttp.ClientPayloadError("closed")).kind == "connection"
+    assert retry.classify(ConnectionResetError(errno.ECONNRESET, "reset")).kind == "connection"
+
+
+def test_cause_chain(retry):
+    """Обёртка без кода ответа классифицируется по причине — через __cause__ и __context__"""
+    try:
+        try:
+            raise aiohttp.ClientConnectionError("refused")
+        except aiohttp.ClientConnectionError as e:
+            # Как LocalEntryNotFoundError huggingface_hub: ValueError поверх сетевой ошибки
+            raise ValueError("Connection error, and the file is not in the local cache") from e
+    except ValueError as e:
+        wrapped = e
+    assert retry.classify(wrapped).kind == "connection"
+
+    try:
+        try:
+            raise http_error(retry, 503, retry_after=3)
+        except retry.HTTPStatusError:
+            raise RuntimeError("download failed")
+    except RuntimeError as e:
+        implicit = e
+    failure = retry.classify(implicit)
+    assert (failure.kind, failure.retry_after) == ("unavailable", 3)
+
+
+def test_cause_chain_cycle(retry):
+    first = Exception("first")
+    second = Exception("second")
+    first.__cause__ = second
+    second.__cause__ = first
+    assert retry.classify(first).kind == "other"
+
+
+def test_unknown_errors_are_retried(retry):
+    for error in (Exception("Source returned an HTML page instead of the file"), OSError("I/O error"), RuntimeError("x")):
+        failure = retry.classify(error)
+        assert (failure.kind, failure.retryable) == ("other", True)
+
+
+def test_local_errors_are_fatal(retry):
+    for error in (ValueError("bad preset"), PermissionError(errno.EACCES, "denied"), OSError(errno.ENOSPC, "No space left")):
+        failure = retry.classify(error)
+        assert (failure.kind, failure.retryable) == ("local", False)
+
+
+def test_unknown_errors_have_limited_budget(retry):
+    policy = retry.RetryPolicy(max_attempts=5, base_delay=0, max_unknown_retries=2)
+    other = retry.classify(Exception("HTTP 999"))
+    assert [policy.should_retry(other, attempt) for attempt in range(4)] == [True, True, False, False]
+    timeout = retry.classify(asyncio.TimeoutError())
+    assert [policy.should_retry(timeout, attempt) for attempt in range(5)] == [True, True, True, True, False]
+
+
+def test_parse_retry_after(retry):
+    assert retry.parse_retry_after("5") == 5.0
+    assert retry.parse_retry_after("-3") == 0.0
+    assert retry.parse_retry_after(None) is None
+    assert retry.parse_retry_after("soon") is None
+    date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+    assert 55 <= retry.parse_retry_after(date) <= 60
+
+
+def test_retry_after_policy(retry):
+    policy = retry.RetryPolicy(max_attempts=5, base_delay=1, max_delay=4, max_retry_after=30)
+    assert policy.next_delay(1, retry.classify(http_error(retry, 429, retry_after=12))) == 12
+    # Сервер просит ждать дольше max_retry_after — повторять бессмысленно
+    assert not policy.should_retry(retry.classify(http_error(retry, 429, retry_after=120)), 0)
+    # Без Retry-After — jitter между base_delay и утроенной предыдущей паузой, не больше max_delay
+    server = retry.classify(http_error(retry, 500))
+    for _index in range(100):
+        assert 1 <= policy.next_delay(1, server) <= 3
+        assert policy.next_delay(10, server) <= 4
+    assert policy.next_delay(1, retry.classify(retry.IntegrityError("bad sha"))) == 0
+
+
+def test_retry_async(retry, monkeypatch):
+    monkeypatch.setenv("PDM_RETRY_DELAY", "0")
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise http_error(retry, 524)
+        return "ok"
+
+    assert asyncio.run(retry.retry_async(flaky, host="https://example.com/x")) == "ok"
+    assert len(calls) == 3
+
+    calls.clear()
+
+    async def missing():
+        calls.append(1)
+        raise http_error(retry, 404)
+
+    with pytest.raises(retry.HTTPStatusError):
+        asyncio.run(retry.retry_async(missing, host="example.com"))
+    assert len(calls) == 1
+
+
+def test_host_key(retry):
+    assert retry.host_key("https://Example.com/a?b=1") == "example.com"
+    assert retry.host_key("https://example.com:443/a") == "example.com"
+    assert retry.host_key("http://127.0.0.1:8900/files/x") == "127.0.0.1:8900"
+    assert retry.host_key("127.0.0.1:8900") == "127.0.0.1:8900"
+    assert retry.host_key(None) == ""
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return time.time()
+
+
+@pytest.fixture
+def clock(retry, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(retry, "time", clock)
+    return clock
+
+
+def test_circuit_opens_after_threshold(retry, clock):
+    breakers = retry.CircuitBreakers(threshold=3, reset_timeout=30)
+    failure = retry.classify(http_error(retry, 524))
+    for _index in range(2):
+        breakers.record_failure("https://cdn.example.com/a", failure)
+        breakers.check("cdn.example.com")
+    breakers.record_failure("https://cdn.example.com/b", failure)
+    with pytest.raises(retry.CircuitOpenError):
+        breakers.check("https://cdn.example.com/c")
+    assert breakers.to_dict()["cdn.example.com"]["state"] == "open"
+    # Другие хосты не затронуты
+    breakers.check("https://other.example.com/a")
+
+
+def test_circuit_ignores_answers_and_resets_on_them(retry, clock):
+    breakers = retry.CircuitBreakers(threshold=2, reset_timeout=30)
+    breakers.record_failure("example.com", retry.classify(http_error(retry, 500)))
+    # 404 — хост ответил, счётчик ошибок подряд сбрасывается
+    breakers.record_failure("example.com", retry.classify(http_error(retry, 404)))
+    breakers.record_failure("example.com", retry.classify(http_error(retry, 500)))
+    breakers.check("example.com")
+
+
+def test_half_open_lets_one_probe_through(retry, clock):
+    breakers = retry.CircuitBreakers(threshold=1, reset_timeout=30)
+    failure = retry.classify(asyncio.TimeoutError())
+    breakers.record_failure("example.com", failure)
+    with pytest.raises(retry.CircuitOpenError):
+        breakers.check("example.com")
+
+    clock.now += 31
+    breakers.check("example.com")  # проба
+    assert breakers.to_dict()["example.com"]["state"] == "half_open"
+    with pytest.raises(retry.CircuitOpenError):
+        breakers.check("example.com")
+
+    # Ошибка пробы снова выключает хост на reset_timeout
+    breakers.record_failure("example.com", failure)
+    assert breakers.to_dict()["example.com"]["state"] == "open"
+    with pytest.raises(retry.CircuitOpenError):
+        breakers.check("example.com")
+
+    clock.now += 31
+    breakers.check("example.com")
+    breakers.record_success("https://example.com/file")
+    breakers.check("example.com")
+    breakers.check("example.com")
+    assert breakers.to_dict()["example.com"]["state"] == "closed"
+
+
+def test_half_open_probe_expires(retry, clock):
+    """Проба, которая не вернула результат за reset_timeout (задачу отменили), не держит хост закрытым"""
+    breakers = retry.CircuitBreakers(threshold=1, reset_timeout=30)
+    breakers.record_failure("example.com", retry.classify(asyncio.TimeoutError()))
+    clock.now += 31
+    breakers.check("example.com")
+    clock.now += 10
+    with pytest.raises(retry.CircuitOpenError):
+        breakers.check("example.com")
+    clock.now += 21
+    breakers.check("example.com")
+
+
+def test_circuit_open_failures_are_not_counted(retry, clock):
+    breakers = retry.CircuitBreakers(threshold=1, reset_timeout=30)
+    breakers.record_failure("example.com", retry.classify(retry.CircuitOpenError("example.com", 5)))
+    breakers.check("example.com")
@@ -0,0 +1,44 @@
+"""Регистрация API при загрузке nodes: повтор после ошибки не запускает фоновую работу дважды (nodes.py)"""
+import sys
+import types
+
+from conftest import PromptServer
+
+
+class FlakyPromptServer(PromptServer):
+    """routes недоступны при первом обращении, как у ещё не готового сервера"""
+
+    def __init__(self):
+        self.failures = 1
+        super().__init__()
+
+    @property
+    def routes(self):
+        if self.failures:
+            self.failures -= 1
+            raise AttributeError("routes are not ready")
+        return self._routes
+
+    @routes.setter
+    def routes(self, value):
+        self._routes = value
+
+
+def test_retry_starts_background_work_once(pdm, monkeypatch):
+    server = types.ModuleType("server")
+    server.PromptServer = FlakyPromptServer
+    FlakyPromptServer.instance = FlakyPromptServer()
+    monkeypatch.setitem(sys.modules, "server", server)
+    local_index = pdm("local_index")
+    starts = []
+    monkeypatch.setattr(local_index.LocalModelIndex, "start", lambda self: starts.append(self))
+
+    nodes = pdm("nodes")
+    assert FlakyPromptServer.instance.failures == 0
+    assert len(pdm("jobs").get_job_manager()._listeners) == 1
+    assert list(FlakyPromptServer.instance.app.on_cleanup).count(pdm("http_client").close_sessions) == 1
+    assert len(starts) == 1
+
+    nodes.init_routes()
+    assert len(pdm("jobs").get_job_manager()._listeners) == 1
+    assert len(starts) == 1
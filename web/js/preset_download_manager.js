@@ -261,6 +261,7 @@ app.registerExtension({
         // Состояние модального окна
         let currentView = 'list'; // 'list' или 'add'
         let editingPresetId = null; // ID редактируемого пресета (null = новый пресет)
+        let editingPresetVersion = null; // Версия редактируемого пресета (для обнаружения конфликтов)
         let selectedPresetsForDeletion = new Set();
         
         // Список папок для сохранения
@@ -478,29 +479,50 @@ app.registerExtension({
         // Экспортируем функцию в глобальную область видимости для доступа из класса
         window.presetDownloadManagerCreateModal = createModal;
         
+        // Параметры списка пресетов (поиск, категория, страница) сохраняются между перерисовками
+        const listQuery = { q: "", category: "", page: 1, pageSize: 50, onlyMissing: false };
+        
+        // Загружает с сервера одну страницу пресетов с учётом поиска и фильтра по категории
+        async function fetchPresetPage() {
+            // with_status — статус установки моделей для каждого пресета на странице
+            const params = new URLSearchParams({ page: listQuery.page, page_size: listQuery.pageSize, with_status: 1 });
+            if (listQuery.onlyMissing) {
+                params.set("installed", 0);
+            }
+            if (listQuery.q) {
+                params.set("q", listQuery.q);
+            }
+            if (listQuery.category) {
+                params.set("category", listQuery.category);
+            }
+            const response = await api.fetchApi(`/preset_download_manager/presets/query?${params}`);
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            return await response.json();
+        }
+        
         // Функция для рендеринга списка пресетов
         async function renderListView(content) {
             // Очищаем контент перед рендерингом
             content.innerHTML = '';
             
-            // Загружаем пресеты
-            let presetsData = { categories: [], presets: [] };
+            // Загружаем только текущую страницу пресетов
+            let pageData = { presets: [], total: 0, page: 1, pages: 1, categories: [], total_presets: 0 };
             try {
-                const response = await api.fetchApi("/preset_download_manager/presets");
-                presetsData = await response.json();
+                pageData = await fetchPresetPage();
+                // После удаления пресетов текущая страница может оказаться пустой — переходим на последнюю
+                if (pageData.presets.length === 0 && listQuery.page > pageData.pages) {
+                    listQuery.page = pageData.pages;
+                    pageData = await fetchPresetPage();
+                }
             } catch (error) {
                 console.error("[PresetDownloadManager] Ошибка загрузки пресетов:", error);
             }
             
             // Подсчитываем статистику
-            const categories = new Set();
-            presetsData.presets.forEach(preset => {
-                if (preset.category) {
-                    categories.add(preset.category);
-                }
-            });
-            const categoriesCount = categories.size;
-            const presetsCount = presetsData.presets.length;
+            const categoriesCount = pageData.categories.length;
+            const presetsCount = pageData.total_presets;
             
             // Stats header
             const statsDiv = document.createElement("div");
@@ -571,9 +593,111 @@ app.registerExtension({
                 return;
             }
             
+            // Поиск и фильтр по категории
+            const filtersDiv = document.createElement("div");
+            filtersDiv.style.cssText = `display: flex; gap: 8px; margin-bottom: 16px;`;
+            
+            const searchInput = document.createElement("input");
+            searchInput.type = "text";
+            searchInput.placeholder = "Search presets, models, files...";
+            searchInput.value = listQuery.q;
+            searchInput.style.cssText = `
+                flex: 1;
+                padding: 8px 10px;
+                background: #1a1a1a;
+                border: 1px solid #444;
+                border-radius: 5px;
+                color: white;
+                font-size: 14px;
+            `;
+            
+            const categorySelect = document.createElement("select");
+            categorySelect.style.cssText = `
+                padding: 8px 10px;
+                background: #1a1a1a;
+                border: 1px solid #444;
+                border-radius: 5px;
+                color: white;
+                font-size: 14px;
+            `;
+            
+            const onlyMissingLabel = document.createElement("label");
+            onlyMissingLabel.style.cssText = `display: flex; align-items: center; gap: 6px; color: #ccc; font-size: 14px; cursor: pointer; white-space: nowrap;`;
+            const onlyMissingCheckbox = document.createElement("input");
+            onlyMissingCheckbox.type = "checkbox";
+            onlyMissingCheckbox.checked = listQuery.onlyMissing;
+            onlyMissingLabel.appendChild(onlyMissingCheckbox);
+            onlyMissingLabel.appendChild(document.createTextNode("Only missing"));
+            
+            filtersDiv.appendChild(searchInput);
+            filtersDiv.appendChild(categorySelect);
+            filtersDiv.appendChild(onlyMissingLabel);
+            content.appendChild(filtersDiv);
+            
+            const resultsDiv = document.createElement("div");
+            content.appendChild(resultsDiv);
+            
+            const refreshResults = async () => {
+                try {
+                    renderPresetResults(resultsDiv, categorySelect, await fetchPresetPage());
+                } catch (error) {
+                    console.error("[PresetDownloadManager] Ошибка загрузки пресетов:", error);
+                }
+            };
+            
+            let searchTimer = null;
+            searchInput.oninput = () => {
+                clearTimeout(searchTimer);
+                searchTimer = setTimeout(() => {
+                    listQuery.q = searchInput.value.trim();
+                    listQuery.page = 1;
+                    refreshResults();
+                }, 250);
+            };
+            categorySelect.onchange = () => {
+                listQuery.category = categorySelect.value;
+                listQuery.page = 1;
+                refreshResults();
+            };
+            onlyMissingCheckbox.onchange = () => {
+                listQuery.onlyMissing = onlyMissingCheckbox.checked;
+                listQuery.page = 1;
+                refreshResults();
+            };
+            resultsDiv.refreshResults = refreshResults;
+            
+            renderPresetResults(resultsDiv, categorySelect, pageData);
+        }
+        
+        // Рендерит страницу найденных пресетов (по категориям), список категорий и пагинацию
+        function renderPresetResults(resultsDiv, categorySelect, pageData) {
+            resultsDiv.innerHTML = '';
+            
+            // Категории с количеством пресетов, подходящих под поиск
+            categorySelect.innerHTML = '';
+            const allOption = document.createElement("option");
+            allOption.value = "";
+            allOption.textContent = "All categories";
+            categorySelect.appendChild(allOption);
+            pageData.categories.forEach(({ name, count }) => {
+                const option = document.createElement("option");
+                option.value = name;
+                option.textContent = `${name} (${count})`;
+                categorySelect.appendChild(option);
+            });
+            categorySelect.value = listQuery.category;
+            
+            if (pageData.total === 0) {
+                const noResults = document.createElement("div");
+                noResults.textContent = "No presets match the search";
+                noResults.style.cssText = `color: #aaa; font-size: 14px; padding: 20px; text-align: center;`;
+                resultsDiv.appendChild(noResults);
+                return;
+            }
+            
             // Группируем пресеты по категориям
             const presetsByCategory = {};
-            presetsData.presets.forEach(preset => {
+            pageData.presets.forEach(preset => {
                 const category = preset.category || "Uncategorized";
                 if (!presetsByCategory[category]) {
                     presetsByCategory[category] = [];
@@ -602,16 +726,50 @@ app.registerExtension({
                 categorySection.appendChild(categoryHeader);
 
                 presets.forEach(preset => {
-                    const presetItem = createPresetItem(preset);
+                    const presetItem = createPresetItem(preset, (pageData.status || {})[preset.id]);
                     categorySection.appendChild(presetItem);
                 });
                 
-                content.appendChild(categorySection);
+                resultsDiv.appendChild(categorySection);
             });
+            
+            // Пагинация
+            if (pageData.pages > 1) {
+                const pagination = document.createElement("div");
+                pagination.style.cssText = `display: flex; align-items: center; justify-content: center; gap: 12px; margin-top: 8px;`;
+                
+                const makePageButton = (label, page, enabled) => {
+                    const button = document.createElement("button");
+                    button.textContent = label;
+                    button.disabled = !enabled;
+                    button.style.cssText = `
+                        padding: 6px 14px;
+                        border: none;
+                        border-radius: 5px;
+                        background: ${enabled ? "#3b82f6" : "#444"};
+                        color: white;
+                        cursor: ${enabled ? "pointer" : "not-allowed"};
+                    `;
+                    button.onclick = () => {
+                        listQuery.page = page;
+                        resultsDiv.refreshResults();
+                    };
+                    return button;
+                };
+                
+                const pageInfo = document.createElement("span");
+                pageInfo.textContent = `Page ${pageData.page} of ${pageData.pages} (${pageData.total} presets)`;
+                pageInfo.style.cssText = `color: #ccc; font-size: 14px;`;
+                
+                pagination.appendChild(makePageButton("← Prev", pageData.page - 1, pageData.page > 1));
+                pagination.appendChild(pageInfo);
+                pagination.appendChild(makePageButton("Next →", pageData.page + 1, pageData.page < pageData.pages));
+                resultsDiv.appendChild(pagination);
+            }
         }
         
         // Функция для создания элемента пресета
-        function createPresetItem(preset) {
+        function createPresetItem(preset, installStatus = null) {
             const item = document.createElement("div");
             item.style.cssText = `
                         background: #1a1a1a;
@@ -649,6 +807,24 @@ app.registerExtension({
                         font-weight: bold;
                 margin-bottom: 4px;
             `;
+            // Статус установки моделей пресета
+            if (installStatus && installStatus.models.length > 0) {
+                const badge = document.createElement("span");
+                badge.textContent = installStatus.installed ? "✓ installed" : `${installStatus.missing} missing`;
+                badge.title = installStatus.models
+                    .map(model => `${model.installed ? "✓" : "✗"} ${model.path}`)
+                    .join("\n");
+                badge.style.cssText = `
+                    margin-left: 8px;
+                    padding: 1px 6px;
+                    border-radius: 4px;
+                    font-size: 11px;
+                    font-weight: normal;
+                    background: ${installStatus.installed ? "rgba(95, 255, 95, 0.15)" : "rgba(255, 170, 0, 0.15)"};
+                    color: ${installStatus.installed ? "#5f5" : "#fa0"};
+                `;
+                name.appendChild(badge);
+            }
             info.appendChild(name);
             
             const details = document.createElement("div");
@@ -794,117 +970,28 @@ app.registerExtension({
             button.style.cursor = "not-allowed";
             
             const totalModels = models.length;
-            let successCount = 0;
-            let errorCount = 0;
-            const errors = [];
             
             // Создаём модальное окно прогресса
             const progressModal = createProgressModal(preset.name || preset.id, totalModels);
             
             try {
-                // Загружаем каждую модель последовательно
-                for (let i = 0; i < models.length; i++) {
-                    const model = models[i];
-                    
-                    // Обновляем прогресс перед началом загрузки
-                    const modelDisplayName = model.direct_url ? (model.direct_url.split('/').pop() || "Direct URL") : model.model_id;
-                    updateProgressModal(progressModal, i + 1, totalModels, modelDisplayName);
-                    
-                    try {
-                        const downloadData = {
-                            save_path: model.save_path,
-                            hf_token: model.hf_token || ""  // Опциональный API ключ
-                        };
-                        
-                        if (model.direct_url) {
-                            downloadData.direct_url = model.direct_url;
-                        } else {
-                            downloadData.model_id = model.model_id;
-                            downloadData.model_path = model.model_path || "";
-                        }
-                        
-                        const modelDisplayName = model.direct_url ? (model.direct_url.split('/').pop() || "Direct URL") : model.model_id;
-                        
-                        const response = await api.fetchApi("/preset_download_manager/download", {
-                            method: "POST",
-                            headers: { "Content-Type": "application/json" },
-                            body: JSON.stringify(downloadData)
-                        });
-                        
-                        // Проверяем статус ответа
-                        if (!response.ok) {
-                            const errorText = await response.text();
-                            throw new Error(`HTTP ${response.status}: ${errorText.substring(0, 200)}`);
-                        }
-                        
-                        // Проверяем Content-Type перед парсингом JSON
-                        const contentType = response.headers.get("content-type") || "";
-                        let result;
-                        
-                        if (contentType.includes("application/json")) {
-                            try {
-                                result = await response.json();
-                            } catch (jsonError) {
-                                // Если не удалось распарсить JSON, но статус OK, возможно файл скачался
-                                // Проверяем, может быть это был успешный ответ, но с неправильным Content-Type
-                                const text = await response.text();
-                                console.warn("[PresetDownloadManager] Failed to parse JSON, but status was OK. Response:", text.substring(0, 200));
-                                // Пытаемся извлечь информацию из текста или считаем успешным
-                                throw new Error(`Server returned non-JSON response (${contentType}). File may have been downloaded successfully. Check the file location.`);
-                            }
-                        } else {
-                            // Если сервер вернул не JSON, но статус OK, возможно файл скачался
-                            // Читаем текст для диагностики
-                            const text = await response.text();
-                            console.warn("[PresetDownloadManager] Server returned non-JSON response:", contentType, text.substring(0, 200));
-                            
-                            // Если статус был OK, возможно файл все-таки скачался
-                            // Но мы не можем это проверить с frontend, поэтому выдаем ошибку
-                            throw new Error(`Server returned ${contentType} instead of JSON. File may have been downloaded successfully. Check the file location. Response preview: ${text.substring(0, 200)}`);
-                        }
-                        
-                        if (result.status === "success") {
-                            // Обновляем прогресс с путем сохранения
-                            if (result.path) {
-                                let progressText = result.path;
-                                if (result.message) {
-                                    progressText += ` (${result.message})`;
-                                }
-                                updateProgressModal(progressModal, i + 1, totalModels, modelDisplayName, progressText);
-                            }
-                            successCount++;
-                } else {
-                            errorCount++;
-                            // Улучшаем сообщение об ошибке для пользователя
-                            let errorMsg = result.message || "Unknown error";
-                            if (errorMsg.includes("Timeout") || errorMsg.includes("timed out")) {
-                                errorMsg = "Timeout: загрузка заняла слишком много времени. Попробуйте снова - загрузка автоматически возобновится.";
-                            } else if (errorMsg.includes("Connection")) {
-                                errorMsg = "Ошибка соединения: проверьте интернет-соединение.";
-                            }
-                            errors.push({
-                                model: modelDisplayName,
-                                error: errorMsg
-                            });
-                        }
-                    } catch (error) {
-                        errorCount++;
-                        const modelDisplayName = model.direct_url ? (model.direct_url.split('/').pop() || "Direct URL") : model.model_id;
-                        errors.push({
-                            model: modelDisplayName,
-                            error: error.message || "Network error"
-                        });
-                    }
-                }
+                // Ставим все модели в очередь загрузок на сервере и ждём завершения
+                const entries = models.map(model => ({
+                    model: model,
+                    label: getModelDisplayName(model)
+                }));
+                const { successCount, errors, unknownCount } = await runDownloadJobs(entries, progressModal);
+                const errorCount = errors.length;
+                const unknownText = unknownCount > 0 ? `, ${unknownCount} finished with unknown status` : "";
                 
                 // Закрываем модальное окно прогресса
                 closeProgressModal(progressModal);
                 
                 // Показываем результат
                 if (errorCount === 0) {
-                    showToast(`Successfully downloaded ${successCount} model(s) from preset "${preset.name || preset.id}"`, "success", 5000);
+                    showToast(`Successfully downloaded ${successCount} model(s) from preset "${preset.name || preset.id}"${unknownText}`, "success", 5000);
                 } else {
-                    let errorMsg = `Downloaded ${successCount} of ${totalModels} model(s). Errors: `;
+                    let errorMsg = `Downloaded ${successCount} of ${totalModels} model(s)${unknownText}. Errors: `;
                     const errorList = errors.map(err => `${err.model}: ${err.error}`).join("; ");
                     errorMsg += errorList;
                     showToast(errorMsg, "error", 8000);
@@ -921,6 +1008,184 @@ app.registerExtension({
             }
         }
         
+        // Отображаемое имя модели пресета
+        function getModelDisplayName(model) {
+            return model.direct_url ? (model.direct_url.split('/').pop() || "Direct URL") : model.model_id;
+        }
+
+        // Формирует параметры загрузки для API из модели пресета
+        function buildDownloadData(model) {
+            // Дополнительные поля модели (sha256, size и т.д.) передаём как есть
+            const { direct_url, model_id, model_path, ...extra } = model;
+            const downloadData = {
+                ...extra,
+                save_path: model.save_path,
+                hf_token: model.hf_token || ""  // Опциональный API ключ
+            };
+
+            if (model.direct_url) {
+                downloadData.direct_url = model.direct_url;
+            } else {
+                downloadData.model_id = model.model_id;
+                downloadData.model_path = model.model_path || "";
+            }
+
+            return downloadData;
+        }
+
+        // Форматирует размер в байтах для отображения
+        function formatBytes(bytes) {
+            if (!bytes) return "0 B";
+            const units = ["B", "KB", "MB", "GB", "TB"];
+            const index = Math.min(Math.floor(Math.log(bytes) / Math.log(1024)), units.length - 1);
+            return `${(bytes / Math.pow(1024, index)).toFixed(index === 0 ? 0 : 1)} ${units[index]}`;
+        }
+
+        // Форматирует длительность в секундах (ETA)
+        function formatDuration(seconds) {
+            if (seconds === null || seconds === undefined) return "—";
+            seconds = Math.round(seconds);
+            const hours = Math.floor(seconds / 3600);
+            const minutes = Math.floor((seconds % 3600) / 60);
+            const secs = seconds % 60;
+            if (hours > 0) return `${hours}h ${minutes}m`;
+            if (minutes > 0) return `${minutes}m ${secs}s`;
+            return `${secs}s`;
+        }
+
+        // Показывает суммарную скорость и объём по выполняющимся загрузкам
+        function updateTransferStats(progressModal, progressByJob) {
+            let downloaded = 0;
+            let total = 0;
+            let speed = 0;
+            let running = 0;
+            for (const progress of progressByJob.values()) {
+                if (progress.status !== "running") continue;
+                running++;
+                downloaded += progress.downloaded || 0;
+                total += progress.total || 0;
+                speed += progress.smoothed_speed || 0;
+            }
+
+            if (running === 0) {
+                progressModal.speedText.textContent = "";
+                return;
+            }
+
+            const eta = total > downloaded && speed > 0 ? (total - downloaded) / speed : null;
+            const sizeText = total > 0 ? `${formatBytes(downloaded)} / ${formatBytes(total)}` : formatBytes(downloaded);
+            progressModal.speedText.textContent = `${sizeText} — ${formatBytes(speed)}/s — ETA ${formatDuration(eta)} (${running} active)`;
+        }
+
+        // Ставит модели в очередь загрузок на сервере и ждёт завершения всех задач.
+        // Прогресс приходит через websocket, а опрос списка задач служит fallback'ом.
+        // entries: [{ model, label, preset? }]
+        // jobs — задачи, уже поставленные в очередь (например, планом загрузки), по одной на entry
+        async function runDownloadJobs(entries, progressModal, jobs = null) {
+            if (!jobs) {
+                const response = await api.fetchApi("/preset_download_manager/jobs", {
+                    method: "POST",
+                    headers: { "Content-Type": "application/json" },
+                    body: JSON.stringify({ models: entries.map(entry => buildDownloadData(entry.model)) })
+                });
+
+                if (!response.ok) {
+                    const errorText = await response.text();
+                    throw new Error(`HTTP ${response.status}: ${errorText.substring(0, 200)}`);
+                }
+
+                jobs = (await response.json()).jobs;
+            }
+
+            // Одинаковые модели сервер объединяет в одну задачу, поэтому ID могут повторяться
+            const pending = jobs.map((job, index) => ({ id: job.id, entry: entries[index] }));
+            const total = entries.length;
+            let finished = 0;
+            let successCount = 0;
+            let unknownCount = 0;
+            const errors = [];
+
+            const progressByJob = new Map();
+            const onProgress = (event) => {
+                const progress = event.detail;
+                if (!progress || !pending.some(item => item.id === progress.job_id)) return;
+                progressByJob.set(progress.job_id, progress);
+                updateTransferStats(progressModal, progressByJob);
+            };
+            api.addEventListener("preset_download_manager.progress", onProgress);
+
+            updateProgressModal(progressModal, 0, total, `${total} model(s) queued`);
+
+            try {
+                while (pending.length > 0) {
+                    await new Promise(resolve => setTimeout(resolve, 1000));
+
+                    let jobsById = new Map();
+                    try {
+                        const listResponse = await api.fetchApi("/preset_download_manager/jobs");
+                        const listData = await listResponse.json();
+                        jobsById = new Map(listData.jobs.map(job => [job.id, job]));
+                        for (const job of listData.jobs) {
+                            if (job.progress && pending.some(item => item.id === job.id)) {
+                                progressByJob.set(job.id, job.progress);
+                            }
+                        }
+                        updateTransferStats(progressModal, progressByJob);
+                    } catch (error) {
+                        // Временная ошибка опроса — пробуем на следующей итерации
+                        console.warn("[PresetDownloadManager] Failed to poll download jobs:", error);
+                        continue;
+                    }
+
+                    for (let i = pending.length - 1; i >= 0; i--) {
+                        const { id, entry } = pending[i];
+                        const job = jobsById.get(id);
+                        if (job && (job.status === "queued" || job.status === "running")) {
+                            continue;
+                        }
+
+                        pending.splice(i, 1);
+                        progressByJob.delete(id);
+                        finished++;
+
+                        if (!job) {
+                            // Задачи уже нет в списке: сервер удаляет только завершённые, но результат неизвестен
+                            unknownCount++;
+                            updateProgressModal(progressModal, finished, total, entry.label, "finished (status unavailable)");
+                        } else if (job.status === "completed") {
+                            successCount++;
+                            let progressText = null;
+                            if (job.result && job.result.path) {
+                                progressText = job.result.path;
+                                if (job.result.message) {
+                                    progressText += ` (${job.result.message})`;
+                                }
+                            }
+                            updateProgressModal(progressModal, finished, total, entry.label, progressText);
+                        } else {
+                            // Улучшаем сообщение об ошибке для пользователя
+                            let errorMsg = job.error || (job.status === "cancelled" ? "Cancelled" : "Unknown error");
+                            if (errorMsg.includes("Timeout") || errorMsg.includes("timed out")) {
+                                errorMsg = "Timeout: загрузка заняла слишком много времени. Попробуйте снова - загрузка автоматически возобновится.";
+                            } else if (errorMsg.includes("Connection")) {
+                                errorMsg = "Ошибка соединения: проверьте интернет-соединение.";
+                            }
+                            errors.push({
+                                preset: entry.preset,
+                                model: entry.label,
+                                error: errorMsg
+                            });
+                            updateProgressModal(progressModal, finished, total, entry.label);
+                        }
+                    }
+                }
+            } finally {
+                api.removeEventListener("preset_download_manager.progress", onProgress);
+            }
+
+            return { successCount, errors, unknownCount };
+        }
+
         // Функция для создания модального окна прогресса
         function createProgressModal(presetName, totalModels) {
             const overlay = document.createElement("div");
@@ -1008,6 +1273,17 @@ app.registerExtension({
             progressBarContainer.appendChild(progressBar);
             modal.appendChild(progressBarContainer);
             
+            // Скорость, объём и оставшееся время по активным загрузкам
+            const speedText = document.createElement("div");
+            speedText.id = "download-speed-text";
+            speedText.textContent = ``;
+            speedText.style.cssText = `
+                color: #aaa;
+                font-size: 12px;
+                font-family: monospace;
+            `;
+            modal.appendChild(speedText);
+            
             overlay.appendChild(modal);
             document.body.appendChild(overlay);
             
@@ -1016,7 +1292,8 @@ app.registerExtension({
                 modal: modal,
                 progressText: progressText,
                 progressBar: progressBar,
-                pathText: pathText
+                pathText: pathText,
+                speedText: speedText
             };
         }
         
@@ -1043,6 +1320,34 @@ app.registerExtension({
             }
         }
         
+        // Запрашивает план загрузки выбранных пресетов и сразу ставит его в очередь.
+        // Если места на диске не хватает, сервер возвращает 507 с планом — спрашиваем, продолжать ли.
+        async function requestDownloadPlan(presetIds, force = false) {
+            const response = await api.fetchApi("/preset_download_manager/plan", {
+                method: "POST",
+                headers: { "Content-Type": "application/json" },
+                body: JSON.stringify({
+                    preset_ids: Array.from(presetIds),
+                    order: "largest",
+                    execute: true,
+                    force: force
+                })
+            });
+            const result = await response.json();
+            if (response.status === 507 && !force) {
+                const shortages = result.plan.filesystems
+                    .filter(fs => !fs.ok)
+                    .map(fs => `${fs.path}: need ${formatBytes(fs.required_with_buffer)}, free ${formatBytes(fs.free_bytes)}`)
+                    .join("; ");
+                const confirmed = await showConfirmDialog(`Not enough free disk space (${shortages}). Start downloads anyway?`);
+                return confirmed ? requestDownloadPlan(presetIds, true) : null;
+            }
+            if (!response.ok) {
+                throw new Error(result.message || `HTTP ${response.status}`);
+            }
+            return result;
+        }
+        
         // Функция для загрузки выбранных пресетов
         async function downloadSelectedPresets(selectedPresetIds) {
             if (selectedPresetIds.size === 0) {
@@ -1050,153 +1355,54 @@ app.registerExtension({
                 return;
             }
 
-            // Загружаем все пресеты
-            let presetsData = { categories: [], presets: [] };
+            // Сервер составляет план: общие для пресетов модели скачиваются один раз,
+            // уже скачанные пропускаются, место на диске проверяется сразу для всего набора
+            let result;
             try {
-                const response = await api.fetchApi("/preset_download_manager/presets");
-                presetsData = await response.json();
-                                } catch (error) {
-                showToast("Error loading presets: " + error.message, "error");
+                result = await requestDownloadPlan(selectedPresetIds);
+            } catch (error) {
+                showToast(`Error planning downloads: ${error.message}`, "error");
                 return;
             }
-            
-            // Фильтруем выбранные пресеты
-            const selectedPresets = presetsData.presets.filter(p => selectedPresetIds.has(p.id));
-            
-            if (selectedPresets.length === 0) {
-                showToast("No presets found", "warning");
+            if (!result) {
                 return;
             }
-            
-            // Подсчитываем общее количество моделей
-            let totalModels = 0;
-            selectedPresets.forEach(preset => {
-                const models = preset.models || (preset.model_id ? [{
-                    model_id: preset.model_id,
-                    model_path: preset.model_path || "",
-                    save_path: preset.save_path || "checkpoints",
-                    hf_token: preset.hf_token || ""
-                }] : []);
-                totalModels += models.length;
-            });
-            
-            if (totalModels === 0) {
-                showToast("No models to download in selected presets", "warning");
+
+            const plan = result.plan;
+            if (plan.downloads.length === 0) {
+                showToast(
+                    plan.present.length > 0
+                        ? `All ${plan.present.length} model(s) of the selected presets are already downloaded`
+                        : "No models to download in selected presets",
+                    plan.present.length > 0 ? "success" : "warning"
+                );
                 return;
             }
             
-            // Создаём модальное окно прогресса
-            const progressModal = createProgressModal(`${selectedPresets.length} preset(s)`, totalModels);
-            
-            let currentModel = 0;
-            let successCount = 0;
-            let errorCount = 0;
-            const errors = [];
+            const totalModels = plan.downloads.length;
+            const sizeText = plan.total_bytes ? `, ${formatBytes(plan.total_bytes)}` : "";
+            const progressModal = createProgressModal(`${selectedPresetIds.size} preset(s)${sizeText}`, totalModels);
             
             try {
-                // Загружаем модели из каждого пресета
-                for (const preset of selectedPresets) {
-                    const models = preset.models || (preset.model_id ? [{
-                        model_id: preset.model_id,
-                        model_path: preset.model_path || "",
-                        save_path: preset.save_path || "checkpoints",
-                        hf_token: preset.hf_token || ""
-                    }] : []);
-                    
-                    for (const model of models) {
-                        currentModel++;
-                        const modelDisplayName = model.direct_url ? (model.direct_url.split('/').pop() || "Direct URL") : model.model_id;
-                        updateProgressModal(progressModal, currentModel, totalModels, `${modelDisplayName} (${preset.name})`);
-                        
-                        try {
-                            const downloadData = {
-                                save_path: model.save_path,
-                                hf_token: model.hf_token || ""  // Опциональный API ключ
-                            };
-                            
-                            if (model.direct_url) {
-                                downloadData.direct_url = model.direct_url;
-                            } else {
-                                downloadData.model_id = model.model_id;
-                                downloadData.model_path = model.model_path || "";
-                            }
-                            
-                            const response = await api.fetchApi("/preset_download_manager/download", {
-                                method: "POST",
-                                headers: { "Content-Type": "application/json" },
-                                body: JSON.stringify(downloadData)
-                            });
-                            
-                            // Проверяем статус ответа
-                            if (!response.ok) {
-                                const errorText = await response.text();
-                                throw new Error(`HTTP ${response.status}: ${errorText.substring(0, 200)}`);
-                            }
-                            
-                            // Проверяем Content-Type перед парсингом JSON
-                            const contentType = response.headers.get("content-type") || "";
-                            let result;
-                            
-                            if (contentType.includes("application/json")) {
-                                try {
-                                    result = await response.json();
-                                } catch (jsonError) {
-                                    // Если не удалось распарсить JSON, но статус OK, возможно файл скачался
-                                    const text = await response.text();
-                                    console.warn("[PresetDownloadManager] Failed to parse JSON, but status was OK. Response:", text.substring(0, 200));
-                                    throw new Error(`Server returned non-JSON response (${contentType}). File may have been downloaded successfully. Check the file location.`);
-                                }
-                            } else {
-                                // Если сервер вернул не JSON, но статус OK, возможно файл скачался
-                                const text = await response.text();
-                                console.warn("[PresetDownloadManager] Server returned non-JSON response:", contentType, text.substring(0, 200));
-                                throw new Error(`Server returned ${contentType} instead of JSON. File may have been downloaded successfully. Check the file location. Response preview: ${text.substring(0, 200)}`);
-                            }
-                            
-                            if (result.status === "success") {
-                                // Обновляем прогресс с путем сохранения
-                                if (result.path) {
-                                    let progressText = result.path;
-                                    if (result.message) {
-                                        progressText += ` (${result.message})`;
-                                    }
-                                    updateProgressModal(progressModal, currentModel, totalModels, `${modelDisplayName} (${preset.name})`, progressText);
-                                }
-                                successCount++;
-                            } else {
-                                errorCount++;
-                                // Улучшаем сообщение об ошибке для пользователя
-                                let errorMsg = result.message || "Unknown error";
-                                if (errorMsg.includes("Timeout") || errorMsg.includes("timed out")) {
-                                    errorMsg = "Timeout: загрузка заняла слишком много времени. Попробуйте снова - загрузка автоматически возобновится.";
-                                } else if (errorMsg.includes("Connection")) {
-                                    errorMsg = "Ошибка соединения: проверьте интернет-соединение.";
-                                }
-                                errors.push({
-                                    preset: preset.name || preset.id,
-                                    model: modelDisplayName,
-                                    error: errorMsg
-                                });
-                            }
-                        } catch (error) {
-                            errorCount++;
-                            errors.push({
-                                preset: preset.name || preset.id,
-                                model: model.model_id,
-                                error: error.message || "Network error"
-                            });
-                        }
-                    }
-                }
+                const entries = plan.downloads.map(item => ({
+                    model: item.model,
+                    label: getModelDisplayName(item.model),
+                    preset: item.presets.join(", ")
+                }));
+                
+                const { successCount, errors, unknownCount } = await runDownloadJobs(entries, progressModal, result.jobs);
+                const errorCount = errors.length;
+                const unknownText = unknownCount > 0 ? `, ${unknownCount} finished with unknown status` : "";
                 
                 // Закрываем модальное окно прогресса
                 closeProgressModal(progressModal);
                 
                 // Показываем результат
+                const skippedText = plan.present.length > 0 ? ` (${plan.present.length} already downloaded)` : "";
                 if (errorCount === 0) {
-                    showToast(`Successfully downloaded ${successCount} model(s) from ${selectedPresets.length} preset(s)`, "success", 5000);
+                    showToast(`Successfully downloaded ${successCount} model(s) from ${selectedPresetIds.size} preset(s)${skippedText}${unknownText}`, "success", 5000);
                 } else {
-                    let errorMsg = `Downloaded ${successCount} of ${totalModels} model(s). Errors: `;
+                    let errorMsg = `Downloaded ${successCount} of ${totalModels} model(s)${unknownText}. Errors: `;
                     const errorList = errors.map(err => `${err.preset}/${err.model}: ${err.error}`).join("; ");
                     errorMsg += errorList;
                     showToast(errorMsg, "error", 8000);
@@ -1213,6 +1419,7 @@ app.registerExtension({
         // Функция для редактирования пресета
         function editPreset(preset) {
             editingPresetId = preset.id;
+            editingPresetVersion = preset.version || 1;
             currentView = 'add';
             
             const content = document.getElementById("preset-manager-content");
@@ -1231,6 +1438,8 @@ app.registerExtension({
             const modelItem = document.createElement("div");
             modelItem.className = "model-item";
             modelItem.dataset.index = modelIndex;
+            // Исходные данные модели: поля, которых нет в форме, сохраняются при редактировании
+            modelItem.presetModel = modelData;
             modelItem.style.cssText = `
                         background: #1a1a1a;
                         border: 2px solid #444;
@@ -1375,6 +1584,48 @@ app.registerExtension({
             modelPathGroup.appendChild(modelPathInput);
             modelItem.appendChild(modelPathGroup);
             
+            // Ревизия и фильтр файлов репозитория (опционально, для HuggingFace)
+            const repoOptionsGroup = document.createElement("div");
+            repoOptionsGroup.style.cssText = `display: flex; flex-direction: column; gap: 6px;`;
+            const repoOptionsLabel = document.createElement("label");
+            repoOptionsLabel.textContent = "Revision and file filter (optional)";
+            repoOptionsLabel.style.cssText = `color: white; font-size: 14px; font-weight: bold;`;
+            const repoOptionInputStyle = `
+                padding: 10px;
+                background: #1a1a1a;
+                border: 1px solid #444;
+                border-radius: 5px;
+                color: white;
+                font-size: 14px;
+            `;
+            const formatPatterns = (value) => Array.isArray(value) ? value.join(", ") : (value || "");
+            const revisionInput = document.createElement("input");
+            revisionInput.type = "text";
+            revisionInput.className = "model-revision-input";
+            revisionInput.dataset.index = modelIndex;
+            revisionInput.placeholder = "Branch, tag or commit (default: main)";
+            revisionInput.value = modelData ? modelData.revision || "" : "";
+            revisionInput.style.cssText = repoOptionInputStyle;
+            const allowPatternsInput = document.createElement("input");
+            allowPatternsInput.type = "text";
+            allowPatternsInput.className = "model-allow-patterns-input";
+            allowPatternsInput.dataset.index = modelIndex;
+            allowPatternsInput.placeholder = "Only these files, e.g. *.safetensors, *.json (whole repository only)";
+            allowPatternsInput.value = modelData ? formatPatterns(modelData.allow_patterns) : "";
+            allowPatternsInput.style.cssText = repoOptionInputStyle;
+            const ignorePatternsInput = document.createElement("input");
+            ignorePatternsInput.type = "text";
+            ignorePatternsInput.className = "model-ignore-patterns-input";
+            ignorePatternsInput.dataset.index = modelIndex;
+            ignorePatternsInput.placeholder = "Skip these files, e.g. *.onnx, *fp32*, *.png (whole repository only)";
+            ignorePatternsInput.value = modelData ? formatPatterns(modelData.ignore_patterns) : "";
+            ignorePatternsInput.style.cssText = repoOptionInputStyle;
+            repoOptionsGroup.appendChild(repoOptionsLabel);
+            repoOptionsGroup.appendChild(revisionInput);
+            repoOptionsGroup.appendChild(allowPatternsInput);
+            repoOptionsGroup.appendChild(ignorePatternsInput);
+            modelItem.appendChild(repoOptionsGroup);
+            
             // Функция для переключения видимости полей
             const updateSourceTypeVisibility = () => {
                 const useHf = useHfRepoCheckbox.checked;
@@ -1382,6 +1633,7 @@ app.registerExtension({
                 directUrlGroup.style.display = useHf ? "none" : "flex";
                 modelIdGroup.style.display = useHf ? "flex" : "none";
                 modelPathGroup.style.display = useHf ? "flex" : "none";
+                repoOptionsGroup.style.display = useHf ? "flex" : "none";
                 // Обновляем обязательность полей
                 if (useHf) {
                     directUrlInput.required = false;
@@ -1496,6 +1748,61 @@ app.registerExtension({
             hfTokenGroup.appendChild(hfTokenInput);
             modelItem.appendChild(hfTokenGroup);
             
+            // SHA-256 для проверки скачанного файла (опционально)
+            const sha256Group = document.createElement("div");
+            sha256Group.style.cssText = `display: flex; flex-direction: column; gap: 6px; margin-top: 12px;`;
+            const sha256Label = document.createElement("label");
+            sha256Label.textContent = "SHA-256 (optional)";
+            sha256Label.style.cssText = `color: white; font-size: 14px; font-weight: bold;`;
+            const sha256Input = document.createElement("input");
+            sha256Input.type = "text";
+            sha256Input.className = "model-sha256-input";
+            sha256Input.dataset.index = modelIndex;
+            sha256Input.placeholder = "Verify the downloaded file (HF LFS files are verified automatically)";
+            sha256Input.value = modelData ? modelData.sha256 || "" : "";
+            sha256Input.style.cssText = `
+                padding: 10px;
+                background: #1a1a1a;
+                border: 1px solid #444;
+                border-radius: 5px;
+                color: white;
+                font-size: 14px;
+                font-family: monospace;
+            `;
+            sha256Group.appendChild(sha256Label);
+            sha256Group.appendChild(sha256Input);
+            modelItem.appendChild(sha256Group);
+            
+            // Зеркала: другие ссылки на тот же файл (для HuggingFace — адреса зеркал, как HF_ENDPOINT)
+            const mirrorsGroup = document.createElement("div");
+            mirrorsGroup.style.cssText = `display: flex; flex-direction: column; gap: 6px; margin-top: 12px;`;
+            const mirrorsLabel = document.createElement("label");
+            mirrorsLabel.textContent = "Mirrors (optional)";
+            mirrorsLabel.style.cssText = `color: white; font-size: 14px; font-weight: bold;`;
+            const mirrorsInput = document.createElement("input");
+            mirrorsInput.type = "text";
+            mirrorsInput.className = "model-mirrors-input";
+            mirrorsInput.dataset.index = modelIndex;
+            mirrorsInput.placeholder = "Comma-separated: other URLs of the same file, or mirror endpoints for HuggingFace";
+            const mirrors = modelData && Array.isArray(modelData.mirrors) ? modelData.mirrors : [];
+            mirrorsInput.value = mirrors
+                .map(mirror => typeof mirror === "string" ? mirror : (mirror.url || mirror.endpoint || ""))
+                .filter(mirror => mirror)
+                .join(", ");
+            // Исходное значение: если поле не меняли, зеркала из пресета сохраняются как есть
+            mirrorsInput.dataset.original = mirrorsInput.value;
+            mirrorsInput.style.cssText = `
+                padding: 10px;
+                background: #1a1a1a;
+                border: 1px solid #444;
+                border-radius: 5px;
+                color: white;
+                font-size: 14px;
+            `;
+            mirrorsGroup.appendChild(mirrorsLabel);
+            mirrorsGroup.appendChild(mirrorsInput);
+            modelItem.appendChild(mirrorsGroup);
+            
             return modelItem;
         }
         
@@ -1706,6 +2013,11 @@ app.registerExtension({
                 const savePathSelect = item.querySelector('.model-save-path-select');
                 const customPathInput = item.querySelector('.model-custom-path-input');
                 const hfTokenInput = item.querySelector('.model-hf-token-input');
+                const sha256Input = item.querySelector('.model-sha256-input');
+                const mirrorsInput = item.querySelector('.model-mirrors-input');
+                const revisionInput = item.querySelector('.model-revision-input');
+                const allowPatternsInput = item.querySelector('.model-allow-patterns-input');
+                const ignorePatternsInput = item.querySelector('.model-ignore-patterns-input');
                 
                 const useHfRepo = useHfRepoCheckbox ? useHfRepoCheckbox.checked : false;
                 const modelId = modelIdInput ? modelIdInput.value.trim() : "";
@@ -1713,6 +2025,7 @@ app.registerExtension({
                 const modelPath = modelPathInput ? modelPathInput.value.trim() : "";
                 let savePath = savePathSelect.value;
                 const hfToken = hfTokenInput ? hfTokenInput.value.trim() : "";
+                const sha256 = sha256Input ? sha256Input.value.trim().toLowerCase() : "";
                 
                 // Если выбрана кастомная папка, берем значение из поля ввода
                 if (savePath === "__custom__") {
@@ -1739,14 +2052,45 @@ app.registerExtension({
                     }
                 }
                 
+                if (sha256 && !/^(sha256:)?[0-9a-f]{64}$/.test(sha256)) {
+                    errorMsg.textContent = `Model #${parseInt(item.dataset.index) + 1}: SHA-256 must be 64 hex characters`;
+                    if (sha256Input) sha256Input.focus();
+                    return;
+                }
+                
+                // Поля, которых нет в форме (size и т.д.), берём из исходной модели
+                const {
+                    direct_url, model_id, model_path, sha256: oldSha256,
+                    revision: oldRevision, allow_patterns, ignore_patterns, mirrors: oldMirrors, ...extra
+                } = item.presetModel || {};
                 const modelData = {
+                    ...extra,
                     save_path: savePath,
                     hf_token: hfToken || ""  // Опциональный API ключ
                 };
+                if (sha256) {
+                    modelData.sha256 = sha256;
+                }
+                const mirrorsText = mirrorsInput ? mirrorsInput.value.trim() : "";
+                if (mirrorsInput && mirrorsText === mirrorsInput.dataset.original && Array.isArray(oldMirrors)) {
+                    if (oldMirrors.length > 0) modelData.mirrors = oldMirrors;
+                } else {
+                    const mirrors = mirrorsText.split(",").map(mirror => mirror.trim()).filter(mirror => mirror);
+                    if (mirrors.length > 0) modelData.mirrors = mirrors;
+                }
                 
                 if (useHfRepo) {
                     modelData.model_id = modelId;
                     modelData.model_path = modelPath || "";
+                    const parsePatterns = (input) => input
+                        ? input.value.split(",").map(pattern => pattern.trim()).filter(pattern => pattern)
+                        : [];
+                    const revision = revisionInput ? revisionInput.value.trim() : "";
+                    const allowPatterns = parsePatterns(allowPatternsInput);
+                    const ignorePatterns = parsePatterns(ignorePatternsInput);
+                    if (revision) modelData.revision = revision;
+                    if (allowPatterns.length > 0) modelData.allow_patterns = allowPatterns;
+                    if (ignorePatterns.length > 0) modelData.ignore_patterns = ignorePatterns;
                 } else {
                     modelData.direct_url = directUrl;
                 }
@@ -1762,52 +2106,33 @@ app.registerExtension({
             
             errorMsg.textContent = "";
             
-            // Загружаем текущие пресеты
-            let presetsData = { categories: [], presets: [] };
-            try {
-                const response = await api.fetchApi("/preset_download_manager/presets");
-                presetsData = await response.json();
-            } catch (error) {
-                console.error("[PresetDownloadManager] Ошибка загрузки пресетов:", error);
-            }
-            
-            // Если редактируем существующий пресет, обновляем его
-            if (editingPresetId) {
-                const presetIndex = presetsData.presets.findIndex(p => p.id === editingPresetId);
-                if (presetIndex !== -1) {
-                    // Обновляем существующий пресет
-                    presetsData.presets[presetIndex] = {
-                        id: editingPresetId,
-                        name: name,
-                        category: category || "Uncategorized",
-                        models: models
-                    };
-                } else {
-                    errorMsg.textContent = "Preset not found";
-                    return;
-                }
-            } else {
-                // Создаём новый пресет
-                const newPreset = {
-                    id: `preset-${Date.now()}`,
-                    name: name,
-                    category: category || "Uncategorized",
-                    models: models
-                };
-                
-                presetsData.presets.push(newPreset);
-            }
+            // Сохраняем только этот пресет: существующий — с проверкой версии, новый — создаём
+            const presetFields = {
+                name: name,
+                category: category || "Uncategorized",
+                models: models
+            };
+            const presetId = editingPresetId || `preset-${Date.now()}`;
             
-            // Сохраняем
             try {
-                const response = await api.fetchApi("/preset_download_manager/presets", {
-                                method: "POST",
-                                headers: { "Content-Type": "application/json" },
-                    body: JSON.stringify(presetsData)
+                const response = await api.fetchApi(`/preset_download_manager/presets/${encodeURIComponent(presetId)}`, {
+                    method: editingPresetId ? "PATCH" : "PUT",
+                    headers: { "Content-Type": "application/json" },
+                    body: JSON.stringify(editingPresetId ? { ...presetFields, version: editingPresetVersion } : presetFields)
                 });
                 
                 const result = await response.json();
                 
+                if (response.status === 404) {
+                    errorMsg.textContent = "Preset not found";
+                    return;
+                }
+                if (response.status === 409) {
+                    errorMsg.textContent = "This preset was changed in another window. Close the form and open it again to see the latest version.";
+                    showToast("Preset was changed in another window", "warning", 5000);
+                    return;
+                }
+                
                 // Показываем сообщение о результате сохранения
                 if (result.status === "success") {
                     showToast("Preset saved successfully! Your presets are saved in presets.json and will persist after ComfyUI restart.", "success", 5000);
@@ -1820,6 +2145,7 @@ app.registerExtension({
                 
                 // Сбрасываем режим редактирования и возвращаемся к списку
                 editingPresetId = null;
+                editingPresetVersion = null;
                 currentView = 'list';
                 const content = document.getElementById("preset-manager-content");
                 if (content) {
@@ -1838,23 +2164,15 @@ app.registerExtension({
         
         // Функция для удаления пресета
         async function deletePreset(presetId) {
-            let presetsData = { categories: [], presets: [] };
             try {
-                const response = await api.fetchApi("/preset_download_manager/presets");
-                presetsData = await response.json();
-                } catch (error) {
-                console.error("[PresetDownloadManager] Ошибка загрузки пресетов:", error);
-                return;
-            }
-            
-            presetsData.presets = presetsData.presets.filter(p => p.id !== presetId);
-            
-            try {
-                await api.fetchApi("/preset_download_manager/presets", {
-                    method: "POST",
-                    headers: { "Content-Type": "application/json" },
-                    body: JSON.stringify(presetsData)
+                const response = await api.fetchApi(`/preset_download_manager/presets/${encodeURIComponent(presetId)}`, {
+                    method: "DELETE"
                 });
+                // 404 — пресет уже удалён (например, в другой вкладке)
+                if (!response.ok && response.status !== 404) {
+                    const result = await response.json();
+                    throw new Error(result.message || `HTTP ${response.status}`);
+                }
             } catch (error) {
                 console.error("[PresetDownloadManager] Ошибка удаления пресета:", error);
                 showToast("Error deleting preset: " + error.message, "error");
@@ -2666,6 +2984,8 @@ app.registerExtension({
             try {
                 // Загружаем текущие пресеты
                 const response = await api.fetchApi("/preset_download_manager/presets");
+                // ETag документа: сохранение не перезапишет изменения, сделанные после открытия редактора
+                const etag = response.headers.get("ETag");
                 const data = await response.json();
                 const jsonText = JSON.stringify(data, null, 2);
                 
@@ -2907,12 +3227,19 @@ app.registerExtension({
                     
                     try {
                         const parsed = JSON.parse(textarea.value);
+                        const headers = { "Content-Type": "application/json" };
+                        if (etag) {
+                            headers["If-Match"] = etag;
+                        }
                         const response = await api.fetchApi("/preset_download_manager/presets", {
                             method: "POST",
-                            headers: { "Content-Type": "application/json" },
+                            headers: headers,
                             body: JSON.stringify(parsed)
                         });
                         
+                        if (response.status === 412) {
+                            throw new Error("Presets were changed in another window. Close the editor and open it again.");
+                        }
                         if (response.ok) {
                             validationMsg.style.color = "#5f5";
                             validationMsg.style.background = "rgba(95, 255, 95, 0.1)";
@@ -3125,16 +3452,22 @@ function updateDeleteButton() {
                         const text = await file.text();
                         try {
                             const data = JSON.parse(text);
-                            await api.fetchApi("/preset_download_manager/presets", {
+                            // Импортированные пресеты добавляются к существующим (с теми же ID — пропускаются)
+                            const response = await api.fetchApi("/preset_download_manager/presets/import", {
                                 method: "POST",
                                 headers: { "Content-Type": "application/json" },
                                 body: JSON.stringify(data)
                             });
+                            const result = await response.json();
+                            if (!response.ok) {
+                                throw new Error(result.message || `HTTP ${response.status}`);
+                            }
                             const content = document.getElementById("preset-manager-content");
                             if (content) {
                                 await renderListView(content);
                             }
-                            showToast("Presets imported successfully!", "success", 3000);
+                            const skipped = result.skipped ? `, ${result.skipped} already present` : "";
+                            showToast(`Imported ${result.added} preset(s)${skipped}`, "success", 3000);
                         } catch (error) {
                             showToast("Error importing presets: " + error.message, "error");
                         }